@@ -0,0 +1,218 @@
+# SPDX-License-Identifier: MPL-2.0
+"""Benchmark building synthetic Sphinx projects with sphinx-exec-jupyter.
+
+Each scenario generates a project of ``--pages`` pages with ``--directives``
+directives each (every directive executes one cell of ``--lines`` statements),
+and builds it ``--repeat`` times from scratch in a fresh ``sphinx-build`` process.
+Scenarios cover forked vs exec-launched kernels (``SPHINX_EXEC_JUPYTER_FORK``),
+light vs heavy preload code, and plain vs ``holoviews`` directives.
+
+Per scenario, the median over repeats of these metrics is reported:
+
+``build_seconds``
+    wall time of the whole ``sphinx-build`` run
+``startup_seconds``
+    time from requesting a kernel until it replied to ``kernel_info``, per document
+``cells_per_second`` / ``documents_per_second``
+    executed cells and documents per second of build time
+``peak_rss_mib``
+    peak resident memory of the largest process in the build
+
+Results are written as JSON (``--output``), and compared to a previous run’s
+results if ``--baseline`` is given::
+
+    python benchmarks/run-benchmarks.py --output baseline.json
+    # … change things …
+    python benchmarks/run-benchmarks.py --baseline baseline.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from itertools import product
+from pathlib import Path
+from textwrap import indent
+from typing import TYPE_CHECKING, TypedDict, cast
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+    from typing import Literal
+
+
+PRELOADS = dict(
+    light="import math\n",
+    heavy="import numpy as np\nimport matplotlib.pyplot as plt\n",
+)
+KINDS = ("plain", "holoviews")
+FORK = dict(on="1", off="0")
+TIMINGS_FILE = "exec-jupyter-timings.json"
+STARTUP_PHASES = ("server", "launch", "kernel_info")
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """What kind of kernels, preload code, and directives to benchmark."""
+
+    fork: Literal["on", "off"]
+    preload: Literal["light", "heavy"]
+    kind: Literal["plain", "holoviews"]
+
+    @property
+    def name(self) -> str:
+        """Key of the scenario’s results."""
+        return f"fork={self.fork},preload={self.preload},kind={self.kind}"
+
+
+class Metrics(TypedDict):
+    """Results of a scenario, see the module docstring."""
+
+    build_seconds: float
+    startup_seconds: float
+    cells_per_second: float
+    documents_per_second: float
+    peak_rss_mib: float
+
+
+#: Metrics where less is better, the others are better when higher
+LOWER_IS_BETTER = {"build_seconds", "startup_seconds", "peak_rss_mib"}
+
+
+def write_project(
+    path: Path, scenario: Scenario, *, pages: int, directives: int, lines: int
+) -> int:
+    """Write a Sphinx project for ``scenario`` to ``path``, return its cell count."""
+    conf = dict(
+        extensions=["sphinx_exec_jupyter"],
+        exec_jupyter_code=PRELOADS[scenario.preload],
+        exec_jupyter_timing_report=1,
+    )
+    (path / "conf.py").write_text(
+        "".join(f"{k} = {v!r}\n" for k, v in conf.items()), encoding="utf-8"
+    )
+    names = [f"page{i}" for i in range(pages)]
+    toctree = indent("\n".join(names), "    ")
+    (path / "index.rst").write_text(
+        f"Benchmark\n=========\n\n..  toctree::\n\n{toctree}\n", encoding="utf-8"
+    )
+    for name in names:
+        blocks = [f"{name}\n{'=' * len(name)}\n"]
+        for d in range(directives):
+            body = [f"x{d}_{i} = sum(range({i}))" for i in range(lines)]
+            if scenario.kind == "holoviews":
+                directive, body = "holoviews", [*body, f"hv.Curve([{d}, {lines}])"]
+            else:
+                directive, body = "exec-jupyter", [*body, f"print(x{d}_0)"]
+            blocks.append(f"..  {directive}::\n\n{indent('\n'.join(body), '    ')}\n")
+        (path / f"{name}.rst").write_text("\n".join(blocks), encoding="utf-8")
+    return pages * directives
+
+
+def build(src: Path, out: Path, scenario: Scenario) -> tuple[float, float]:
+    """Build ``src`` from scratch, return wall time and peak RSS in MiB."""
+    env = {**os.environ, "SPHINX_EXEC_JUPYTER_FORK": FORK[scenario.fork]}
+    cmd = [sys.executable, "-m", "sphinx", "-E", "-q", "-b", "html", src, out]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env)  # noqa: S603
+    # unlike `proc.wait()`, `wait4` reports the resource usage of just this build
+    _, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    # kibibytes on Linux, bytes on macOS
+    rss = usage.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    return seconds, rss
+
+
+def run_scenario(
+    scenario: Scenario, *, pages: int, directives: int, lines: int, repeat: int
+) -> Metrics:
+    """Build a project for ``scenario`` ``repeat`` times, return median metrics."""
+    runs: list[Metrics] = []
+    with tempfile.TemporaryDirectory(prefix="sej-bench-") as d:
+        src, out = Path(d) / "src", Path(d) / "out"
+        src.mkdir()
+        n_cells = write_project(
+            src, scenario, pages=pages, directives=directives, lines=lines
+        )
+        for _ in range(repeat):
+            seconds, rss = build(src, out, scenario)
+            timings = json.loads((out / TIMINGS_FILE).read_text())["documents"]
+            startups = [
+                sum(doc["phases"].get(p, 0) for p in STARTUP_PHASES)
+                for doc in timings.values()
+            ]
+            runs.append(
+                Metrics(
+                    build_seconds=seconds,
+                    startup_seconds=statistics.median(startups),
+                    cells_per_second=n_cells / seconds,
+                    documents_per_second=len(timings) / seconds,
+                    peak_rss_mib=rss,
+                )
+            )
+    return cast("Metrics", {k: statistics.median(r[k] for r in runs) for k in runs[0]})
+
+
+def compare(results: dict[str, Metrics], baseline: dict[str, Metrics]) -> str:
+    """Format ``results`` as a table, with changes relative to ``baseline``."""
+    lines = []
+    for name, metrics in results.items():
+        lines.append(name)
+        for key, value in metrics.items():
+            line = f"  {key:<22}{value:10.3f}"
+            if (old := baseline.get(name, {}).get(key)) is not None and old:
+                change = (value - old) / old
+                better = (change < 0) == (key in LOWER_IS_BETTER)
+                line += f"  {change:+7.1%} {'better' if better else 'worse'}"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--directives", type=int, default=5, help="per page")
+    parser.add_argument("--lines", type=int, default=10, help="per directive")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fork", nargs="+", choices=FORK, default=list(FORK))
+    parser.add_argument("--preload", nargs="+", choices=PRELOADS, default=["light"])
+    parser.add_argument("--kind", nargs="+", choices=KINDS, default=["plain"])
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON results to compare to")
+    return parser.parse_args(argv)
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    """Run all selected scenarios, print and optionally save their results."""
+    args = parse_args(argv)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else {}
+    results: dict[str, Metrics] = {}
+    for fork, preload, kind in product(args.fork, args.preload, args.kind):
+        scenario = Scenario(fork, preload, kind)
+        print(f"running {scenario.name} …", file=sys.stderr)
+        results[scenario.name] = run_scenario(
+            scenario,
+            pages=args.pages,
+            directives=args.directives,
+            lines=args.lines,
+            repeat=args.repeat,
+        )
+    print(compare(results, baseline.get("results", {})))
+    if args.output:
+        params = {k: getattr(args, k) for k in ("pages", "directives", "lines")}
+        data = dict(params=params, results=results)
+        args.output.write_text(json.dumps(data, indent=2) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
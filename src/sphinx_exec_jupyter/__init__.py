@@ -5,35 +5,92 @@ from __future__ import annotations
 
 from contextlib import suppress
 from importlib.metadata import version
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, cast
 
+from sphinx.config import ENUM
 from sphinx.errors import ExtensionError
 from sphinx.util.typing import ExtensionMetadata
 
+from ._assets import clear_assets
+from ._blobs import externalize_outputs, restore_outputs
+from ._cache import evict_cache, log_stats, merge_stats, reset_stats
 from ._directive import ExecJupyterDirective
-from ._kernel_mgr import maybe_patch_myst_nb
+from ._kernel_mgr import (
+    ForkingKernelSpecManager,
+    ForkingProvisioner,
+    call_in_server_loop,
+    maybe_patch_myst_nb,
+    prestart_fork_server,
+)
+from ._memory import merge_memory, report_memory, reset_memory
 from ._pending import PendingExecNode
-from ._resolve import ExecPendingNodes
+from ._resolve import ExecPendingNodes, resolve_deferred
+from ._schedule import start_scheduler, stop_scheduler
+from ._timing import merge_timings, report_timings, reset_timings
 
 if TYPE_CHECKING:
     from sphinx.application import Sphinx
     from sphinx.config import Config
+    from sphinx.environment import BuildEnvironment
+
+    from ._kernel_mgr import KernelLimits
 
 
 __all__ = ["ExecJupyterDirective", "setup"]
 
 
-def setup(app: Sphinx) -> ExtensionMetadata:
+def setup(app: Sphinx) -> ExtensionMetadata:  # noqa: PLR0915
     """Add directive(s) and settings to Sphinx."""
     app.setup_extension("myst_nb")
     app.add_config_value("exec_jupyter_code", "", "env")
     app.add_config_value("exec_jupyter_kernel", "python3", "env")
     app.add_config_value("exec_jupyter_isolate_per_document", True, "env")  # noqa: FBT003
     app.add_config_value("exec_jupyter_patch_myst_nb", True, "env")  # noqa: FBT003
+    app.add_config_value("exec_jupyter_kernel_pool_size", 0, "", {int})
+    app.add_config_value("exec_jupyter_max_workers", 0, "", {int})
+    app.add_config_value("exec_jupyter_max_fork_servers", 0, "", {int})
+    app.add_config_value("exec_jupyter_fork_servers_max_memory", 0, "", {int})
+    app.add_config_value("exec_jupyter_fork_server_daemon", 0, "", {int})
+    app.add_config_value("exec_jupyter_kernel_max_memory", 0, "env", {int})
+    app.add_config_value("exec_jupyter_kernel_max_cpu_time", 0, "env", {int})
+    app.add_config_value("exec_jupyter_kernel_max_wall_time", 0, "env", {int})
+    app.add_config_value("exec_jupyter_gc_freeze", False, "", {bool})  # noqa: FBT003
+    app.add_config_value("exec_jupyter_prestart_fork_servers", True, "", {bool})  # noqa: FBT003
+    app.add_config_value("exec_jupyter_kernel_transport", "ipc", "", ENUM("ipc", "tcp"))
+    app.add_config_value("exec_jupyter_cache", False, "", {bool})  # noqa: FBT003
+    app.add_config_value("exec_jupyter_cache_path", "", "", {str})
+    app.add_config_value("exec_jupyter_cache_max_size", 2**29, "", {int})
+    app.add_config_value("exec_jupyter_timing_report", 0, "", {int})
+    app.add_config_value("exec_jupyter_memory_report", 0, "", {int})
+    app.add_config_value("exec_jupyter_profile_preload", 0, "", {int})
+    app.add_config_value("exec_jupyter_max_cell_output", 0, "env", {int})
+    app.add_config_value("exec_jupyter_max_document_output", 0, "env", {int})
+    app.add_config_value("exec_jupyter_spill_outputs", False, "env", {bool})  # noqa: FBT003
+    app.add_config_value("exec_jupyter_external_output_size", 0, "env", {int})
     app.add_directive("exec-jupyter", ExecJupyterDirective)
     app.add_node(PendingExecNode)
     app.add_transform(ExecPendingNodes)
     app.connect("config-inited", _maybe_patch_myst_nb)
+    app.connect("config-inited", _configure_fork_servers)
+    app.connect("config-inited", _prestart_fork_servers)
+    app.connect("env-before-read-docs", _share_fork_servers)
+    app.connect("env-before-read-docs", reset_stats)
+    app.connect("env-before-read-docs", reset_timings)
+    app.connect("env-before-read-docs", reset_memory)
+    app.connect("env-merge-info", merge_stats)
+    app.connect("env-merge-info", merge_timings)
+    app.connect("env-merge-info", merge_memory)
+    app.connect("builder-inited", start_scheduler)
+    app.connect("doctree-read", externalize_outputs)
+    app.connect("env-updated", resolve_deferred)
+    app.connect("doctree-resolved", restore_outputs)
+    app.connect("build-finished", stop_scheduler)
+    app.connect("build-finished", _shutdown_fork_servers)
+    app.connect("build-finished", log_stats)
+    app.connect("build-finished", evict_cache)
+    app.connect("build-finished", report_timings)
+    app.connect("build-finished", report_memory)
+    app.connect("build-finished", clear_assets)
 
     with suppress(ExtensionError):
         app.setup_extension("sphinx_exec_jupyter.holoviews")
@@ -56,3 +113,52 @@ def _maybe_patch_myst_nb(app: Sphinx, config: Config) -> None:
             ctx.__exit__(type(exc), exc, exc.__traceback__)
 
     app.connect("build-finished", cleanup)
+
+
+def _configure_fork_servers(app: Sphinx, config: Config) -> None:  # noqa: ARG001
+    servers = ForkingProvisioner.SERVERS
+    servers.max_servers = config.exec_jupyter_max_fork_servers
+    servers.max_memory = config.exec_jupyter_fork_servers_max_memory
+    servers.daemon_timeout = config.exec_jupyter_fork_server_daemon
+    servers.gc_freeze = config.exec_jupyter_gc_freeze
+    servers.transport = config.exec_jupyter_kernel_transport
+    servers.measure_memory = config.exec_jupyter_memory_report > 0
+    servers.profile_preload = config.exec_jupyter_profile_preload
+    limits = dict(
+        memory=config.exec_jupyter_kernel_max_memory,
+        cpu_time=config.exec_jupyter_kernel_max_cpu_time,
+        wall_time=config.exec_jupyter_kernel_max_wall_time,
+    )
+    servers.kernel_limits = cast(
+        "KernelLimits", {name: limit for name, limit in limits.items() if limit}
+    )
+
+
+def _prestart_fork_servers(app: Sphinx, config: Config) -> None:
+    """Let the preload code run while Sphinx sets up and reads the first documents."""
+    if not config.exec_jupyter_prestart_fork_servers:
+        return
+    if config.nb_execution_mode == "off":
+        return
+    if app.parallel > 1:  # start the servers parallel readers will share
+        call_in_server_loop(ForkingProvisioner.SERVERS.share)
+    prestart_fork_server(
+        config.exec_jupyter_code,
+        config.exec_jupyter_kernel,
+        config.exec_jupyter_kernel_pool_size,
+    )
+
+
+def _share_fork_servers(
+    app: Sphinx,
+    env: BuildEnvironment,  # noqa: ARG001
+    docnames: list[str],  # noqa: ARG001
+) -> None:
+    """Let parallel readers fork kernels off the same servers."""
+    if app.parallel > 1:
+        call_in_server_loop(ForkingProvisioner.SERVERS.share)
+
+
+def _shutdown_fork_servers(app: Sphinx, exc: Exception | None) -> None:  # noqa: ARG001
+    call_in_server_loop(ForkingProvisioner.SERVERS.shutdown)
+    ForkingKernelSpecManager.specs.clear()  # kernels may be installed until next build
@@ -0,0 +1,75 @@
+# SPDX-License-Identifier: MPL-2.0
+"""Content-addressed store for image outputs shared across documents.
+
+myst_nb already names image files after a hash of their content,
+but decodes, hashes, and looks for the file again for every single output.
+Here identical outputs (a logo, a recurring diagnostic plot) are rendered
+once per build: later outputs get a copy of the node referring to the same file,
+so the file is written and its dimensions are measured only once.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from docutils import nodes
+    from myst_nb.core.render import MimeData, NbElementRenderer
+    from sphinx.application import Sphinx
+
+
+__all__ = ["clear_assets", "render_image"]
+
+
+#: Rendered image nodes by output folder, source folder, content, and options
+_RENDERED: dict[tuple[str, str, str, str], nodes.Element] = {}
+
+
+def render_image(
+    renderer: NbElementRenderer,
+    data: MimeData,
+    finish: Callable[[nodes.Element, MimeData], None] | None = None,
+) -> nodes.Element:
+    """Render an image output, reusing the node of an identical earlier output.
+
+    ``finish`` is called on newly rendered nodes, e.g. to add their dimensions.
+    """
+    key = _asset_key(renderer, data)
+    if key is None or (node := _RENDERED.get(key)) is None:
+        [node] = renderer.render_image(data)
+        if finish is not None:
+            finish(node, data)
+        if key is None:
+            return node
+        _RENDERED[key] = node
+    return node.deepcopy()
+
+
+def clear_assets(app: Sphinx, exc: Exception | None) -> None:  # noqa: ARG001
+    _RENDERED.clear()
+
+
+def _asset_key(
+    renderer: NbElementRenderer, data: MimeData
+) -> tuple[str, str, str, str] | None:
+    """Identify what ``data`` renders to, or return None if it can’t be shared.
+
+    Images are only written to files (and therefore shareable) in Sphinx builds.
+    """
+    env = renderer.renderer.sphinx_env
+    if env is None or not renderer.config.output_folder:
+        return None
+    content = data.content
+    digest = hashlib.blake2b(
+        content.encode() if isinstance(content, str) else content, digest_size=16
+    ).hexdigest()
+    options = renderer.renderer.get_cell_level_config(
+        "render_image_options", data.cell_metadata, line=data.line
+    )
+    metadata = data.output_metadata.get(data.mime_type, {})
+    attrs = json.dumps([data.mime_type, options, metadata], sort_keys=True, default=str)
+    return renderer.config.output_folder, str(env.srcdir), digest, attrs
@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: MPL-2.0
+"""Keep large raw outputs out of pickled doctrees.
+
+Raw outputs (HTML reprs, JavaScript, …) of at least
+``exec_jupyter_external_output_size`` characters are moved to a
+content-addressed blob store next to the doctrees.
+Their nodes only keep the blob’s name until the doctree is resolved for writing,
+so pickling doctrees and sending them between parallel readers stays cheap.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import TYPE_CHECKING
+
+from docutils import nodes
+from sphinx.util import logging
+
+if TYPE_CHECKING:
+    from sphinx.application import Sphinx
+    from sphinx.environment import BuildEnvironment
+
+
+__all__ = ["BLOB_ATTR", "externalize_outputs", "restore_outputs"]
+
+logger = logging.getLogger(__name__)
+
+#: Attribute of raw nodes naming the blob their content was moved to
+BLOB_ATTR = "exec_jupyter_blob"
+
+
+def blob_dir(env: BuildEnvironment) -> Path:
+    return Path(env.doctreedir) / "exec_jupyter_blobs"
+
+
+def externalize_outputs(app: Sphinx, doctree: nodes.document) -> None:
+    """Move large raw cell outputs in ``doctree`` to the blob store."""
+    if not (min_size := app.config.exec_jupyter_external_output_size):
+        return
+    path = blob_dir(app.env)
+    for node in doctree.findall(_is_raw_output):
+        if BLOB_ATTR in node or len(text := node.astext()) < min_size:
+            continue
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        if not (blob := path / f"{digest}.txt").exists():
+            path.mkdir(parents=True, exist_ok=True)
+            # write atomically, parallel readers might produce the same output
+            with NamedTemporaryFile(
+                "w", dir=path, suffix=".tmp", delete=False, encoding="utf-8"
+            ) as f:
+                f.write(text)
+            Path(f.name).replace(blob)
+        node[BLOB_ATTR] = digest
+        node[:] = []
+
+
+def restore_outputs(app: Sphinx, doctree: nodes.document, docname: str) -> None:  # noqa: ARG001
+    """Put the content of externalized outputs back before writing."""
+    path = blob_dir(app.env)
+    for node in doctree.findall(nodes.raw):
+        if (digest := node.get(BLOB_ATTR)) is None:
+            continue
+        try:
+            text = (path / f"{digest}.txt").read_text(encoding="utf-8")
+        except FileNotFoundError:
+            msg = f"Output {digest} is missing, rebuild with -E to restore it"
+            logger.warning(msg, location=node, type="exec_jupyter", subtype="blob")
+            continue
+        del node[BLOB_ATTR]
+        node[:] = [nodes.Text(text)]
+
+
+def _is_raw_output(node: nodes.Node) -> bool:
+    if not isinstance(node, nodes.raw):
+        return False
+    parent = node.parent
+    while parent is not None:
+        if parent.get("nb_element") == "cell_code_output":
+            return True
+        parent = parent.parent
+    return False
@@ -0,0 +1,175 @@
+# SPDX-License-Identifier: MPL-2.0
+"""Persistent, content-addressed cache of executed notebooks."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sys
+from collections import Counter
+from contextlib import suppress
+from dataclasses import dataclass
+from functools import cache
+from importlib.metadata import distributions
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import TYPE_CHECKING, cast
+
+import nbformat
+from myst_nb._compat import get_env_app
+from sphinx.util import logging
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping
+    from collections.abc import Set as AbstractSet
+
+    from nbformat import NotebookNode
+    from sphinx.application import Sphinx
+    from sphinx.environment import BuildEnvironment
+
+    class CacheStatsEnv(BuildEnvironment):
+        exec_jupyter_cache_stats: Counter[str]
+
+
+__all__ = [
+    "ExecutionCache",
+    "cache_key",
+    "evict_cache",
+    "get_cache",
+    "record_cache_use",
+]
+
+logger = logging.getLogger(__name__)
+
+
+@cache
+def environment_fingerprint() -> str:
+    """Hash of the interpreter version and all installed distributions.
+
+    Installing, upgrading, or removing a package changes it,
+    so cached outputs are never reused with a different software stack.
+    """
+    dists = sorted(f"{d.name}=={d.version}" for d in distributions() if d.name)
+    return hashlib.sha256("\n".join([sys.version, *dists]).encode()).hexdigest()
+
+
+def cache_key(
+    cells: list[str],
+    *,
+    code: str,
+    kernel_name: str,
+    options: Mapping[str, object] | None = None,
+) -> str:
+    """Key for an executed notebook, covering everything that can change its outputs.
+
+    ``options`` are settings that change how outputs are kept,
+    e.g. output budgets.
+    """
+    data = dict(
+        cells=cells,
+        code=code,
+        kernel=kernel_name,
+        env=environment_fingerprint(),
+        options=dict(options or {}),
+    )
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class ExecutionCache:
+    """A directory of executed notebooks, evicting least recently used ones.
+
+    Entries are only evicted by :meth:`evict`, which lists the whole directory,
+    so it runs once per build (see :func:`evict_cache`), not on every :meth:`put`.
+
+    Attributes
+    ----------
+    path
+        Directory to store notebooks in
+    max_size
+        Total size in bytes above which the least recently used entries are dropped
+
+    """
+
+    path: Path
+    max_size: int
+
+    def __contains__(self, key: str) -> bool:
+        return (self.path / f"{key}.ipynb").is_file()
+
+    def get(self, key: str) -> NotebookNode | None:
+        entry = self.path / f"{key}.ipynb"
+        try:
+            nb = nbformat.reads(entry.read_text(encoding="utf-8"), as_version=4)
+        except (OSError, ValueError):  # missing or partially written by a crash
+            return None
+        with suppress(OSError):
+            entry.touch()  # mark as recently used
+        return nb
+
+    def put(self, key: str, nb: NotebookNode) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        # write atomically, parallel readers might look up the same key
+        with NamedTemporaryFile(
+            "w", dir=self.path, suffix=".tmp", delete=False, encoding="utf-8"
+        ) as f:
+            nbformat.write(nb, f)
+        Path(f.name).replace(self.path / f"{key}.ipynb")
+
+    def evict(self) -> None:
+        """Drop the least recently used entries until they fit into ``max_size``."""
+        entries: list[tuple[float, int, Path]] = []
+        for entry in self.path.glob("*.ipynb"):
+            with suppress(FileNotFoundError):  # evicted by another process
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry))
+        total = 0
+        for _, size, entry in sorted(entries, reverse=True):
+            total += size
+            if total > self.max_size:
+                entry.unlink(missing_ok=True)
+
+
+def get_cache(env: BuildEnvironment) -> ExecutionCache | None:
+    """Return the configured execution cache, or None if caching is disabled.
+
+    A relative ``exec_jupyter_cache_path`` is relative to the configuration directory.
+    """
+    if not env.config.exec_jupyter_cache:
+        return None
+    path = Path(env.doctreedir) / "exec-jupyter"
+    if cache_path := env.config.exec_jupyter_cache_path:
+        path = Path(get_env_app(env).confdir, cache_path)
+    return ExecutionCache(path, env.config.exec_jupyter_cache_max_size)
+
+
+def evict_cache(app: Sphinx, exc: Exception | None) -> None:  # noqa: ARG001
+    if (exec_cache := get_cache(app.env)) is not None:
+        exec_cache.evict()
+
+
+def record_cache_use(env: BuildEnvironment, *, hit: bool) -> None:
+    stats = cast("CacheStatsEnv", env).exec_jupyter_cache_stats
+    stats["hits" if hit else "misses"] += 1
+
+
+def reset_stats(app: Sphinx, env: BuildEnvironment, docnames: list[str]) -> None:  # noqa: ARG001
+    cast("CacheStatsEnv", env).exec_jupyter_cache_stats = Counter()
+
+
+def merge_stats(
+    app: Sphinx,  # noqa: ARG001
+    env: BuildEnvironment,
+    docnames: AbstractSet[str],  # noqa: ARG001
+    other: BuildEnvironment,
+) -> None:
+    stats = cast("CacheStatsEnv", env).exec_jupyter_cache_stats
+    stats.update(cast("CacheStatsEnv", other).exec_jupyter_cache_stats)
+
+
+def log_stats(app: Sphinx, exc: Exception | None) -> None:  # noqa: ARG001
+    stats = getattr(app.env, "exec_jupyter_cache_stats", Counter())
+    if stats.total():
+        logger.info(
+            "exec-jupyter cache: %d hits, %d misses", stats["hits"], stats["misses"]
+        )
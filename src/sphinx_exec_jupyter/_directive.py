@@ -3,9 +3,9 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
+from docutils.parsers.rst import directives
 from sphinx.util.docutils import SphinxDirective
 
-from ._kernel_mgr import maybe_patch_myst_nb
 from ._pending import PendingExecNode
 from .common import execute_cells
 
@@ -17,13 +17,17 @@ __all__ = ["ExecJupyterDirective"]
 
 
 class ExecJupyterDirective(SphinxDirective):
+    option_spec = dict(timeout=directives.nonnegative_int)  # noqa: RUF012
     has_content = True
 
     def run(self) -> list[nodes.Node]:
         code = "\n".join(self.content)
+        timeout = self.options.get("timeout")
         if self.config.exec_jupyter_isolate_per_document:
-            return [PendingExecNode(cells=[code], hv_backends=None)]
-        with maybe_patch_myst_nb(self.config):
-            return execute_cells(
-                [code], self.state.document, kernel_name=self.config.exec_jupyter_kernel
-            )
+            return [PendingExecNode(cells=[code], hv_backends=None, timeout=timeout)]
+        return execute_cells(
+            [code],
+            self.state.document,
+            kernel_name=self.config.exec_jupyter_kernel,
+            timeouts=[timeout],
+        )
@@ -0,0 +1,299 @@
+# SPDX-License-Identifier: MPL-2.0
+"""Execute notebooks with nbclient, keeping their outputs within a budget.
+
+Outputs are checked as they arrive, so a runaway cell can’t fill up memory:
+Consecutive stream outputs are coalesced, and once a cell or notebook
+exceeds its budget, further outputs are replaced with a marker.
+What doesn’t fit can be spilled to a side file instead of being dropped.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import partial
+from typing import TYPE_CHECKING, override
+
+from jupyter_cache.executors.utils import ExecutionResult
+from nbclient import NotebookClient
+from nbclient.exceptions import CellExecutionError, CellTimeoutError, DeadKernelError
+from traitlets import Instance
+
+from ._timing import ExecutionTimer
+
+if TYPE_CHECKING:
+    from collections.abc import Generator
+    from pathlib import Path
+
+    from myst_nb.core.config import NbParserConfig
+    from nbformat import NotebookNode
+
+    from ._kernel_mgr import ForkingKernelManager, LimitName
+    from ._memory import KernelMemory
+
+
+__all__ = [
+    "DocumentOutput",
+    "ExecutionMonitor",
+    "OutputBudget",
+    "Overflow",
+    "cell_timeout",
+    "current_monitor",
+    "execute_notebook",
+    "notebook_client",
+]
+
+
+#: Output types that count against the budget. Errors are always kept.
+BUDGETED = frozenset({"stream", "display_data", "execute_result"})
+
+
+@dataclass
+class Overflow:
+    """Outputs of a cell that didn’t fit into the budget.
+
+    Attributes
+    ----------
+    cell_index
+        Index of the cell in the notebook
+    size
+        Number of characters that were cut
+    path
+        Side file the cut outputs were written to, if any
+
+    """
+
+    cell_index: int
+    size: int = 0
+    path: Path | None = None
+    #: names of streams that already end in a truncation marker
+    marked: set[str] = field(default_factory=set, repr=False)
+
+
+@dataclass
+class DocumentOutput:
+    """Outputs of all notebooks a document executed so far.
+
+    Attributes
+    ----------
+    size
+        Number of characters the notebooks output
+    notebooks
+        Number of notebooks that were given a budget
+
+    """
+
+    size: int = 0
+    notebooks: int = 0
+
+
+@dataclass
+class OutputBudget:
+    """Limits on the size of outputs a notebook produces, in characters.
+
+    ``0`` means no limit. ``max_document`` applies to all notebooks
+    sharing ``document``. If ``spill_dir`` is given, outputs that don’t fit
+    are written to files in it, named after ``name`` and ``notebook``.
+    """
+
+    max_cell: int = 0
+    max_document: int = 0
+    spill_dir: Path | None = None
+    name: str = "notebook"
+    document: DocumentOutput = field(default_factory=DocumentOutput)
+    #: Number of the notebook among those of ``document``
+    notebook: int = 0
+    overflows: dict[int, Overflow] = field(default_factory=dict)
+    _cell_sizes: dict[int, int] = field(init=False, default_factory=dict)
+
+    def add(self, outs: list[NotebookNode], cell_index: int) -> NotebookNode:
+        """Account for the output that was just appended to ``outs``.
+
+        It is coalesced with the previous output if both are the same stream,
+        and truncated if it doesn’t fit into the budget.
+        Returns the output that ends up last in ``outs``.
+        """
+        out = outs[-1]
+        if len(outs) == 1:  # previous outputs were cleared
+            self.document.size -= self._cell_sizes.pop(cell_index, 0)
+            if overflow := self.overflows.get(cell_index):
+                overflow.marked.clear()
+        if out.output_type not in BUDGETED:
+            return out
+
+        size, text = _output_size(out), ""
+        if out.output_type == "stream":
+            if len(outs) > 1 and _same_stream(outs[-2], out):
+                outs.pop()
+                outs[-1].text += out.text
+                out = outs[-1]
+                text = out.text[-size:] if size else ""
+            else:
+                text = out.text
+        remaining = self._remaining(cell_index)
+        if remaining is None or size <= remaining:
+            self._charge(cell_index, size)
+            return out
+
+        overflow = self.overflows.setdefault(cell_index, Overflow(cell_index))
+        overflow.size += size - remaining
+        self._charge(cell_index, remaining)
+        if out.output_type == "stream":
+            out.text = out.text[: len(out.text) - size + remaining]
+            self._spill(overflow, text[remaining:])
+            if out.name not in overflow.marked:
+                overflow.marked.add(out.name)
+                out.text += self._marker(overflow)
+        else:
+            self._spill(overflow, json.dumps(out.get("data", {})) + "\n")
+            out.data = {"text/plain": self._marker(overflow).strip()}
+            out.metadata = {}
+        return out
+
+    @property
+    def size(self) -> int:
+        """Number of characters this notebook output, not counting what was cut."""
+        return sum(self._cell_sizes.values())
+
+    def charge_cached(self, size: int) -> None:
+        """Account for the outputs of a cached notebook against the document."""
+        self.document.size += size
+
+    def _remaining(self, cell_index: int) -> int | None:
+        limits = []
+        if self.max_cell:
+            limits.append(self.max_cell - self._cell_sizes.get(cell_index, 0))
+        if self.max_document:
+            limits.append(self.max_document - self.document.size)
+        return max(min(limits), 0) if limits else None
+
+    def _charge(self, cell_index: int, size: int) -> None:
+        self._cell_sizes[cell_index] = self._cell_sizes.get(cell_index, 0) + size
+        self.document.size += size
+
+    def _spill(self, overflow: Overflow, text: str) -> None:
+        if self.spill_dir is None or not text:
+            return
+        if overflow.path is None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            name = f"{self.name}-{self.notebook}-{overflow.cell_index}.txt"
+            overflow.path = self.spill_dir / name
+            overflow.path.write_text("", encoding="utf-8")
+        with overflow.path.open("a", encoding="utf-8") as f:
+            f.write(text)
+
+    def _marker(self, overflow: Overflow) -> str:
+        where = f", see {overflow.path}" if overflow.path else ""
+        return f"\n[… output truncated to fit the output budget{where}]\n"
+
+
+def _output_size(out: NotebookNode) -> int:
+    if out.output_type == "stream":
+        return len(out.text)
+    return sum(
+        len(v if isinstance(v, str) else json.dumps(v)) for v in out.data.values()
+    )
+
+
+def _same_stream(a: NotebookNode, b: NotebookNode) -> bool:
+    return a.get("output_type") == "stream" and a.get("name") == b.get("name")
+
+
+@dataclass
+class ExecutionMonitor:
+    """Observes a notebook’s execution: how long it takes and how much it outputs.
+
+    Also records if its kernel was killed for exceeding a resource limit,
+    and how much memory its kernels used (see :mod:`sphinx_exec_jupyter._memory`).
+    """
+
+    timer: ExecutionTimer = field(default_factory=ExecutionTimer)
+    budget: OutputBudget = field(default_factory=OutputBudget)
+    exceeded: LimitName | None = None
+    memory: list[KernelMemory] = field(default_factory=list)
+
+    @contextmanager
+    def active(self) -> Generator[None]:
+        """Let kernels launched in this context report to this monitor and its timer."""
+        token = _CURRENT.set(self)
+        try:
+            with self.timer.active():
+                yield
+        finally:
+            _CURRENT.reset(token)
+
+
+_CURRENT: ContextVar[ExecutionMonitor | None] = ContextVar(
+    "exec_jupyter_monitor", default=None
+)
+
+
+def current_monitor() -> ExecutionMonitor | None:
+    """Return the monitor of the notebook executing now, if any."""
+    return _CURRENT.get()
+
+
+class BudgetedNotebookClient(NotebookClient):
+    """Notebook client that keeps outputs within an :class:`OutputBudget`."""
+
+    budget = Instance(OutputBudget, allow_none=True)
+
+    @override
+    def output(
+        self,
+        outs: list[NotebookNode],
+        msg: dict[str, object],
+        display_id: str | None,
+        cell_index: int,
+    ) -> NotebookNode | None:
+        out = super().output(outs, msg, display_id, cell_index)
+        if out is None or self.budget is None:
+            return out
+        return self.budget.add(outs, cell_index)
+
+
+def notebook_client(
+    notebook: NotebookNode,
+    *,
+    cwd: str,
+    nb_config: NbParserConfig,
+    monitor: ExecutionMonitor,
+    km_class: type[ForkingKernelManager] | None = None,
+) -> BudgetedNotebookClient:
+    """Create a client that executes ``notebook`` in place like myst_nb would."""
+    kwargs: dict[str, object] = {}
+    if km_class is not None:
+        kwargs["kernel_manager_class"] = km_class
+    return BudgetedNotebookClient(
+        notebook,
+        timeout=nb_config.execution_timeout,
+        timeout_func=partial(cell_timeout, default=nb_config.execution_timeout),
+        allow_errors=nb_config.execution_allow_errors,
+        record_timing=False,
+        resources=dict(metadata=dict(path=cwd)),
+        budget=monitor.budget,
+        **monitor.timer.hooks(),
+        **kwargs,
+    )
+
+
+def cell_timeout(cell: NotebookNode, *, default: int | None) -> int | None:
+    """Timeout of a cell in seconds: its own (see `_python_notebook`) or ``default``."""
+    return cell.metadata.get("exec_jupyter", {}).get("timeout", default)
+
+
+async def execute_notebook(client: NotebookClient) -> ExecutionResult:
+    """Execute a client’s notebook, like `single_nb_execution` but async."""
+    err = exc_string = None
+    start = time.perf_counter()
+    try:
+        await client.async_execute()
+    except (CellExecutionError, CellTimeoutError, DeadKernelError) as e:
+        err, exc_string = e, traceback.format_exc()
+    runtime = time.perf_counter() - start
+    cwd = client.resources["metadata"]["path"]
+    return ExecutionResult(client.nb, cwd, runtime, err, exc_string)
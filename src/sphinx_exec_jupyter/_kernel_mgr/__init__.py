@@ -3,52 +3,89 @@
 
 from __future__ import annotations
 
+import hashlib
 import importlib.resources
 import json
 import os
+import shutil
 import signal
+import socket
 import sys
 import tempfile
-from asyncio import Lock
-from asyncio.subprocess import PIPE, create_subprocess_exec
+from asyncio import (
+    Lock,
+    StreamReader,
+    StreamReaderProtocol,
+    StreamWriter,
+    create_task,
+    get_running_loop,
+    new_event_loop,
+    open_unix_connection,
+    run_coroutine_threadsafe,
+    to_thread,
+)
+from collections import OrderedDict
 from contextlib import ExitStack, suppress
 from dataclasses import KW_ONLY, dataclass, field
-from functools import wraps
+from functools import partial
+from itertools import count
 from pathlib import Path
+from subprocess import DEVNULL, PIPE, Popen
+from threading import Thread
 from typing import TYPE_CHECKING, ClassVar, TypedDict, cast, overload, override
 
 from jupyter_client import LocalPortCache
-from jupyter_client.kernelspec import KernelSpec, KernelSpecManager
+from jupyter_client.connect import port_names
+from jupyter_client.kernelspec import KernelSpec, KernelSpecManager, NoSuchKernel
 from jupyter_client.manager import AsyncKernelManager
 from jupyter_client.provisioning.local_provisioner import LocalProvisioner
 from jupyter_client.provisioning.provisioner_base import KernelProvisionerBase
+from jupyter_core.paths import jupyter_runtime_dir
 from traitlets import Instance, default
 
+from .._cache import environment_fingerprint
+from .._execute import current_monitor
+from .._memory import measure_kernel
+from .._profile import report_profile
+from .._timing import mark
 from .myst import maybe_patch_myst_nb
 
 if TYPE_CHECKING:
-    from asyncio.subprocess import Process
-    from collections.abc import Awaitable, Callable, Sequence
-    from typing import Concatenate, Literal
+    from asyncio import AbstractEventLoop, Future, ReadTransport, Task
+    from collections.abc import Callable, Coroutine, Iterator, Sequence
+    from typing import Literal
 
     from jupyter_client import KernelConnectionInfo
     from traitlets import Unicode
 
+    from .._profile import PreloadProfile
+
 
 __all__ = [
     "FORK_ENV_VAR",
+    "LAYER_SEPARATOR",
     "Cmd",
+    "ForkServerRegistry",
     "ForkingKernelManager",
+    "ForkingKernelSpecManager",
+    "KernelLimits",
+    "LimitName",
+    "PooledKernel",
     "Resp",
+    "call_in_server_loop",
     "forking_supported",
+    "kernel_manager_class",
+    "layered",
     "maybe_patch_myst_nb",
+    "prestart_fork_server",
+    "run_in_server_loop",
+    "server_loop",
     "start_new_fork_kernel",
 ]
 
 
 FILES = importlib.resources.files(__name__)
 
-
 #: Environment variable to force-enable (``1``) or force-disable (``0``) the
 #: forking provisioner, overriding the platform default.
 FORK_ENV_VAR = "SPHINX_EXEC_JUPYTER_FORK"
@@ -71,10 +108,70 @@ def forking_supported() -> bool:
     return sys.platform != "darwin"
 
 
+#: Event loops that fork servers are used from, by process ID
+_LOOPS: dict[int, AbstractEventLoop] = {}
+
+
+def server_loop() -> AbstractEventLoop:
+    """Event loop in a daemon thread that the build uses fork servers from.
+
+    Servers are bound to the loop that connected to them,
+    and :class:`ForkServerRegistry` isn’t thread-safe,
+    so kernels are launched and servers shut down in this loop only,
+    see :func:`run_in_server_loop` and :func:`call_in_server_loop`.
+    It lives as long as the process. Forked processes get their own.
+    """
+    if (loop := _LOOPS.get(os.getpid())) is None:
+        loop = _LOOPS[os.getpid()] = new_event_loop()
+        name = "sphinx-exec-jupyter"
+        Thread(target=loop.run_forever, name=name, daemon=True).start()
+    return loop
+
+
+def run_in_server_loop[T](coro: Coroutine[object, object, T]) -> T:
+    """Run ``coro`` in :func:`server_loop`, and wait for its result."""
+    return run_coroutine_threadsafe(coro, server_loop()).result()
+
+
+def call_in_server_loop[**P, T](
+    func: Callable[P, T], *args: P.args, **kwargs: P.kwargs
+) -> T:
+    """Call ``func`` in the thread of :func:`server_loop`, and wait for its result."""
+
+    async def call() -> T:
+        return func(*args, **kwargs)
+
+    return run_in_server_loop(call())
+
+
+type LimitName = Literal["memory", "cpu_time", "wall_time"]
+
+
+class KernelLimits(TypedDict, total=False):
+    """Resource limits for forked kernels, see :class:`ForkServerRegistry`.
+
+    Attributes
+    ----------
+    memory
+        Maximum size of the kernel’s virtual memory in bytes (``RLIMIT_AS``)
+    cpu_time
+        Maximum CPU time of the kernel in seconds (``RLIMIT_CPU``)
+    wall_time
+        Seconds after which the fork server kills the kernel
+
+    """
+
+    memory: int
+    cpu_time: int
+    wall_time: int
+
+
 class ForkCmd(TypedDict):
     cmd: Literal["fork"]
     argv: Sequence[str]
-    log: str
+    limits: KernelLimits
+    #: the kernel’s connection info, if it isn’t in a connection file
+    connection: dict[str, int | str] | None
 
 
 class ForkResp(TypedDict):
@@ -88,6 +185,10 @@ class WaitExitCmd(TypedDict):
 
 class WaitExitResp(TypedDict):
     code: int
+    #: the limit the kernel was killed for exceeding, if any
+    limit: LimitName | None
+    #: the tail of the kernel’s stdout and stderr, if it exited with an error
+    output: str | None
 
 
 class ExitCodeCmd(TypedDict):
@@ -97,85 +198,710 @@ class ExitCodeCmd(TypedDict):
 
 class ExitCodeResp(TypedDict):
     code: int | None
+    limit: LimitName | None
+    output: str | None
+
+
+class SpawnCmd(TypedDict):
+    cmd: Literal["spawn"]
+    code: str
+    socket: str
+    pool_size: int
+
+
+class TakeCmd(TypedDict):
+    cmd: Literal["take"]
+    argv: Sequence[str]
+    limits: KernelLimits
+
 
+class ProfileCmd(TypedDict):
+    cmd: Literal["profile"]
+    #: how many modules and functions to report
+    top: int
 
-type Cmd = ForkCmd | WaitExitCmd | ExitCodeCmd
-type Resp = ForkResp | WaitExitResp | ExitCodeResp
+
+class ProfileResp(TypedDict):
+    #: ``None`` if the server wasn’t profiled or reported its profile already
+    profile: PreloadProfile | None
+
+
+class PooledKernel(TypedDict):
+    """A kernel that was forked and initialized before it was requested."""
+
+    pid: int
+    connection: dict[str, int | str]
+
+
+class TakeResp(TypedDict):
+    kernel: PooledKernel | None
+
+
+type Cmd = ForkCmd | WaitExitCmd | ExitCodeCmd | SpawnCmd | TakeCmd | ProfileCmd
+type Resp = ForkResp | WaitExitResp | ExitCodeResp | TakeResp | ProfileResp
 
 
 RUN_SERVER_CODE = (importlib.resources.files(__name__) / "fork-server.py").read_text()
 
+#: Separates layers of preload code, see :func:`layered`
+LAYER_SEPARATOR = "\n# sphinx-exec-jupyter: next preload layer\n"
 
-def _locked[**P, R](
-    method: Callable[Concatenate[KernelForkServer, P], Awaitable[R]],
-) -> Callable[Concatenate[KernelForkServer, P], Awaitable[R]]:
-    @wraps(method)
-    async def wrapper(self: KernelForkServer, *args: P.args, **kwargs: P.kwargs) -> R:
-        async with self._lock:
-            return await method(self, *args, **kwargs)
 
-    return wrapper
+def layered(*layers: str) -> str:
+    """Join preload code so that each layer runs in its own fork server.
+
+    The server for a preload is forked from the server for the preload
+    minus its last layer, so it only runs that layer,
+    and shares the memory of everything its parent imported.
+    Empty layers are skipped.
+    """
+    return LAYER_SEPARATOR.join(layer for layer in layers if layer)
+
+
+def daemon_path(
+    py_cmd: Sequence[str],
+    code: str,
+    pool_size: int,
+    directory: Path | None = None,
+    flags: Sequence[str] = (),
+) -> Path:
+    """Unix socket of the fork server daemon for this interpreter and preload.
+
+    The installed packages and the server’s ``flags`` are part of the name,
+    so a new daemon is started after they change.
+    ``directory`` defaults to one in the Jupyter runtime directory.
+    """
+    if directory is None:
+        directory = Path(jupyter_runtime_dir()) / "sphinx-exec-jupyter"
+    env = environment_fingerprint()
+    key = [*py_cmd, code, pool_size, *flags, RUN_SERVER_CODE, env]
+    digest = hashlib.sha256(json.dumps(key).encode()).hexdigest()[:16]
+    return directory / f"{digest}.sock"
+
+
+def stop_daemons(directory: Path) -> None:
+    """Stop the fork server daemons listening in ``directory``."""
+    for path in directory.glob("*.sock"):
+        with suppress(OSError, ValueError), socket.socket(socket.AF_UNIX) as sock:
+            sock.settimeout(5)
+            sock.connect(str(path))
+            hello = sock.makefile("rb").readline()
+            os.kill(json.loads(hello)["pid"], signal.SIGTERM)
+
+
+@dataclass
+class ServerConnection:
+    """How to talk to a running fork server."""
+
+    pid: int
+    reader: StreamReader
+    writer: StreamWriter
+    stderr: StreamReader | None = None
+    process: Popen[bytes] | None = None
+    #: Transports reading the server’s stdout and stderr
+    read_pipes: list[ReadTransport] = field(default_factory=list)
+
+    def close(self) -> None:
+        """Close the connection, including the pipes it reads from."""
+        self.writer.close()
+        for read_pipe in self.read_pipes:
+            read_pipe.close()
 
 
 @dataclass
 class KernelForkServer:
-    """A server that executes code and allows forking off kernels after."""
+    """A server that executes code and allows forking off kernels after.
+
+    Each command carries an ``id`` that the server copies into its reply.
+    Replies can arrive in any order (e.g. a ``wait`` for a kernel that takes
+    a while to die doesn’t hold up ``fork`` commands sent after it),
+    so many provisioners can share a server concurrently.
+
+    If ``parent`` is given, ``code`` has to be its code plus one more layer
+    (see :func:`layered`). The server is then forked from the parent server
+    and only runs that layer. Otherwise, it runs in a new Python process.
+
+    If ``pool_size`` is positive, the server keeps that many kernels
+    forked and initialized ahead of demand, which :meth:`take` hands out.
+
+    If ``daemon_timeout`` is positive, the server is a daemon that outlives
+    this process, so later builds can reuse it (see :func:`daemon_path`).
+    It exits after ``daemon_timeout`` seconds without clients.
+    If ``daemon_dir`` is given, the server is a daemon listening there instead,
+    which runs until stopped (see :func:`stop_daemons`) if ``daemon_timeout`` is 0.
+
+    If ``gc_freeze`` is true, the garbage collector is kept off the server’s heap:
+    It is disabled before running ``code`` and the resulting objects are frozen
+    (see :func:`gc.freeze`), so kernels don’t write to (and thereby copy)
+    the memory pages they share with the server. Kernels re-enable it.
+    Servers spawned from this one inherit the setting.
+
+    If ``profile`` is positive, the server runs ``code`` under :mod:`cProfile`,
+    and once it is started, the slowest ``profile`` modules to import
+    and functions to call are logged (see :mod:`sphinx_exec_jupyter._profile`).
+    A daemon’s profile is only logged by the first process to connect to it.
+    Servers spawned from this one inherit the setting.
+    """
 
     py_cmd: tuple[str, ...]
     code: str
-    process: Process | None = field(init=False, default=None)
-    # Prevent race conditions with multiple kernels
-    _lock: Lock = field(init=False, default_factory=Lock)
-
-    @_locked
-    async def fork(self, cmd: Sequence[str], log_path: str) -> int:
-        if self.process is None:
-            code = RUN_SERVER_CODE.replace('"USER_CODE_INSERTION_POINT"', self.code)
-            self.process = await create_subprocess_exec(
-                *self.py_cmd, "-c", code, stdin=PIPE, stdout=PIPE, stderr=PIPE
+    pool_size: int = 0
+    parent: KernelForkServer | None = None
+    daemon_timeout: float = 0
+    daemon_dir: Path | None = None
+    gc_freeze: bool = False
+    profile: int = 0
+    conn: ServerConnection | None = field(init=False, default=None)
+    #: PIDs of kernels handed out and not known to have exited
+    kernels: set[int] = field(init=False, default_factory=set)
+    #: Number of users that got the server from `ForkServerRegistry.get`
+    leases: int = field(init=False, default=0)
+    #: Limits that kernels were killed for exceeding, by PID
+    exceeded: dict[int, LimitName] = field(init=False, default_factory=dict)
+    #: Output of kernels that exited with an error, by PID
+    outputs: dict[int, str] = field(init=False, default_factory=dict)
+    _start_lock: Lock = field(init=False, default_factory=Lock)
+    #: Event loop that the connection to the server is bound to
+    _loop: AbstractEventLoop | None = field(init=False, default=None)
+    _ids: Iterator[int] = field(init=False, default_factory=count)
+    _pending: dict[int, Future[Resp]] = field(init=False, default_factory=dict)
+    _reader: Task[None] | None = field(init=False, default=None)
+    #: The server process, if launched before connecting to it (see :meth:`launch`)
+    _process: Popen[bytes] | None = field(init=False, default=None)
+    #: The process starting our daemon, if launched before connecting to it
+    _launcher: Popen[bytes] | None = field(init=False, default=None)
+    #: IDs of commands sent before connecting, and futures for their replies
+    _sent_early: dict[int, Future[Resp] | None] = field(
+        init=False, default_factory=dict
+    )
+    #: The parent’s spawn command ID and our socket, if spawned on launch
+    _prespawned: tuple[int, Path] | None = field(init=False, default=None)
+
+    def launch(self) -> None:
+        """Start the server’s process now, without waiting for its preload code.
+
+        :meth:`start` connects to it later, from whatever event loop runs then.
+        A server with a parent is spawned by the parent right after running
+        the parent’s code, if the parent is a server process launched this way
+        and not connected to yet. Otherwise, it is only spawned in :meth:`start`.
+        """
+        if self.conn is not None:
+            return
+        if self.parent is not None:
+            self.parent.launch()
+            self.parent._prespawn(self)  # noqa: SLF001
+        elif not self.is_daemon:
+            if self._process is None:
+                args = (str(self.pool_size), *self._flags)
+                cmd = self._server_cmd(*args)
+                self._process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)  # noqa: S603
+        elif self._launcher is None and not _listening(path := self._daemon_path()):
+            self._launcher = self._launch_daemon(path)
+
+    def _prespawn(self, child: KernelForkServer) -> None:
+        """Have our launched process spawn ``child``, unless we’re connected."""
+        process = self._process
+        if process is None or process.stdin is None:
+            return
+        if child.conn is not None or child._prespawned is not None:
+            return
+        path = Path(tempfile.mkdtemp(prefix="sej-")) / "server.sock"
+        req_id = next(self._ids)
+        cmd = {"id": req_id, **child._spawn_cmd(path)}
+        process.stdin.write(json.dumps(cmd).encode() + b"\n")
+        process.stdin.flush()
+        self._sent_early[req_id] = None
+        child._prespawned = (req_id, path)
+
+    async def start(self) -> None:
+        """Start the server unless it is running already.
+
+        Raises a :class:`RuntimeError` if it was started in another event loop.
+        """
+        if self._loop is not None and self._loop is not get_running_loop():
+            msg = f"Fork server for {self.code!r} is bound to another event loop"
+            raise RuntimeError(msg)
+        async with self._start_lock:
+            if self.conn is None:
+                if self.parent is not None:
+                    self.conn = await self._spawn()
+                elif self.is_daemon:
+                    self.conn = await self._connect()
+                else:
+                    self.conn = await self._start()
+                self._loop = get_running_loop()
+                if self.profile:
+                    await self._report_profile()
+
+    async def _start(self) -> ServerConnection:
+        """Launch the server unless it was, and connect to its stdio in this loop."""
+        self.launch()
+        process = self._process
+        assert process and process.stdin and process.stdout and process.stderr
+        loop = get_running_loop()
+        reader, stderr = StreamReader(), StreamReader()
+        read_pipes = []
+        for stream, pipe in ((reader, process.stdout), (stderr, process.stderr)):
+            read_pipe, _ = await loop.connect_read_pipe(
+                partial(StreamReaderProtocol, stream), pipe
             )
+            read_pipes.append(read_pipe)
+        transport, protocol = await loop.connect_write_pipe(
+            partial(StreamReaderProtocol, StreamReader()), process.stdin
+        )
+        # the transports close the pipes from now on
+        process.stdin = process.stdout = process.stderr = None
+        writer = StreamWriter(transport, protocol, None, loop)
+        for req_id in self._sent_early:
+            self._pending[req_id] = self._sent_early[req_id] = loop.create_future()
+        return ServerConnection(
+            process.pid, reader, writer, stderr, process, read_pipes
+        )
+
+    async def _connect(self) -> ServerConnection:
+        """Connect to the daemon for our code, starting it if there is none."""
+        path = self._daemon_path()
+        if (launcher := self._launcher) is not None:  # see `launch`
+            self._launcher = None
+            await _daemon_status(launcher)
+        with suppress(OSError):
+            return await _open_daemon(path)
+        if await _daemon_status(self._launch_daemon(path)) != b"ready\n":
+            output = path.with_suffix(".log").read_text(errors="replace")
+            msg = f"Failed to start fork server daemon:\n{output}"
+            raise RuntimeError(msg)
+        return await _open_daemon(path)
+
+    def _launch_daemon(self, path: Path) -> Popen[bytes]:
+        """Start a process that runs our code and exits once a daemon listens."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        args = (str(self.pool_size), str(path), str(self.daemon_timeout), *self._flags)
+        with path.with_suffix(".log").open("wb") as stderr:
+            cmd = self._server_cmd(*args)
+            return Popen(cmd, stdin=DEVNULL, stdout=PIPE, stderr=stderr)  # noqa: S603
+
+    def _daemon_path(self) -> Path:
+        return daemon_path(
+            self.py_cmd, self.code, self.pool_size, self.daemon_dir, self._flags
+        )
+
+    def _server_cmd(self, *args: str) -> list[str]:
+        code = RUN_SERVER_CODE.replace('"USER_CODE_INSERTION_POINT"', self.code)
+        return [*self.py_cmd, "-c", code, *args]
+
+    async def _spawn(self) -> ServerConnection:
+        assert self.parent is not None
+        await self.parent.start()
+        if (prespawned := self._prespawned) is not None:  # see `launch`
+            self._prespawned = None
+            req_id, path = prespawned
+            try:
+                resp = await self.parent._early_reply(req_id)  # noqa: SLF001
+                reader, writer = await open_unix_connection(path)
+            finally:
+                shutil.rmtree(path.parent, ignore_errors=True)
+        else:
+            with tempfile.TemporaryDirectory(prefix="sej-") as d:
+                path = Path(d) / "server.sock"
+                resp = await self.parent._send_cmd(self._spawn_cmd(path))  # noqa: SLF001
+                reader, writer = await open_unix_connection(path)
+        if (status := await reader.readline()) != b"ready\n":
+            output = status + await reader.read()
+            writer.close()
+            msg = (
+                "Failed to run preload layer in fork server:\n"
+                f"{output.decode('utf-8', errors='replace')}"
+            )
+            raise RuntimeError(msg)
+        return ServerConnection(resp["pid"], reader, writer)
+
+    def _spawn_cmd(self, path: Path) -> SpawnCmd:
+        assert self.parent is not None
+        prefix = self.parent.code + LAYER_SEPARATOR
+        assert self.code.startswith(prefix), "code must extend the parent’s code"
+        return SpawnCmd(
+            cmd="spawn",
+            code=self.code.removeprefix(prefix),
+            socket=str(path),
+            pool_size=self.pool_size,
+        )
+
+    async def fork(
+        self,
+        cmd: Sequence[str],
+        limits: KernelLimits | None = None,
+        connection: dict[str, int | str] | None = None,
+    ) -> int:
+        """Fork off a kernel running ``cmd``, return its PID.
 
-        resp = await self._send_cmd(ForkCmd(cmd="fork", argv=cmd, log=log_path))
+        If ``connection`` is given, the kernel uses it instead of a connection file.
+        """
+        await self.start()
+        resp = await self._send_cmd(
+            ForkCmd(cmd="fork", argv=cmd, limits=limits or {}, connection=connection)
+        )
+        self.kernels.add(resp["pid"])
         return resp["pid"]
 
-    @_locked
+    async def take(
+        self, cmd: Sequence[str], limits: KernelLimits | None = None
+    ) -> PooledKernel | None:
+        """Take a ready kernel from the pool, then refill it in the background.
+
+        Returns None if no kernel was pooled yet for this command line
+        (``cmd`` minus its connection file) and these limits.
+        """
+        await self.start()
+        resp = await self._send_cmd(TakeCmd(cmd="take", argv=cmd, limits=limits or {}))
+        if (kernel := resp["kernel"]) is not None:
+            self.kernels.add(kernel["pid"])
+        return kernel
+
     async def get_exit_code(self, pid: int) -> int | None:
-        if self.process is None:
+        if self.conn is None:
             return None
         resp = await self._send_cmd(ExitCodeCmd(cmd="exit_code", pid=pid))
+        if resp["code"] is not None:
+            self._exited(pid, resp.get("limit"), resp.get("output"))
         return resp["code"]
 
-    @_locked
     async def wait(self, pid: int) -> int:
         resp = await self._send_cmd(WaitExitCmd(cmd="wait", pid=pid))
+        self._exited(pid, resp.get("limit"), resp.get("output"))
         return resp["code"]
 
+    async def _report_profile(self) -> None:
+        resp = await self._send_cmd(ProfileCmd(cmd="profile", top=self.profile))
+        if (profile := resp["profile"]) is not None:
+            report_profile(profile, self.code.rsplit(LAYER_SEPARATOR, 1)[-1])
+
+    def _exited(self, pid: int, limit: LimitName | None, output: str | None) -> None:
+        self.kernels.discard(pid)
+        if limit is not None:
+            self.exceeded[pid] = limit
+        if output is not None:
+            self.outputs[pid] = output
+
+    @property
+    def _flags(self) -> list[str]:
+        flags = {"--gc-freeze": self.gc_freeze, "--profile": self.profile > 0}
+        return [flag for flag, enabled in flags.items() if enabled]
+
+    @property
+    def is_daemon(self) -> bool:
+        """Whether the server is shared with other processes via a Unix socket."""
+        return bool(self.daemon_timeout or self.daemon_dir)
+
+    @property
+    def in_use(self) -> bool:
+        """Whether kernels, commands, or leases are still outstanding."""
+        return bool(self.leases or self.kernels or self._pending)
+
+    def rss(self) -> int:
+        """Resident memory of the server process in bytes, 0 if unknown."""
+        if self.conn is None:
+            return 0
+        try:
+            import psutil  # noqa: PLC0415
+        except ImportError:
+            return 0
+        with suppress(psutil.Error):
+            return psutil.Process(self.conn.pid).memory_info().rss
+        return 0
+
+    def close(self) -> None:
+        """Stop the server, which kills its pooled kernels.
+
+        Kernels already handed out keep running.
+        Daemons are only disconnected from, they stop once they are idle.
+        """
+        if self.conn is not None:
+            if not self.is_daemon:
+                with suppress(ProcessLookupError):
+                    os.kill(self.conn.pid, signal.SIGTERM)
+            if self._reader is not None:
+                self._reader.cancel()
+            self.conn.close()
+        elif (process := self._process) is not None:  # launched, never connected
+            process.terminate()
+            for pipe in (process.stdin, process.stdout, process.stderr):
+                if pipe is not None:
+                    pipe.close()
+        if (process := self._process) is not None:
+            self._process = None
+            # it exits once it killed its pooled kernels, don’t wait for that
+            Thread(target=process.wait, name="fork-server-reaper", daemon=True).start()
+        if (launcher := self._launcher) is not None:
+            self._launcher = None
+            with launcher:  # stops the preload code, unless a daemon runs already
+                launcher.kill()
+        if (prespawned := self._prespawned) is not None:
+            self._prespawned = None
+            _, path = prespawned
+            _listening(path)  # a client that leaves right away lets it exit
+            shutil.rmtree(path.parent, ignore_errors=True)
+
     @overload
     async def _send_cmd(self, cmd: ForkCmd) -> ForkResp: ...
     @overload
     async def _send_cmd(self, cmd: WaitExitCmd) -> WaitExitResp: ...
     @overload
     async def _send_cmd(self, cmd: ExitCodeCmd) -> ExitCodeResp: ...
+    @overload
+    async def _send_cmd(self, cmd: SpawnCmd) -> ForkResp: ...
+    @overload
+    async def _send_cmd(self, cmd: TakeCmd) -> TakeResp: ...
+    @overload
+    async def _send_cmd(self, cmd: ProfileCmd) -> ProfileResp: ...
     async def _send_cmd(self, cmd: Cmd) -> Resp:
-        assert self.process and self.process.stdin and self.process.stdout
-        self.process.stdin.write(json.dumps(cmd).encode("utf-8") + b"\n")
-        await self.process.stdin.drain()
-        out = (
-            (await self.process.stdout.readline())
-            if self.process.returncode is None
-            else b""
+        assert self.conn
+        self._read_in_background()
+        req_id = next(self._ids)
+        self._pending[req_id] = resp = get_running_loop().create_future()
+        # a single write per command, so concurrent commands don’t interleave
+        self.conn.writer.write(json.dumps({"id": req_id, **cmd}).encode() + b"\n")
+        await self.conn.writer.drain()
+        return await resp
+
+    async def _early_reply(self, req_id: int) -> Resp:
+        """Wait for the reply to a command sent before connecting."""
+        fut = self._sent_early.pop(req_id)
+        assert fut is not None, "not connected yet"
+        self._read_in_background()
+        return await fut
+
+    def _read_in_background(self) -> None:
+        if self._reader is None or self._reader.done():
+            self._reader = create_task(self._read_replies())
+
+    async def _read_replies(self) -> None:
+        """Hand each reply to the command with the same ``id``."""
+        assert self.conn
+        while out := await self.conn.reader.readline():
+            try:
+                resp = json.loads(out)
+                fut = self._pending.pop(resp.pop("id"))
+            except (json.JSONDecodeError, KeyError) as e:
+                await self._fail_pending(out, e)
+                return
+            if not fut.done():  # e.g. cancelled
+                fut.set_result(resp)
+        await self._fail_pending(b"", None)
+
+    async def _fail_pending(self, out: bytes, cause: Exception | None) -> None:
+        """Fail all waiting commands, e.g. because the server died."""
+        assert self.conn
+        err = await self.conn.stderr.read() if self.conn.stderr else b""
+        msg = (
+            "Failed to parse response from fork server:\n"
+            f"Stdout: {out.decode('utf-8', errors='replace')}\n"
+            f"Stderr: {err.decode('utf-8', errors='replace')}"
         )
+        pending, self._pending = self._pending, {}
+        for fut in pending.values():
+            if not fut.done():
+                exc = RuntimeError(msg)
+                exc.__cause__ = cause
+                fut.set_exception(exc)
+
+
+def _listening(path: Path) -> bool:
+    """Whether a daemon listens at ``path``."""
+    with socket.socket(socket.AF_UNIX) as sock:
         try:
-            return json.loads(out)
-        except json.JSONDecodeError as e:
-            assert self.process.stderr
-            err = await self.process.stderr.read()
-            msg = (
-                "Failed to parse response from fork server:\n"
-                f"Stdout: {out.decode('utf-8', errors='replace')}\n"
-                f"Stderr: {err.decode('utf-8', errors='replace')}"
-            )
-            raise RuntimeError(msg) from e
+            sock.connect(str(path))
+        except OSError:
+            return False
+    return True
+
+
+async def _daemon_status(launcher: Popen[bytes]) -> bytes:
+    """Wait for a daemon’s launcher to report whether the daemon listens.
+
+    Processes forked from the one that started the launcher can wait, too,
+    but only one of them reads the report.
+    The pipe is read in a thread, since forked processes share
+    their parent’s event loop selector, which then can’t watch it twice.
+    """
+    assert launcher.stdout
+    with launcher:
+        return await to_thread(launcher.stdout.readline)
+
+
+async def _open_daemon(path: Path) -> ServerConnection:
+    reader, writer = await open_unix_connection(path)
+    # the daemon introduces itself, unless it is just exiting
+    if not (hello := await reader.readline()):
+        writer.close()
+        msg = f"Fork server daemon at {path} closed the connection"
+        raise ConnectionError(msg)
+    return ServerConnection(json.loads(hello)["pid"], reader, writer)
+
+
+def _without_connection_file(argv: list[str]) -> list[str]:
+    if "-f" in argv:
+        i = argv.index("-f")
+        return [*argv[:i], *argv[i + 2 :]]
+    return argv
+
+
+@dataclass
+class ForkServerRegistry:
+    """Fork servers by Python command and preload code, least recently used first.
+
+    Whenever a server is requested, idle servers are shut down (least recently
+    used first) while more than ``max_servers`` are live, or while all servers
+    together use more than ``max_memory`` bytes. ``0`` means no limit.
+
+    If ``daemon_timeout`` is positive, servers are daemons (see `KernelForkServer`).
+    After :meth:`share`, servers are daemons that live until :meth:`shutdown`.
+    Each daemon runs all layers of its preload code.
+
+    If ``transport`` is ``"ipc"``, kernels forked from the servers communicate
+    via Unix sockets in a directory that lives until :meth:`shutdown`
+    (see :meth:`ipc_path`), instead of via TCP ports on localhost.
+    """
+
+    max_servers: int = 0
+    max_memory: int = 0
+    daemon_timeout: float = 0
+    #: Whether servers keep the garbage collector off their heap
+    gc_freeze: bool = False
+    #: How many of the slowest imports and calls of preload code to log
+    profile_preload: int = 0
+    #: Whether to measure kernels’ memory before shutting them down
+    measure_memory: bool = False
+    #: Limits for all kernels forked from the servers
+    kernel_limits: KernelLimits = field(default_factory=KernelLimits)
+    transport: Literal["tcp", "ipc"] = "ipc"
+    #: Where kernels’ IPC endpoints are, see :meth:`ipc_path`
+    ipc_dir: Path | None = None
+    #: Where servers shared by this process and its forks listen, see :meth:`share`
+    shared_dir: Path | None = None
+    _servers: OrderedDict[tuple[tuple[str, ...], str], KernelForkServer] = field(
+        init=False, default_factory=OrderedDict
+    )
+
+    def __len__(self) -> int:
+        return len(self._servers)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._servers
+
+    def get(
+        self, py_cmd: tuple[str, ...], code: str, pool_size: int = 0
+    ) -> KernelForkServer:
+        """Return the server for ``py_cmd`` and ``code``, creating it if needed.
+
+        If ``code`` has multiple layers (see :func:`layered`),
+        servers for its shorter prefixes are created as its ancestors.
+        The server is leased, so it isn’t shut down to meet the limits
+        until it is passed to :meth:`release`.
+        """
+        daemon = self.daemon_timeout or self.shared_dir
+        layers = [code] if daemon else code.split(LAYER_SEPARATOR)
+        server = None
+        for n in range(1, len(layers) + 1):
+            key = (py_cmd, LAYER_SEPARATOR.join(layers[:n]))
+            if (child := self._servers.get(key)) is None:
+                size = pool_size if n == len(layers) else 0
+                child = KernelForkServer(
+                    *key,
+                    size,
+                    parent=server,
+                    daemon_timeout=self.daemon_timeout,
+                    daemon_dir=self.shared_dir,
+                    gc_freeze=self.gc_freeze,
+                    profile=self.profile_preload,
+                )
+                self._servers[key] = child
+            self._servers.move_to_end(key)
+            server = child
+        assert server is not None
+        server.leases += 1
+        self.evict()
+        return server
+
+    def release(self, server: KernelForkServer) -> None:
+        """Return a server leased by :meth:`get`."""
+        server.leases -= 1
+
+    def evict(self) -> None:
+        """Shut down idle servers until the limits are met."""
+        rss = (
+            {key: server.rss() for key, server in self._servers.items()}
+            if self.max_memory
+            else {}
+        )
+        total = sum(rss.values())
+        for key, server in list(self._servers.items()):
+            if server.in_use or self._has_children(server):
+                continue
+            too_many = self.max_servers and len(self._servers) > self.max_servers
+            too_big = self.max_memory and total > self.max_memory
+            if not (too_many or too_big):
+                break
+            del self._servers[key]
+            total -= rss.get(key, 0)
+            server.close()
+
+    def _has_children(self, server: KernelForkServer) -> bool:
+        return any(s.parent is server for s in self._servers.values())
+
+    def prestart(self, py_cmd: tuple[str, ...], code: str, pool_size: int = 0) -> None:
+        """Launch the server for ``code`` now, see :meth:`KernelForkServer.launch`.
+
+        Of layered code, the servers for the first two layers run their code
+        right away, the others once kernels are requested from them.
+        Daemons run all layers right away.
+        """
+        server = self.get(py_cmd, code, pool_size)
+        server.launch()
+        self.release(server)
+
+    def share(self) -> None:
+        """Share servers with processes forked from this one from now on.
+
+        E.g. Sphinx’ parallel readers then connect to the same servers,
+        so each preload runs once, instead of once per reader process.
+        Servers created before are shut down,
+        since forked processes can’t use their connections.
+        Does nothing if servers are daemons already.
+        """
+        if self.transport == "ipc":  # create it before forking, so all clean it up
+            self._ipc_dir()
+        if self.daemon_timeout or self.shared_dir is not None:
+            return
+        for server in self._servers.values():
+            server.close()
+        self._servers.clear()
+        self.shared_dir = Path(tempfile.mkdtemp(prefix="sej-"))
+
+    def ipc_path(self, kernel_id: str) -> str:
+        """Path prefix for a kernel’s IPC endpoints, which :meth:`shutdown` removes."""
+        return str(self._ipc_dir() / kernel_id)
+
+    def _ipc_dir(self) -> Path:
+        if self.ipc_dir is None:
+            # Unix socket paths are limited to ~100 bytes, so not in the runtime dir
+            self.ipc_dir = Path(tempfile.mkdtemp(prefix="sej-ipc-"))
+        return self.ipc_dir
+
+    def shutdown(self) -> None:
+        """Shut down all servers, e.g. at the end of a build.
+
+        Servers aren’t shared anymore afterwards.
+        """
+        shared_dir, self.shared_dir = self.shared_dir, None
+        servers, self._servers = self._servers, OrderedDict()
+        for server in servers.values():
+            server.close()
+        if shared_dir is not None:
+            stop_daemons(shared_dir)
+            shutil.rmtree(shared_dir, ignore_errors=True)
+        if self.ipc_dir is not None:  # endpoints of kernels that didn’t clean up
+            shutil.rmtree(self.ipc_dir, ignore_errors=True)
+            self.ipc_dir = None
 
 
 @dataclass
@@ -189,18 +915,23 @@ class ForkingProvisioner(KernelProvisionerBase):
 
     # internal state
     ports_cached: bool = field(init=False, default=False)
+    #: Whether the kernel reads its connection info from a file
+    uses_connection_file: bool = field(init=False, default=False)
     server: KernelForkServer | None = field(init=False, default=None)
     pid: int | None = field(init=False, default=None)
-    log_path: str | None = field(init=False, default=None)
     _output_surfaced: bool = field(init=False, default=False)
     _shutdown_initiated: bool = field(init=False, default=False)
 
-    SERVERS: ClassVar[dict[tuple[tuple[str, ...], str], KernelForkServer]] = {}
+    SERVERS: ClassVar[ForkServerRegistry] = ForkServerRegistry()
 
     @property
     def code(self) -> str:
         return self.parent.code
 
+    @property
+    def pool_size(self) -> int:
+        return self.parent.pool_size
+
     @property
     @override
     def has_process(self) -> bool:
@@ -212,8 +943,7 @@ class ForkingProvisioner(KernelProvisionerBase):
             return 0
         code = await self.server.get_exit_code(self.pid)
         if code is not None:
-            self.pid = None
-            self._surface_output(code)
+            self._exited(code)
         return code
 
     @override
@@ -221,30 +951,32 @@ class ForkingProvisioner(KernelProvisionerBase):
         if self.pid is None or not self.server:
             return 0
         code = await self.server.wait(self.pid)
-        self.pid = None
-        self._surface_output(code)
+        self._exited(code)
         return code
 
-    def _surface_output(self, code: int) -> None:
-        """Log the kernel’s captured output and drop its log file.
+    def _exited(self, code: int) -> None:
+        assert self.server is not None
+        assert self.pid is not None
+        limit = self.server.exceeded.pop(self.pid, None)
+        if limit and (monitor := current_monitor()) is not None:
+            monitor.exceeded = limit
+        output = self.server.outputs.pop(self.pid, "")
+        self.pid = None
+        self._surface_output(code, output)
+
+    def _surface_output(self, code: int, output: str) -> None:
+        """Log the kernel’s captured output if it exited abnormally.
 
         A kernel that crashes on startup (e.g. a broken preload) writes its
-        traceback to the log file instead of replying to ``kernel_info``,
+        traceback to stderr instead of replying to ``kernel_info``,
         which otherwise surfaces only as a generic “Kernel died” error.
-        Emit it on abnormal exit so the cause is visible; on a clean exit just clean up.
+        The fork server keeps the tail of each kernel’s stdout and stderr in memory,
+        and sends it along with an abnormal exit code, so the cause is visible.
         """
         if self._output_surfaced:
             return
         self._output_surfaced = True
-        if (log_path := self.log_path) is None:
-            return
-        self.log_path = None
-        try:
-            output = Path(log_path).read_text(errors="replace").strip()
-        except OSError:
-            output = ""
-        finally:
-            Path(log_path).unlink(missing_ok=True)
+        output = output.strip()
         if code != 0 and output and not self._shutdown_initiated:
             self.parent.log.warning(
                 "Kernel %s exited with code %d. Captured output:\n%s",
@@ -256,6 +988,15 @@ class ForkingProvisioner(KernelProvisionerBase):
         assert self.pid
         os.kill(self.pid, signum)
 
+    def measure_memory(self) -> None:
+        """Let the current monitor know how much memory the kernel uses."""
+        if self.pid is None or self.server is None or self.server.conn is None:
+            return
+        if (monitor := current_monitor()) is None:
+            return
+        if (memory := measure_kernel(self.pid, self.server.conn.pid)) is not None:
+            monitor.memory.append(memory)
+
     @override
     async def kill(self, restart: bool = False) -> None:
         self._shutdown_initiated = True
@@ -271,19 +1012,49 @@ class ForkingProvisioner(KernelProvisionerBase):
     async def launch_kernel(
         self, cmd: list[str], **kwargs: object
     ) -> KernelConnectionInfo:
-        cls = type(self)
         m_idx = cmd.index("-m")
         py_cmd, kernel_argv = tuple(cmd[:m_idx]), cmd[m_idx + 2 :]
-        self.server = cls.SERVERS.setdefault(
-            (py_cmd, self.code), KernelForkServer(py_cmd, self.code)
-        )
-        fd, self.log_path = tempfile.mkstemp(prefix="sej-kernel-", suffix=".log")
-        os.close(fd)
-        self.pid = await self.server.fork(kernel_argv, self.log_path)
-        self.parent.log.debug(
-            "Kernel %s output captured at %s", self.kernel_id, self.log_path
-        )
-        return self.connection_info
+        server = self.server = type(self).SERVERS.get(py_cmd, self.code, self.pool_size)
+        try:  # once the kernel is forked, the server is in use until it exits
+            await self.server.start()
+            mark("server")
+            limits = type(self).SERVERS.kernel_limits
+            connection: dict[str, int | str] | None = None
+            if not self.uses_connection_file:
+                kernel_argv = _without_connection_file(kernel_argv)
+                info = cast("dict[str, int | str | bytes]", self.connection_info)
+                connection = {
+                    name: value.decode() if isinstance(value, bytes) else value
+                    for name, value in info.items()
+                }
+            if self.pool_size:
+                # pooled kernels bind before we know them, so they choose their
+                # endpoints, under a prefix in the build’s directory for IPC endpoints
+                if self.parent.transport == "ipc":
+                    pooled_ip = type(self).SERVERS.ipc_path("pooled")
+                    kernel_argv = [*kernel_argv, "--transport=ipc", f"--ip={pooled_ip}"]
+                if pooled := await self.server.take(kernel_argv, limits):
+                    mark("launch")
+                    return self._adopt(pooled)
+            self.pid = await self.server.fork(kernel_argv, limits, connection)
+            mark("launch")
+            return self.connection_info
+        finally:
+            type(self).SERVERS.release(server)
+
+    def _adopt(self, pooled: PooledKernel) -> KernelConnectionInfo:
+        """Use a pooled kernel, which has already bound its own ports."""
+        self.pid = pooled["pid"]
+        if self.ports_cached:  # the ports reserved in `pre_launch` remain unused
+            lpc = LocalPortCache.instance()
+            for name in ("shell", "iopub", "stdin", "hb", "control"):
+                lpc.return_port(cast("int", self.connection_info[f"{name}_port"]))
+            self.ports_cached = False
+        info = cast("KernelConnectionInfo", dict(pooled["connection"]))
+        info["key"] = cast("str", info["key"]).encode()
+        self.connection_info = info
+        self.parent.log.debug("Kernel %s taken from pool", self.kernel_id)
+        return info
 
     @override
     async def cleanup(self, restart: bool = False) -> None:
@@ -300,7 +1071,14 @@ class ForkingProvisioner(KernelProvisionerBase):
         """
         assert self.kernel_spec
         km = self.parent
-        if km.cache_ports and not self.ports_cached:
+        if type(self).SERVERS.transport == "ipc":
+            km.transport = "ipc"
+            km.ip = type(self).SERVERS.ipc_path(str(self.kernel_id))
+            # the path is the kernel’s own, so any port numbers will do
+            for port, name in enumerate(port_names, 1):
+                if not getattr(km, name):
+                    setattr(km, name, port)
+        elif km.cache_ports and not self.ports_cached:
             lpc = LocalPortCache.instance()
             km.shell_port = lpc.find_available_port(km.ip)
             km.iopub_port = lpc.find_available_port(km.ip)
@@ -308,11 +1086,15 @@ class ForkingProvisioner(KernelProvisionerBase):
             km.hb_port = lpc.find_available_port(km.ip)
             km.control_port = lpc.find_available_port(km.ip)
             self.ports_cached = True
-        if env := cast("dict[str, object] | None", kwargs.get("env")):
-            jupyter_session = env.get("JPY_SESSION_NAME", "")
-            km.write_connection_file(jupyter_session=jupyter_session)
-        else:
-            km.write_connection_file()
+        # the kernel gets its connection info with the `fork` command,
+        # unless we need a connection file to find free ports
+        self.uses_connection_file = not all(getattr(km, n) for n in port_names)
+        if self.uses_connection_file:
+            if env := cast("dict[str, object] | None", kwargs.get("env")):
+                jupyter_session = env.get("JPY_SESSION_NAME", "")
+                km.write_connection_file(jupyter_session=jupyter_session)
+            else:
+                km.write_connection_file()
         self.connection_info = km.get_connection_info()
         kernel_cmd = km.format_kernel_cmd(extra_arguments=list(extra_arguments))
         return await super().pre_launch(cmd=kernel_cmd, **kwargs)
@@ -330,8 +1112,20 @@ class ForkingKernelSpec(KernelSpec):
 
 
 class ForkingKernelSpecManager(KernelSpecManager):
+    """A KernelSpecManager that looks up each kernel spec once per build."""
+
     kernel_spec_class = ForkingKernelSpec
 
+    #: Kernel specs by name and whether they fork, cleared at the end of a build
+    specs: ClassVar[dict[tuple[str, bool], KernelSpec]] = {}
+
+    @override
+    def get_kernel_spec(self, kernel_name: str) -> KernelSpec:
+        key = (kernel_name, forking_supported())
+        if (spec := self.specs.get(key)) is None:
+            spec = self.specs[key] = super().get_kernel_spec(kernel_name)
+        return spec
+
 
 class ForkingKernelManager(AsyncKernelManager):
     """A KernelManager that starts kernels from forked processes.
@@ -340,6 +1134,8 @@ class ForkingKernelManager(AsyncKernelManager):
     ----------
     code
         Code to execute before forking off a kernel.
+    pool_size
+        Number of kernels to keep forked and initialized ahead of demand.
 
     """
 
@@ -350,15 +1146,18 @@ class ForkingKernelManager(AsyncKernelManager):
         return ForkingKernelSpecManager(parent=self)
 
     code: str
+    pool_size: int
     provisioner: ForkingProvisioner
 
-    def __init__(self, code: str, **kw: object) -> None:
+    def __init__(self, code: str, pool_size: int = 0, **kw: object) -> None:
         super().__init__(**kw)
         self.code = code
+        self.pool_size = pool_size
         self._resources = ExitStack()
-        self._reactivate_mpl_inline = self._resources.enter_context(
-            importlib.resources.as_file(FILES / "reactivate-mpl-inline.py")
-        )
+        self._reactivate = [
+            self._resources.enter_context(importlib.resources.as_file(FILES / name))
+            for name in ("reactivate-mpl-inline.py", "reactivate-holoviews.py")
+        ]
 
     def __del__(self) -> None:
         self._resources.close()
@@ -372,7 +1171,29 @@ class ForkingKernelManager(AsyncKernelManager):
         # so inject it as startup lines instead.
         if self.code and not forking_supported():
             cmd = [*cmd, f"--IPKernelApp.exec_lines={self.code}"]
-        return [*cmd, f"--IPKernelApp.exec_files={self._reactivate_mpl_inline}"]
+        return [*cmd, *(f"--IPKernelApp.exec_files={f}" for f in self._reactivate)]
+
+    @override
+    def _reconcile_connection_info(self, info: KernelConnectionInfo) -> None:
+        if self._connection_file_written:
+            super()._reconcile_connection_info(info)
+            return
+        # forked kernels are connected without a file, so don’t write one
+        for name in port_names:
+            setattr(self, name, 0)
+        self.load_connection_info(info)
+
+    @override
+    async def shutdown_kernel(self, now: bool = False, restart: bool = False) -> None:
+        # measure before the kernel starts to exit
+        if (
+            isinstance(self.provisioner, ForkingProvisioner)
+            and ForkingProvisioner.SERVERS.measure_memory
+        ):
+            self.provisioner.measure_memory()
+        await super()._async_shutdown_kernel(now=now, restart=restart)
+
+    _async_shutdown_kernel = shutdown_kernel
 
     @override
     async def finish_shutdown(
@@ -387,3 +1208,38 @@ class ForkingKernelManager(AsyncKernelManager):
             await self.provisioner.wait()
 
     _async_finish_shutdown = finish_shutdown
+
+
+def prestart_fork_server(code: str, kernel_name: str, pool_size: int = 0) -> None:
+    """Launch the fork server for ``code`` without waiting for it to run the code.
+
+    Does nothing if kernels for ``kernel_name`` aren’t forked.
+    """
+    if not code or not forking_supported():
+        return
+    km = kernel_manager_class(code, pool_size=pool_size)(kernel_name=kernel_name)
+    try:
+        spec = km.kernel_spec
+    except NoSuchKernel:  # executing will fail with a proper error message
+        return
+    provisioner = spec.metadata.get("kernel_provisioner", {})
+    if provisioner.get("provisioner_name") != "forking_provisioner":
+        return
+    # like `ForkingProvisioner.launch_kernel` does
+    cmd = km.format_kernel_cmd()
+    if "-m" in cmd:
+        py_cmd = tuple(cmd[: cmd.index("-m")])
+        servers = ForkingProvisioner.SERVERS
+        call_in_server_loop(servers.prestart, py_cmd, code, pool_size)
+
+
+def kernel_manager_class(
+    code: str, *, pool_size: int = 0
+) -> type[ForkingKernelManager]:
+    """Create a kernel manager class that forks kernels after running ``code``."""
+
+    class F(ForkingKernelManager):
+        def __init__(self, *args: object, **kwargs: object) -> None:
+            super().__init__(code, pool_size, *args, **kwargs)
+
+    return F
@@ -8,30 +8,140 @@ InteractiveShell.instance()  # so preload code sees a real `get_ipython()`
 
 del InteractiveShell
 
+if "--gc-freeze" in __import__("sys").argv:
+    # freed preload objects would leave holes that kernels fill, copying pages
+    __import__("gc").disable()
+
+if "--profile" in __import__("sys").argv:
+    # see `preload_profile` below
+    __profile = __import__("cProfile").Profile(__import__("time").perf_counter)
+    __profile.enable()
+
 "USER_CODE_INSERTION_POINT"
 
+if "--profile" in __import__("sys").argv:
+    __profile.disable()
+
 user_ns = globals().copy()
 
 
-def __main() -> None:  # noqa: C901
+def __main() -> None:  # noqa: C901, PLR0912, PLR0915
+    import cProfile
+    import gc
     import json
     import os
+    import pstats
+    import resource
+    import selectors
     import signal
+    import socket
     import sys
+    import time
+    import traceback
+    from collections import deque
+    from contextlib import suppress
+    from functools import partial
+    from itertools import chain
     from pathlib import Path
     from typing import TYPE_CHECKING
 
-    import ipykernel.kernelapp
+    from ipykernel.kernelapp import IPKernelApp
     from IPython.core.interactiveshell import InteractiveShell
 
     if TYPE_CHECKING:
-        from typing import Never
+        from collections.abc import Sequence
+        from typing import BinaryIO, Never
+
+        from sphinx_exec_jupyter._kernel_mgr import (
+            Cmd,
+            KernelLimits,
+            LimitName,
+            PooledKernel,
+            Resp,
+        )
+        from sphinx_exec_jupyter._profile import PreloadProfile
 
-        from sphinx_exec_jupyter._kernel_mgr import Cmd
+        # command line and limits of pooled kernels
+        type PoolKey = tuple[tuple[str, ...], str]
 
     InteractiveShell.clear_instance()
 
+    LOG_SIZE = 1 << 16  # noqa: N806
+    # unreported exit codes to keep, e.g. of discarded pooled kernels nobody asks for
+    MAX_EXIT_CODES = 1 << 10  # noqa: N806
+    # profiled calls that just import modules
+    IMPORT_MACHINERY = {  # noqa: N806
+        "<built-in method builtins.exec>",
+        "<built-in method builtins.__import__>",
+    }
+
+    class Client:
+        """Where commands come from and replies go: our stdio, or a socket."""
+
+        def __init__(
+            self, fd: int, out: BinaryIO, sock: socket.socket | None = None
+        ) -> None:
+            self.fd, self.out, self.sock = fd, out, sock
+            self.buf = b""
+
+        def close(self) -> None:
+            if self.sock is not None:
+                with suppress(OSError):  # can’t flush to a client that left
+                    self.out.close()
+                self.sock.close()
+
+    class KernelLog:
+        """The tail of a kernel’s stdout and stderr, read from a pipe."""
+
+        def __init__(self, fd: int) -> None:
+            self.fd: int | None = fd
+            self.tail = bytearray()
+            os.set_blocking(fd, False)
+            sel.register(fd, selectors.EVENT_READ, self)
+
+        def read(self) -> None:
+            """Read what the kernel wrote so far, stop at EOF."""
+            while self.fd is not None:
+                try:
+                    chunk = os.read(self.fd, 1 << 16)
+                except BlockingIOError:
+                    return
+                if not chunk:
+                    self.close()
+                    return
+                self.tail += chunk
+                del self.tail[:-LOG_SIZE]
+
+        def close(self) -> None:
+            if self.fd is not None:
+                sel.unregister(self.fd)
+                os.close(self.fd)
+                self.fd = None
+
+    # whether to keep the garbage collector off our heap, so kernels share it
+    gc_freeze = "--gc-freeze" in sys.argv
+    # how long our preload code took, until a client asked for it
+    profile: cProfile.Profile | None = user_ns.pop("__profile", None)
+    args = [arg for arg in sys.argv[1:] if arg not in {"--gc-freeze", "--profile"}]
+    pool_size = int(args[0]) if args else 0
+    # exit codes of kernels until they are reported, oldest first
     exit_codes: dict[int, int] = {}
+    # clients and request IDs of `wait` commands by the PID they wait for
+    waiting: dict[int, list[tuple[Client, int]]] = {}
+    # kernels forked ahead of demand: key → (pid, pipe with connection info)
+    pools: dict[PoolKey, deque[tuple[int, int]]] = {}
+    # output of kernels whose exit code we didn’t report yet, up to LOG_SIZE bytes
+    logs: dict[int, KernelLog] = {}
+    # when to kill kernels with a wall time limit, and why we killed them
+    deadlines: dict[int, float] = {}
+    killed: dict[int, LimitName] = {}
+    clients = [Client(sys.stdin.fileno(), sys.stdout.buffer)]
+    # as a daemon, we accept any number of clients at a Unix socket,
+    # and exit once we had none for `idle_timeout` seconds (if positive)
+    listener: socket.socket | None = None
+    daemon_path = args[1] if len(args) > 1 else None
+    idle_timeout = float(args[2]) if len(args) > 2 else 0  # noqa: PLR2004
+    idle_since = time.monotonic()
 
     def reap_children(signum: int, frame: object) -> None:  # noqa: ARG001
         while True:
@@ -40,37 +150,499 @@ def __main() -> None:  # noqa: C901
                 if pid == 0:  # no reapable children right now
                     break
                 exit_codes[pid] = os.waitstatus_to_exitcode(status)
+                if len(exit_codes) > MAX_EXIT_CODES:
+                    del exit_codes[next(iter(exit_codes))]
             except ChildProcessError:
                 break
 
-    signal.signal(signal.SIGCHLD, reap_children)
+    stopping = False
 
-    def launch(argv: list[str], log_path: str) -> Never:
-        with Path(os.devnull).open() as r, Path(log_path).open("w") as w:
-            os.dup2(r.fileno(), sys.stdin.fileno())
-            os.dup2(w.fileno(), sys.stdout.fileno())
-            os.dup2(w.fileno(), sys.stderr.fileno())
-            ipykernel.kernelapp.launch_new_instance(argv, user_ns=user_ns)
-            sys.exit(0)  # actually unreachable
+    def stop(signum: int, frame: object) -> None:  # noqa: ARG001
+        nonlocal stopping
+        stopping = True
 
-    for line in sys.stdin:
-        msg: Cmd = json.loads(line)
-        if msg["cmd"] == "fork":
-            if child_pid := os.fork():
-                json.dump({"pid": child_pid}, sys.stdout)
-                sys.stdout.write("\n")
-                sys.stdout.flush()
+    sel = selectors.DefaultSelector()
+    wakeup_r = wakeup_w = -1
+
+    def watch() -> None:
+        """Listen for commands, and let `SIGCHLD` wake up `select` via a pipe."""
+        nonlocal wakeup_r, wakeup_w
+        wakeup_r, wakeup_w = os.pipe()
+        for fd in (wakeup_r, wakeup_w):
+            os.set_blocking(fd, False)
+        signal.set_wakeup_fd(wakeup_w)
+        signal.signal(signal.SIGCHLD, reap_children)
+        signal.signal(signal.SIGTERM, stop)
+        for client in clients:
+            sel.register(client.fd, selectors.EVENT_READ, client)
+        if listener is not None:
+            sel.register(listener, selectors.EVENT_READ, listener)
+        sel.register(wakeup_r, selectors.EVENT_READ)
+
+    def unwatch() -> None:
+        """Undo `watch` and forget pooled kernels, which belong to our parent."""
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for key in list(sel.get_map().values()):
+            if isinstance(key.data, tuple):  # pooled kernel being taken
+                os.close(key.fd)
+        sel.close()
+        for fd in (wakeup_r, wakeup_w):
+            os.close(fd)
+        for _, ready_fd in chain.from_iterable(pools.values()):
+            os.close(ready_fd)
+        pools.clear()
+        for log in logs.values():
+            if log.fd is not None:
+                os.close(log.fd)
+        logs.clear()
+
+    def close_connections() -> None:
+        nonlocal listener
+        for client in clients:
+            client.close()
+        clients.clear()
+        if listener is not None:
+            listener.close()
+            listener = None
+
+    def listen(path: str) -> socket.socket | None:
+        """Listen at ``path``, unless another daemon does already."""
+        sock = socket.socket(socket.AF_UNIX)
+        # only appear at `path` once listening, so others never see a dead socket
+        tmp_path = f"{path}.{os.getpid()}"
+        sock.bind(tmp_path)
+        sock.listen()
+        try:
+            while True:
+                try:
+                    os.link(tmp_path, path)
+                except FileExistsError:
+                    with socket.socket(socket.AF_UNIX) as probe:
+                        try:
+                            probe.connect(path)
+                        except OSError:  # left over from a daemon that died
+                            Path(path).unlink(missing_ok=True)
+                            continue
+                    sock.close()
+                    return None
+                return sock
+        finally:
+            Path(tmp_path).unlink()
+
+    if daemon_path is not None:
+        # the process our client started only reports whether the daemon is ready
+        if os.fork():
+            os._exit(0)
+        if idle_timeout:  # don’t get interrupted along with the build
+            os.setsid()
+        listener = listen(daemon_path)
+        sys.stdout.write("ready\n")
+        sys.stdout.flush()
+        with Path(os.devnull).open("r+b") as null:
+            os.dup2(null.fileno(), sys.stdin.fileno())
+            os.dup2(null.fileno(), sys.stdout.fileno())
+        if listener is None:
+            os._exit(0)
+        clients.clear()
+
+    if gc_freeze:
+        gc.freeze()
+    watch()
+
+    def fork_kernel(
+        argv: list[str],
+        limits: KernelLimits,
+        *,
+        connection: dict[str, int | str] | None = None,
+        ready: tuple[int, int] | None = None,
+    ) -> int:
+        """Fork off a kernel whose output we keep, return its PID.
+
+        Pooled kernels report their connection info to the ``ready`` pipe.
+        """
+        log_r, log_w = os.pipe()
+        if not (child_pid := os.fork()):
+            os.close(log_r)
+            if ready is not None:
+                os.close(ready[0])
+            ready_fd = None if ready is None else ready[1]
+            launch(argv, log_w, limits, ready_fd, connection)
+        os.close(log_w)
+        if ready is not None:
+            os.close(ready[1])
+        logs[child_pid] = KernelLog(log_r)
+        return child_pid
+
+    def launch(
+        argv: list[str],
+        log_fd: int,
+        limits: KernelLimits,
+        ready_fd: int | None = None,
+        connection: dict[str, int | str] | None = None,
+    ) -> Never:
+        # kernels reap their own children and shouldn’t share our event loop
+        unwatch()
+        close_connections()
+        if gc_freeze:  # only collect what the kernel allocates itself
+            gc.enable()
+        if memory := limits.get("memory"):
+            resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+        if cpu_time := limits.get("cpu_time"):
+            # `SIGXCPU` at the soft limit, `SIGKILL` if that is ignored
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_time, cpu_time + 1))
+        with Path(os.devnull).open() as null:
+            os.dup2(null.fileno(), sys.stdin.fileno())
+        os.dup2(log_fd, sys.stdout.fileno())
+        os.dup2(log_fd, sys.stderr.fileno())
+        os.close(log_fd)
+        app = IPKernelApp.instance(user_ns=user_ns)
+        # don’t read or write a connection file, we know or report the info
+        if connection is not None:
+            app.init_connection_file = partial(app.load_connection_info, connection)
+            app.write_connection_file = lambda: None
+        elif ready_fd is not None:
+            app.init_connection_file = app.write_connection_file = lambda: None
+            if (prefix := ipc_prefix(argv, os.getpid())) is not None:
+                argv = [
+                    *(a for a in argv if not a.startswith("--ip=")),
+                    f"--ip={prefix}",
+                ]
+        app.initialize(argv)
+        if ready_fd is not None:
+            # pooled kernels choose their own ports and report them once ready
+            info = app.get_connection_info()
+            info["key"] = app.session.key.decode()
+            with os.fdopen(ready_fd, "w") as ready:
+                ready.write(json.dumps(info) + "\n")
+        app.start()
+        sys.exit(0)
+
+    class Respawned(Exception):  # noqa: N818
+        """Raised in a spawned server to drop the rest of its parent’s work."""
+
+    def spawn(client: Client, req_id: int, code: str, path: str, size: int) -> None:
+        """Fork a fork server that runs ``code`` on top of what we ran.
+
+        It serves the client that connects to the Unix socket at ``path``,
+        which can happen before or after it ran ``code``.
+        """
+        nonlocal sel, pool_size, daemon_path, profile
+        spawn_listener = socket.socket(socket.AF_UNIX)
+        spawn_listener.bind(path)
+        spawn_listener.listen(1)
+        if child_pid := os.fork():
+            spawn_listener.close()
+            reply(client, req_id, {"pid": child_pid})
+            return
+
+        unwatch()
+        for state in (exit_codes, waiting, deadlines, killed):
+            state.clear()
+        if any(c.sock is None for c in clients):  # release our parent’s stdio pipes
+            with Path(os.devnull).open("r+b") as null:
+                os.dup2(null.fileno(), sys.stdin.fileno())
+                os.dup2(null.fileno(), sys.stdout.fileno())
+        close_connections()
+        daemon_path = None
+        if "--profile" in sys.argv:
+            profile = cProfile.Profile(time.perf_counter)
+            profile.enable()
+        try:
+            exec(code, user_ns)  # noqa: S102
+        except BaseException:  # noqa: BLE001
+            failure = traceback.format_exc().encode()
+        else:
+            failure = None
+        sock, _ = spawn_listener.accept()
+        spawn_listener.close()
+        spawned = Client(sock.fileno(), sock.makefile("wb"), sock)
+        if failure is not None:
+            # instead of “ready”, so the client fails with the traceback
+            with suppress(OSError):
+                spawned.out.write(failure)
+                spawned.out.flush()
+            os._exit(1)
+        if profile is not None:
+            profile.disable()
+        if gc_freeze:
+            gc.freeze()
+        with suppress(OSError):  # e.g. a client that only wanted us to exit
+            spawned.out.write(b"ready\n")
+            spawned.out.flush()
+        clients.append(spawned)
+        pool_size = size
+        sel = selectors.DefaultSelector()
+        watch()
+        raise Respawned
+
+    def pool_key(argv: list[str], limits: KernelLimits) -> PoolKey:
+        """Remove the connection file, pooled kernels don’t know it in advance."""
+        if "-f" in argv:
+            i = argv.index("-f")
+            argv = [*argv[:i], *argv[i + 2 :]]
+        return tuple(argv), json.dumps(limits, sort_keys=True)
+
+    def fill_pool(key: PoolKey) -> None:
+        pool = pools.setdefault(key, deque())
+        while len(pool) < pool_size:
+            ready = os.pipe()
+            child_pid = fork_kernel(list(key[0]), json.loads(key[1]), ready=ready)
+            pool.append((child_pid, ready[0]))
+
+    def take(client: Client, req_id: int, key: PoolKey) -> None:
+        """Reply with a pooled kernel once it’s initialized, without blocking."""
+        prune_pools()
+        if not (pool := pools.get(key)):
+            reply(client, req_id, {"kernel": None})
+            return
+        pid, ready_fd = pool.popleft()
+        sel.register(ready_fd, selectors.EVENT_READ, (client, req_id, key, pid))
+
+    def adopt(ready_fd: int, taken: tuple[Client, int, PoolKey, int]) -> None:
+        client, req_id, key, pid = taken
+        sel.unregister(ready_fd)
+        with os.fdopen(ready_fd) as ready:
+            line = ready.readline()
+        if client not in clients:  # nobody will use it
+            with suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGKILL)
+            line = ""
+        if not line:  # died while starting up
+            discard(pid, key)
+            if client in clients:
+                take(client, req_id, key)
+            return
+        hand_out(pid, json.loads(key[1]))
+        kernel: PooledKernel = {"pid": pid, "connection": json.loads(line)}
+        reply(client, req_id, {"kernel": kernel})
+
+    def ipc_prefix(argv: Sequence[str], pid: int) -> str | None:
+        """Return a unique path prefix for a pooled kernel’s IPC endpoints.
+
+        It’s based on the one passed as ``--ip``, which is in our client’s
+        directory for IPC endpoints. Returns None for TCP kernels.
+        """
+        if "--transport=ipc" not in argv:
+            return None
+        ip = next(a.removeprefix("--ip=") for a in argv if a.startswith("--ip="))
+        return f"{ip}-{pid}"
+
+    def discard(pid: int, key: PoolKey) -> None:
+        """Forget a pooled kernel: its output, and IPC endpoints if any."""
+        if (log := logs.pop(pid, None)) is not None:
+            log.close()
+        if (prefix := ipc_prefix(key[0], pid)) is not None:
+            for endpoint in Path(prefix).parent.glob(f"{Path(prefix).name}-*"):
+                endpoint.unlink(missing_ok=True)
+
+    def prune_pools() -> None:
+        """Kill pooled kernels whose IPC endpoints were removed.
+
+        Our client removes its directory for them at the end of a build,
+        so a daemon’s kernels pooled for that build can’t be used anymore.
+        """
+        for key, pool in list(pools.items()):
+            prefix = ipc_prefix(key[0], 0)
+            if prefix is None or Path(prefix).parent.is_dir():
                 continue
-            launch(list(msg["argv"]), msg["log"])
+            del pools[key]
+            for pid, ready_fd in pool:
+                with suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGKILL)
+                os.close(ready_fd)
+                discard(pid, key)
+
+    def hand_out(pid: int, limits: KernelLimits) -> None:
+        """Start the wall time of a kernel that is being handed out."""
+        if wall_time := limits.get("wall_time"):
+            deadlines[pid] = time.monotonic() + wall_time
+
+    def enforce_deadlines() -> float | None:
+        """Kill kernels past their deadline, return seconds until the next one."""
+        now = time.monotonic()
+        for pid, deadline in list(deadlines.items()):
+            if pid in exit_codes:
+                del deadlines[pid]
+            elif deadline <= now:
+                del deadlines[pid]
+                killed[pid] = "wall_time"
+                with suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGKILL)
+        return min(deadlines.values()) - now if deadlines else None
+
+    def preload_profile(top: int) -> PreloadProfile | None:
+        """Return the ``top`` modules our preload imported and functions it called."""
+        nonlocal profile
+        if profile is None:
+            return None
+        stats = pstats.Stats(profile)
+        profile = None  # only report it once, e.g. to the first client of a daemon
+        files = {
+            getattr(module, "__file__", None): name
+            for name, module in list(sys.modules.items())
+        }
+        modules: list[tuple[str, float]] = []
+        calls: list[tuple[str, float]] = []
+        for (path, line, func), (*_, cumtime, _) in stats.stats.items():
+            if path.startswith("<frozen ") or func in IMPORT_MACHINERY:
+                continue  # importing modules is what their `<module>` entries are for
+            if func == "<module>":
+                modules.append((files.get(path, path), cumtime))
+            elif path == "~":  # built-in
+                calls.append((func, cumtime))
+            else:
+                calls.append((f"{files.get(path, path)}:{line}({func})", cumtime))
+        # peak resident memory, which is in KiB on Linux and bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {
+            "pid": os.getpid(),
+            "seconds": stats.total_tt,
+            "max_rss": max_rss if sys.platform == "darwin" else max_rss * 1024,
+            "modules": sorted(modules, key=lambda m: m[1], reverse=True)[:top],
+            "calls": sorted(calls, key=lambda c: c[1], reverse=True)[:top],
+        }
+
+    def exit_status(pid: int) -> Resp:
+        """Exit code of a kernel, the limit it exceeded, and its output if it failed.
 
-        if msg["cmd"] == "exit_code":
-            code = exit_codes.get(msg["pid"])
+        Once a kernel’s exit code is reported, it is forgotten.
+        """
+        code = exit_codes.pop(pid, None)
+        limit = killed.get(pid)
+        if code is not None:
+            killed.pop(pid, None)
+            deadlines.pop(pid, None)
+        if code == -signal.SIGXCPU:
+            limit = "cpu_time"
+        output = None
+        if code is not None and (log := logs.pop(pid, None)) is not None:
+            log.read()
+            log.close()
+            if code != 0:
+                output = log.tail.decode(errors="replace")
+        return {"code": code, "limit": limit, "output": output}
+
+    def reply(client: Client, req_id: int | None, resp: Resp) -> None:
+        msg = resp if req_id is None else {"id": req_id, **resp}
+        with suppress(OSError):  # a daemon’s client may have gone away
+            client.out.write(json.dumps(msg).encode() + b"\n")
+            client.out.flush()
+
+    def handle(msg: Cmd, req_id: int, client: Client) -> None:
+        if msg["cmd"] == "fork":
+            child_pid = fork_kernel(
+                list(msg["argv"]), msg["limits"], connection=msg["connection"]
+            )
+            hand_out(child_pid, msg["limits"])
+            reply(client, req_id, {"pid": child_pid})
+        elif msg["cmd"] == "spawn":
+            spawn(client, req_id, msg["code"], msg["socket"], msg["pool_size"])
+        elif msg["cmd"] == "take":
+            key = pool_key(list(msg["argv"]), msg["limits"])
+            take(client, req_id, key)
+            fill_pool(key)  # kernels initialize in the background
+        elif msg["cmd"] == "exit_code":
+            reply(client, req_id, exit_status(msg["pid"]))
+        elif msg["cmd"] == "profile":
+            reply(client, req_id, {"profile": preload_profile(msg["top"])})
         elif msg["cmd"] == "wait":
-            while (code := exit_codes.get(msg["pid"])) is None:
-                signal.pause()  # wait until `SIGCHLD` triggers the handler above
-        json.dump({"code": code}, sys.stdout)
-        sys.stdout.write("\n")
-        sys.stdout.flush()
+            waiting.setdefault(msg["pid"], []).append((client, req_id))
+
+    def accept(sock: socket.socket) -> None:
+        conn, _ = sock.accept()
+        client = Client(conn.fileno(), conn.makefile("wb"), conn)
+        clients.append(client)
+        sel.register(client.fd, selectors.EVENT_READ, client)
+        # lets the client know who we are, e.g. to measure our memory
+        reply(client, None, {"pid": os.getpid()})
+
+    def drop(client: Client) -> None:
+        nonlocal idle_since
+        sel.unregister(client.fd)
+        client.close()
+        clients.remove(client)
+        for pid, reqs in list(waiting.items()):
+            waiting[pid] = [r for r in reqs if r[0] is not client]
+            if not waiting[pid]:
+                del waiting[pid]
+        idle_since = time.monotonic()
+
+    def receive(client: Client) -> bool:
+        """Handle commands from ``client``, return False if our only client left."""
+        try:
+            chunk = os.read(client.fd, 1 << 16)
+        except ConnectionResetError:
+            chunk = b""
+        if not chunk:
+            if listener is None:
+                return False
+            drop(client)
+            return True
+        *lines, client.buf = (client.buf + chunk).split(b"\n")
+        for line in lines:
+            msg = json.loads(line)
+            handle(msg, msg.pop("id"), client)
+        return True
+
+    def answer_waits() -> None:
+        """Answer `wait`s for kernels that exited."""
+        for pid in [pid for pid in waiting if pid in exit_codes]:
+            status = exit_status(pid)
+            for client, req_id in waiting.pop(pid):
+                reply(client, req_id, status)
+
+    def serve() -> bool:
+        """Handle whatever is ready, return False once we should exit.
+
+        That is when our client is gone or asks us to stop using `SIGTERM`,
+        or, for a daemon, when it had no clients for `idle_timeout` seconds.
+        """
+        timeout = enforce_deadlines()
+        if listener is not None and idle_timeout and not clients:
+            idle_left = idle_since + idle_timeout - time.monotonic()
+            timeout = min(idle_left, timeout if timeout is not None else idle_left)
+        for key, _ in sel.select(None if timeout is None else max(timeout, 0)):
+            if key.fd == wakeup_r:
+                with suppress(BlockingIOError):
+                    while os.read(wakeup_r, 4096):
+                        pass
+            elif key.data is listener:
+                accept(listener)
+            elif isinstance(key.data, Client):
+                if not receive(key.data):
+                    return False
+            elif isinstance(key.data, KernelLog):
+                key.data.read()
+            else:
+                adopt(key.fd, key.data)
+        answer_waits()
+        if listener is not None and idle_timeout and not clients:
+            return time.monotonic() < idle_since + idle_timeout and not stopping
+        return not stopping
+
+    while True:
+        try:
+            if not serve():
+                break
+        except Respawned:
+            pass
+
+    # nobody will take the remaining pooled kernels
+    leftover = [(key, *kernel) for key, pool in pools.items() for kernel in pool]
+    for k in sel.get_map().values():
+        if isinstance(k.data, tuple):  # taken, but not initialized yet
+            _, _, key, pid = k.data
+            leftover.append((key, pid, k.fd))
+    for key, pid, ready_fd in leftover:
+        with suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGKILL)
+        with suppress(OSError):
+            os.close(ready_fd)
+        discard(pid, key)
+    if listener is not None and daemon_path is not None:
+        Path(daemon_path).unlink(missing_ok=True)
 
 
 if __name__ == "__main__":
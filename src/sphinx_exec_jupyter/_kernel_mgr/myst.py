@@ -7,10 +7,12 @@ from functools import partial
 from typing import TYPE_CHECKING
 
 import jupyter_cache.executors.utils
+from nbclient import NotebookClient
 
 if TYPE_CHECKING:
     from collections.abc import Generator
 
+    from nbformat import NotebookNode
     from sphinx.config import Config
 
 
@@ -24,27 +26,38 @@ def maybe_patch_myst_nb(
     """Patch myst-nb if needed.
 
     if `is_local` is False, respect `config.exec_jupyter_patch_myst_nb`.
+    This only affects notebooks myst-nb executes itself,
+    the directives pass their kernel manager to each notebook client instead.
     """
     code = code or config.exec_jupyter_code
     do_patch = (is_local or config.exec_jupyter_patch_myst_nb) and code
-    with patch_myst_nb(code) if do_patch else nullcontext():
+    pool_size = config.exec_jupyter_kernel_pool_size
+    with patch_myst_nb(code, pool_size=pool_size) if do_patch else nullcontext():
         yield
 
 
 @contextmanager
-def patch_myst_nb(code: str) -> Generator[None]:
-    from . import ForkingKernelManager  # noqa: PLC0415
-
-    class F(ForkingKernelManager):
-        def __init__(self, *args: object, **kwargs: object) -> None:
-            super().__init__(code, *args, **kwargs)
+def patch_myst_nb(code: str, *, pool_size: int = 0) -> Generator[None]:
+    from . import kernel_manager_class  # noqa: PLC0415
 
     orig_executenb = jupyter_cache.executors.utils.executenb
     jupyter_cache.executors.utils.executenb = partial(
-        orig_executenb, kernel_manager_class=F
+        _executenb,
+        kernel_manager_class=kernel_manager_class(code, pool_size=pool_size),
     )
 
     try:
         yield
     finally:
         jupyter_cache.executors.utils.executenb = orig_executenb
+
+
+def _executenb(
+    nb: NotebookNode, cwd: str | None = None, **kwargs: object
+) -> NotebookNode:
+    """Like :func:`nbclient.execute`, but in the fork servers’ event loop."""
+    from . import run_in_server_loop  # noqa: PLC0415
+
+    resources = {} if cwd is None else {"metadata": {"path": cwd}}
+    client = NotebookClient(nb=nb, resources=resources, **kwargs)
+    return run_in_server_loop(client.async_execute())
@@ -0,0 +1,26 @@
+# SPDX-License-Identifier: MPL-2.0
+"""Redo HoloViews’ notebook extension for the kernel’s real shell."""
+
+from __future__ import annotations
+
+
+def _reactivate_holoviews() -> None:
+    import sys
+
+    if "holoviews" not in sys.modules:
+        return
+    import holoviews as hv
+
+    # backends loaded by the preload code, in a shell that was discarded
+    if not (backends := list(hv.Store.renderers)):
+        return
+    if get_ipython() is None:  # noqa: F821
+        return
+
+    current = hv.Store.current_backend
+    hv.extension(*backends)
+    hv.Store.set_current_backend(current)
+
+
+_reactivate_holoviews()
+del _reactivate_holoviews
@@ -0,0 +1,112 @@
+# SPDX-License-Identifier: MPL-2.0
+"""Report how much memory kernels share with the fork server they came from.
+
+Right before a forked kernel is shut down, its unique (USS), proportional (PSS),
+and resident (RSS) set sizes are measured, along with its fork server’s RSS.
+Pages a kernel still shares with its server are in its RSS, but not its USS.
+"""
+
+from __future__ import annotations
+
+from contextlib import suppress
+from typing import TYPE_CHECKING, TypedDict, cast
+
+from sphinx.util import logging
+
+if TYPE_CHECKING:
+    from collections.abc import Set as AbstractSet
+
+    from sphinx.application import Sphinx
+    from sphinx.environment import BuildEnvironment
+
+    class MemoryEnv(BuildEnvironment):
+        exec_jupyter_memory: dict[str, list[KernelMemory]]
+
+
+__all__ = ["KernelMemory", "measure_kernel", "record_memory"]
+
+logger = logging.getLogger(__name__)
+
+MIB = 2**20
+
+
+class KernelMemory(TypedDict):
+    """Memory of a kernel and its fork server in bytes."""
+
+    uss: int
+    pss: int
+    rss: int
+    server_rss: int
+
+
+def measure_kernel(pid: int, server_pid: int) -> KernelMemory | None:
+    """Measure a kernel’s memory, or return None if ``psutil`` can’t."""
+    try:
+        import psutil  # noqa: PLC0415
+    except ImportError:
+        return None
+    # USS and PSS are only available on Linux
+    with suppress(psutil.Error, AttributeError):
+        info = psutil.Process(pid).memory_full_info()
+        server_rss = psutil.Process(server_pid).memory_info().rss
+        return KernelMemory(
+            uss=info.uss, pss=info.pss, rss=info.rss, server_rss=server_rss
+        )
+    return None
+
+
+def record_memory(env: BuildEnvironment, memory: list[KernelMemory]) -> None:
+    """Store the memory of the current document’s kernels for the report."""
+    if memory:
+        docs = cast("MemoryEnv", env).exec_jupyter_memory
+        docs.setdefault(env.docname, []).extend(memory)
+
+
+def reset_memory(app: Sphinx, env: BuildEnvironment, docnames: list[str]) -> None:  # noqa: ARG001
+    cast("MemoryEnv", env).exec_jupyter_memory = {}
+
+
+def merge_memory(
+    app: Sphinx,  # noqa: ARG001
+    env: BuildEnvironment,
+    docnames: AbstractSet[str],  # noqa: ARG001
+    other: BuildEnvironment,
+) -> None:
+    memory = cast("MemoryEnv", env).exec_jupyter_memory
+    memory.update(cast("MemoryEnv", other).exec_jupyter_memory)
+
+
+def report_memory(app: Sphinx, exc: Exception | None) -> None:
+    """Log how much memory kernels shared with their fork servers."""
+    docs: dict[str, list[KernelMemory]] = getattr(app.env, "exec_jupyter_memory", {})
+    if exc is not None or not docs:
+        return
+    if not (n := app.config.exec_jupyter_memory_report):
+        return
+
+    kernels = sorted(
+        ((docname, m) for docname, ms in docs.items() for m in ms),
+        key=lambda item: item[1]["uss"],
+        reverse=True,
+    )
+    memory = [m for _, m in kernels]
+    uss = sum(m["uss"] for m in memory) / len(memory) / MIB
+    pss = sum(m["pss"] for m in memory) / len(memory) / MIB
+    shared = sum(m["rss"] - m["uss"] for m in memory)
+    server_rss = sum(m["server_rss"] for m in memory)
+    # servers that exited before they were measured have no RSS to share
+    ratio = ""
+    if server_rss:
+        ratio = f", {shared / server_rss:.0%} of fork server RSS shared"
+    header = (
+        f"exec-jupyter: memory of {len(memory)} forked kernels "
+        f"(mean USS {uss:.1f} MiB, mean PSS {pss:.1f} MiB{ratio}), largest:"
+    )
+    lines = [header]
+    lines.extend(
+        f"  USS {m['uss'] / MIB:7.1f} MiB, PSS {m['pss'] / MIB:7.1f} MiB, "
+        f"shares {(m['rss'] - m['uss']) / MIB:7.1f} "
+        f"of {m['server_rss'] / MIB:7.1f} MiB server RSS: {docname}"
+        for docname, m in kernels[:n]
+    )
+    logger.info("\n".join(lines))
@@ -18,6 +18,8 @@ class PendingExecNode(nodes.General, nodes.Element):
         code strings to execute as notebook cells
     hv_backends
         HoloViews backend names, or None for plain exec-jupyter
+    timeout
+        Timeout for each of the cells in seconds, or None for the default
 
     """
 
@@ -27,5 +29,8 @@ class PendingExecNode(nodes.General, nodes.Element):
     @overload
     def __getitem__(self, key: Literal["hv_backends"]) -> list[str] | None: ...
 
+    @overload
+    def __getitem__(self, key: Literal["timeout"]) -> int | None: ...
+
     def __getitem__(self, key: str) -> object:
         return super().__getitem__(key)
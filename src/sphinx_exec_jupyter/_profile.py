@@ -0,0 +1,47 @@
+# SPDX-License-Identifier: MPL-2.0
+"""Report what fork servers spend their time on while running the preload code.
+
+Fork servers run their preload code under :mod:`cProfile`.
+Each module’s top-level code counts as importing it,
+so the slowest modules are ranked by cumulative import time,
+the slowest functions by cumulative call time.
+"""
+
+from __future__ import annotations
+
+from typing import TypedDict
+
+from sphinx.util import logging
+
+__all__ = ["PreloadProfile", "report_profile"]
+
+logger = logging.getLogger(__name__)
+
+MIB = 2**20
+
+
+class PreloadProfile(TypedDict):
+    """Where a fork server’s preload code spent its time, in seconds."""
+
+    pid: int
+    seconds: float
+    #: peak resident memory of the server after running the code, in bytes
+    max_rss: int
+    #: the slowest modules to import, by name (or path)
+    modules: list[tuple[str, float]]
+    #: the slowest functions to call, as ``module:line(function)``
+    calls: list[tuple[str, float]]
+
+
+def report_profile(profile: PreloadProfile, code: str) -> None:
+    """Log where the preload ``code`` of a fork server spent its time."""
+    first_line = next((line for line in code.splitlines() if line.strip()), "")
+    header = (
+        f"exec-jupyter: preload code {first_line!r}… of fork server {profile['pid']} "
+        f"took {profile['seconds']:.2f} s, peak RSS {profile['max_rss'] / MIB:.1f} MiB"
+    )
+    lines = [header, "  slowest imports:"]
+    lines.extend(f"    {secs:7.3f} s  {name}" for name, secs in profile["modules"])
+    lines.append("  slowest calls:")
+    lines.extend(f"    {secs:7.3f} s  {name}" for name, secs in profile["calls"])
+    logger.info("\n".join(lines))
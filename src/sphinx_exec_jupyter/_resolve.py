@@ -5,21 +5,41 @@ from contextlib import suppress
 from itertools import islice
 from typing import TYPE_CHECKING, cast, override
 
+from sphinx.environment.collectors.asset import DownloadFileCollector, ImageCollector
+from sphinx.environment.collectors.dependencies import DependenciesCollector
 from sphinx.transforms import SphinxTransform
+from sphinx.util.docutils import LoggingReporter
 
-from ._kernel_mgr import maybe_patch_myst_nb
+from ._blobs import externalize_outputs
+from ._cache import cache_key
+from ._execute import ExecutionMonitor
 from ._pending import PendingExecNode
-from .common import execute_cells
+from ._schedule import get_scheduler
+from .common import (
+    _python_notebook,
+    execute_cells,
+    is_cached,
+    output_budget,
+    output_options,
+)
 
 with suppress(ImportError):
     from .holoviews._directive import hv_preload, process_hv_results
 
 if TYPE_CHECKING:
+    from docutils import nodes
     from myst_nb.sphinx_ import SphinxEnvType
+    from sphinx.application import Sphinx
+    from sphinx.config import Config
+    from sphinx.environment import BuildEnvironment
 
 
 class ExecPendingNodes(SphinxTransform):
-    """Replace PendingExecNode placeholders with executed notebook output nodes."""
+    """Replace PendingExecNode placeholders with executed notebook output nodes.
+
+    With concurrent execution enabled, the notebook is submitted instead,
+    and the placeholders are replaced in :func:`resolve_deferred`.
+    """
 
     default_priority = 500
 
@@ -29,23 +49,101 @@ class ExecPendingNodes(SphinxTransform):
         if not pending:
             return
 
-        if hv_backends := {
-            backend for node in pending for backend in node["hv_backends"] or ()
-        }:
-            code = hv_preload(hv_backends, self.config.exec_jupyter_code)
-        else:
-            code = None
-
-        all_cells = [c for node in pending for c in node["cells"]]
-        with maybe_patch_myst_nb(self.config, code=code):
-            all_results = execute_cells(
-                all_cells, self.document, kernel_name=self.config.exec_jupyter_kernel
+        env = cast("SphinxEnvType", self.env)
+        cells, code, timeouts = _notebook_source(pending, self.config)
+        kernel_name = self.config.exec_jupyter_kernel
+        options = output_options(env)
+        key = cache_key(cells, code=code, kernel_name=kernel_name, options=options)
+        if (
+            (scheduler := get_scheduler()) is not None
+            and env.mystnb_config.execution_mode != "off"
+            and not is_cached(env, key)
+        ):
+            scheduler.submit(
+                key,
+                _python_notebook(cells, kernel_name, timeouts),
+                code=code,
+                nb_config=env.mystnb_config,
+                monitor=ExecutionMonitor(budget=output_budget(env)),
+                pool_size=self.config.exec_jupyter_kernel_pool_size,
             )
+            scheduler.defer(key, env.docname, self.document)
+            return
 
-        env = cast("SphinxEnvType", self.env)
-        it = iter(all_results)
-        for node in pending:
-            results = list(islice(it, len(node["cells"])))
-            if node["hv_backends"] is not None:
-                results = process_hv_results(results, node["hv_backends"], env)
-            node.replace_self(results)
+        _resolve(pending, self.document, cells=cells, code=code, timeouts=timeouts)
+
+
+def resolve_deferred(app: Sphinx, env: BuildEnvironment) -> None:
+    """Fill in results of notebooks executed while other documents were read.
+
+    Documents are resolved and their doctrees written as their notebooks finish.
+    Of the environment collectors, which ran before the outputs were added,
+    those that outputs matter to run again: the ones for images, downloads,
+    and dependencies recorded while rendering the outputs.
+    Outputs can’t add titles, sections, or metadata, so the others don’t.
+    """
+    if (scheduler := get_scheduler()) is None:
+        return
+    for docname, document in scheduler.take_deferred():
+        # restore the state `Builder.write_doctree` stripped
+        current_document = env.current_document
+        env.prepare_settings(docname)
+        document.settings.env = env
+        document.reporter = LoggingReporter(str(env.doc2path(docname)))
+        try:
+            pending = list(document.findall(PendingExecNode))
+            cells, code, timeouts = _notebook_source(pending, env.config)
+            _resolve(pending, document, cells=cells, code=code, timeouts=timeouts)
+            # outputs weren’t in the document when the collectors ran
+            for collector in (
+                ImageCollector(),
+                DownloadFileCollector(),
+                DependenciesCollector(),
+            ):
+                collector.process_doc(app, document)
+            externalize_outputs(app, document)
+        finally:
+            env.current_document = current_document
+        app.builder.write_doctree(docname, document)
+
+
+def _notebook_source(
+    pending: list[PendingExecNode], config: Config
+) -> tuple[list[str], str, list[int | None]]:
+    """Return all cells, preload code, and cell timeouts for a document’s notebook."""
+    if hv_backends := {
+        backend for node in pending for backend in node["hv_backends"] or ()
+    }:
+        code = hv_preload(hv_backends, config.exec_jupyter_code)
+    else:
+        code = config.exec_jupyter_code
+    cells = [c for node in pending for c in node["cells"]]
+    timeouts = [node.get("timeout") for node in pending for _ in node["cells"]]
+    return cells, code, timeouts
+
+
+def _resolve(
+    pending: list[PendingExecNode],
+    document: nodes.document,
+    *,
+    cells: list[str],
+    code: str,
+    timeouts: list[int | None],
+) -> None:
+    env = cast("SphinxEnvType", document.settings.env)
+    all_results = execute_cells(
+        cells,
+        document,
+        kernel_name=env.config.exec_jupyter_kernel,
+        code=code,
+        timeouts=timeouts,
+    )
+
+    it = iter(all_results)
+    for node in pending:
+        results = list(islice(it, len(node["cells"])))
+        if node["hv_backends"] is not None:
+            results = process_hv_results(
+                results, node["hv_backends"], env, preloads=[code]
+            )
+        node.replace_self(results)
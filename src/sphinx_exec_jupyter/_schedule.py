@@ -0,0 +1,140 @@
+# SPDX-License-Identifier: MPL-2.0
+"""Execute per-document notebooks concurrently while Sphinx keeps reading."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from concurrent.futures import as_completed
+from dataclasses import dataclass, field
+from tempfile import TemporaryDirectory
+from typing import TYPE_CHECKING
+
+from ._execute import execute_notebook, notebook_client
+from ._kernel_mgr import kernel_manager_class, server_loop
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from concurrent.futures import Future
+
+    from docutils import nodes
+    from jupyter_cache.executors.utils import ExecutionResult
+    from myst_nb.core.config import NbParserConfig
+    from nbformat import NotebookNode
+    from sphinx.application import Sphinx
+
+    from ._execute import ExecutionMonitor
+
+
+__all__ = ["ExecutionScheduler", "get_scheduler"]
+
+
+#: Schedulers by process ID, so forked parallel readers don’t use their parent’s
+_SCHEDULERS: dict[int, ExecutionScheduler] = {}
+
+
+@dataclass
+class ExecutionScheduler:
+    """Executes notebooks in the background, at most ``max_workers`` at once.
+
+    Documents whose notebooks are executing are held until :meth:`take_deferred`,
+    so their placeholders can be replaced once all documents have been read.
+    """
+
+    max_workers: int
+    _slots: asyncio.Semaphore = field(init=False)
+    _futures: dict[str, Future[ExecutionResult]] = field(
+        init=False, default_factory=dict
+    )
+    _monitors: dict[str, ExecutionMonitor] = field(init=False, default_factory=dict)
+    #: Documents waiting for a notebook, by its key
+    _deferred: dict[str, list[tuple[str, nodes.document]]] = field(
+        init=False, default_factory=dict
+    )
+
+    def __post_init__(self) -> None:
+        self._slots = asyncio.Semaphore(self.max_workers)
+
+    def submit(  # noqa: PLR0913
+        self,
+        key: str,
+        notebook: NotebookNode,
+        *,
+        code: str,
+        nb_config: NbParserConfig,
+        monitor: ExecutionMonitor,
+        pool_size: int = 0,
+    ) -> None:
+        """Start executing ``notebook`` unless one with the same ``key`` was."""
+        if key in self._futures:
+            return
+        self._monitors[key] = monitor
+        coro = self._execute(
+            notebook,
+            code=code,
+            nb_config=nb_config,
+            pool_size=pool_size,
+            monitor=monitor,
+        )
+        self._futures[key] = asyncio.run_coroutine_threadsafe(coro, server_loop())
+
+    def result(self, key: str) -> ExecutionResult | None:
+        """Wait for a submitted notebook’s result, or return None if not submitted."""
+        if (future := self._futures.get(key)) is None:
+            return None
+        return future.result()
+
+    def monitor(self, key: str) -> ExecutionMonitor:
+        """Return the monitor of a submitted notebook’s execution."""
+        return self._monitors[key]
+
+    def defer(self, key: str, docname: str, document: nodes.document) -> None:
+        """Hold ``document`` until the submitted notebook with ``key`` is executed."""
+        self._deferred.setdefault(key, []).append((docname, document))
+
+    def take_deferred(self) -> Iterator[tuple[str, nodes.document]]:
+        """Yield held documents and their names as their notebooks finish executing."""
+        deferred, self._deferred = self._deferred, {}
+        by_future = {self._futures[key]: docs for key, docs in deferred.items()}
+        for future in as_completed(by_future):
+            yield from by_future[future]
+
+    def cancel(self) -> None:
+        for future in self._futures.values():
+            future.cancel()
+
+    async def _execute(
+        self,
+        notebook: NotebookNode,
+        *,
+        code: str,
+        nb_config: NbParserConfig,
+        pool_size: int,
+        monitor: ExecutionMonitor,
+    ) -> ExecutionResult:
+        km_class = kernel_manager_class(code, pool_size=pool_size) if code else None
+        async with self._slots:
+            with TemporaryDirectory() as cwd, monitor.active():
+                client = notebook_client(
+                    notebook,
+                    cwd=cwd,
+                    nb_config=nb_config,
+                    monitor=monitor,
+                    km_class=km_class,
+                )
+                return await execute_notebook(client)
+
+
+def get_scheduler() -> ExecutionScheduler | None:
+    """Return the current build’s scheduler, if concurrent execution is enabled."""
+    return _SCHEDULERS.get(os.getpid())
+
+
+def start_scheduler(app: Sphinx) -> None:
+    if max_workers := app.config.exec_jupyter_max_workers:
+        _SCHEDULERS[os.getpid()] = ExecutionScheduler(max_workers)
+
+
+def stop_scheduler(app: Sphinx, exc: Exception | None) -> None:  # noqa: ARG001
+    if scheduler := _SCHEDULERS.pop(os.getpid(), None):
+        scheduler.cancel()
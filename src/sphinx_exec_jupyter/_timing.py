@@ -0,0 +1,215 @@
+# SPDX-License-Identifier: MPL-2.0
+"""Record where time goes when executing and rendering documents’ notebooks."""
+
+from __future__ import annotations
+
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, TypedDict, cast
+
+from sphinx.util import logging
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Generator
+    from collections.abc import Set as AbstractSet
+
+    from nbformat import NotebookNode
+    from sphinx.application import Sphinx
+    from sphinx.environment import BuildEnvironment
+
+    class TimingsEnv(BuildEnvironment):
+        exec_jupyter_timings: dict[str, DocumentTimings]
+
+
+__all__ = [
+    "PHASES",
+    "CellTiming",
+    "DocumentTimings",
+    "ExecutionTimer",
+    "mark",
+    "record_timings",
+]
+
+logger = logging.getLogger(__name__)
+
+#: Phases of a document’s execution, in order
+PHASES = ("server", "launch", "kernel_info", "execute", "render")
+
+REPORT_NAME = "exec-jupyter-timings.json"
+
+
+class CellTiming(TypedDict):
+    index: int
+    source: str
+    seconds: float
+
+
+class DocumentTimings(TypedDict):
+    cached: bool
+    total: float
+    phases: dict[str, float]
+    cells: list[CellTiming]
+
+
+@dataclass
+class ExecutionTimer:
+    """Durations of one notebook’s execution phases (see `PHASES`) and cells.
+
+    Each call to :meth:`mark` ends a phase that started at the previous call.
+
+    Attributes
+    ----------
+    phases
+        Seconds spent in each phase that was marked
+    cells
+        Seconds spent executing each cell, by index
+    last_cell
+        Index of the cell that started executing last,
+        i.e. the one that failed if execution failed
+
+    """
+
+    phases: dict[str, float] = field(default_factory=dict)
+    cells: dict[int, float] = field(default_factory=dict)
+    last_cell: int | None = None
+    _last: float | None = field(init=False, default=None, repr=False)
+    _cell_start: float | None = field(init=False, default=None, repr=False)
+
+    def mark(self, phase: str | None = None) -> None:
+        """End ``phase`` now, or just start timing if ``phase`` is None."""
+        now = time.perf_counter()
+        if phase is not None and self._last is not None:
+            self.phases[phase] = self.phases.get(phase, 0) + now - self._last
+        self._last = now
+
+    @contextmanager
+    def active(self) -> Generator[None]:
+        """Let kernel launches in this context :func:`mark` phases on this timer."""
+        self.mark()
+        token = _CURRENT.set(self)
+        try:
+            yield
+        finally:
+            _CURRENT.reset(token)
+
+    def hooks(self) -> dict[str, Callable[..., None]]:
+        """`nbclient.NotebookClient` hooks that mark kernel readiness and cells."""
+        return dict(
+            on_notebook_start=self._on_notebook_start,
+            on_notebook_complete=self._on_notebook_complete,
+            on_cell_start=self._on_cell_start,
+            on_cell_executed=self._on_cell_executed,
+        )
+
+    def _on_notebook_start(self, **_: object) -> None:
+        self.mark("kernel_info")
+
+    def _on_notebook_complete(self, **_: object) -> None:
+        self.mark("execute")
+
+    def _on_cell_start(self, *, cell_index: int, **_: object) -> None:
+        self._cell_start = time.perf_counter()
+        self.last_cell = cell_index
+
+    def _on_cell_executed(self, *, cell_index: int, **_: object) -> None:
+        if self._cell_start is not None:
+            self.cells[cell_index] = time.perf_counter() - self._cell_start
+            self._cell_start = None
+
+
+_CURRENT: ContextVar[ExecutionTimer | None] = ContextVar(
+    "exec_jupyter_timer", default=None
+)
+
+
+def mark(phase: str) -> None:
+    """End ``phase`` of the execution timed in the current context, if any."""
+    if (timer := _CURRENT.get()) is not None:
+        timer.mark(phase)
+
+
+def record_timings(
+    env: BuildEnvironment,
+    timer: ExecutionTimer,
+    notebook: NotebookNode,
+    *,
+    cached: bool,
+) -> None:
+    """Store the current document’s timings for the report at the end of the build.
+
+    Documents executing several notebooks accumulate the timings of all of them.
+    """
+    timings = cast("TimingsEnv", env).exec_jupyter_timings
+    doc = timings.setdefault(
+        env.docname, DocumentTimings(cached=cached, total=0, phases={}, cells=[])
+    )
+    doc["cached"] = doc["cached"] and cached
+    doc["total"] += sum(timer.phases.values())
+    phases = {p: doc["phases"].get(p, 0) + timer.phases.get(p, 0) for p in PHASES}
+    doc["phases"] = {
+        p: seconds
+        for p, seconds in phases.items()
+        if p in doc["phases"] or p in timer.phases
+    }
+    doc["cells"].extend(
+        CellTiming(
+            index=i,
+            source=notebook.cells[i].source.strip().partition("\n")[0],
+            seconds=seconds,
+        )
+        for i, seconds in sorted(timer.cells.items())
+        if i < len(notebook.cells)
+    )
+
+
+def reset_timings(app: Sphinx, env: BuildEnvironment, docnames: list[str]) -> None:  # noqa: ARG001
+    cast("TimingsEnv", env).exec_jupyter_timings = {}
+
+
+def merge_timings(
+    app: Sphinx,  # noqa: ARG001
+    env: BuildEnvironment,
+    docnames: AbstractSet[str],  # noqa: ARG001
+    other: BuildEnvironment,
+) -> None:
+    timings = cast("TimingsEnv", env).exec_jupyter_timings
+    timings.update(cast("TimingsEnv", other).exec_jupyter_timings)
+
+
+def report_timings(app: Sphinx, exc: Exception | None) -> None:
+    """Log the slowest documents and cells, and write all timings to a JSON file."""
+    timings: dict[str, DocumentTimings] = getattr(app.env, "exec_jupyter_timings", {})
+    if exc is not None or not timings:
+        return
+    if not (n := app.config.exec_jupyter_timing_report):
+        return
+
+    report = Path(app.outdir) / REPORT_NAME
+    report.write_text(
+        json.dumps(dict(documents=timings), indent=2, sort_keys=True) + "\n",
+        encoding="utf-8",
+    )
+
+    docs = sorted(timings.items(), key=lambda item: item[1]["total"], reverse=True)
+    lines = [f"exec-jupyter: slowest documents (all timings in {report}):"]
+    for docname, doc in docs[:n]:
+        phases = ", ".join(f"{p} {s:.2f}s" for p, s in doc["phases"].items())
+        cached = ", cached" if doc["cached"] else ""
+        lines.append(f"  {doc['total']:7.2f}s {docname} ({phases}{cached})")
+
+    cells = sorted(
+        ((cell, docname) for docname, doc in timings.items() for cell in doc["cells"]),
+        key=lambda item: item[0]["seconds"],
+        reverse=True,
+    )
+    if cells:
+        lines.append("exec-jupyter: slowest cells:")
+    for cell, docname in cells[:n]:
+        where = f"{docname}[{cell['index']}]"
+        lines.append(f"  {cell['seconds']:7.2f}s {where}: {cell['source']}")
+
+    logger.info("\n".join(lines))
@@ -3,91 +3,415 @@
 
 from __future__ import annotations
 
-import shutil
-from contextlib import contextmanager
+import asyncio
+from contextlib import ExitStack
 from pathlib import Path
-from tempfile import mkdtemp
-from typing import TYPE_CHECKING, TypedDict, cast, override
+from tempfile import TemporaryDirectory
+from typing import TYPE_CHECKING, cast, override
 
-import myst_nb.sphinx_
+from docutils import nodes
+from myst_nb.core.execute import ExecutionError, NotebookClientBase
+from myst_nb.core.loggers import SphinxDocLogger
+from myst_nb.core.nb_to_tokens import notebook_to_tokens
+from myst_nb.core.render import load_renderer
+from myst_nb.sphinx_ import NbMetadataCollector, SphinxNbRenderer
+from myst_parser.parsers.mdit import create_md_parser
+from nbclient.exceptions import CellExecutionError, CellTimeoutError
 from nbformat import NotebookNode, v4
 
+from ._cache import cache_key, get_cache, record_cache_use
+from ._execute import (
+    DocumentOutput,
+    ExecutionMonitor,
+    OutputBudget,
+    cell_timeout,
+    execute_notebook,
+    notebook_client,
+)
+from ._kernel_mgr import kernel_manager_class, run_in_server_loop
+from ._memory import record_memory
+from ._schedule import get_scheduler
+from ._timing import record_timings
+
 if TYPE_CHECKING:
-    from collections.abc import Generator
+    from collections.abc import Sequence
 
-    from docutils import nodes
+    from jupyter_cache.executors.utils import ExecutionResult
+    from markdown_it.tree import SyntaxTreeNode
     from myst_nb.sphinx_ import SphinxEnvType
+    from nbclient import NotebookClient
+    from sphinx.environment import BuildEnvironment
 
+    from ._kernel_mgr import LimitName
 
-class ExtData(TypedDict, total=False):
-    """Document metadata added by us."""
-
-    count: int
+#: Metadata of cached notebooks: how much of the output budget they used
+OUTPUT_SIZE_KEY = "exec_jupyter_output_size"
 
 
 def execute_cells(
-    cells: list[str], document: nodes.document, *, kernel_name: str
+    cells: list[str],
+    document: nodes.document,
+    *,
+    kernel_name: str,
+    code: str | None = None,
+    timeouts: Sequence[int | None] = (),
 ) -> list[nodes.Element]:
-    """Execute code cells and return resulting docutils nodes, one per cell."""
-    notebook_json = v4.writes(_python_notebook(cells, kernel_name))
+    """Execute code cells and return resulting docutils nodes, one per cell.
 
-    # execute notebook and append resulting nodes to document
-    parser = myst_nb.sphinx_.Parser()
-    after_last_child = len(document.children)
-    with temp_source_code(document, notebook_json):
-        parser.parse(notebook_json, document)
+    ``code`` is the preload code to use instead of ``exec_jupyter_code``.
+    ``timeouts`` override ``nb_execution_timeout`` for the cells they’re not None for.
+    If the execution cache is enabled, outputs are reused from it when possible.
+    Notebooks already submitted to the execution scheduler are not run again.
+    """
+    env = cast("SphinxEnvType", document.settings.env)
+    code = code or env.config.exec_jupyter_code
+    options = output_options(env)
+    key = cache_key(cells, code=code, kernel_name=kernel_name, options=options)
+    monitor = ExecutionMonitor(budget=output_budget(env))
 
-    # extract nodes and restore document
-    executed = document.children[after_last_child:]
-    del document.children[after_last_child:]
-    for key in ["words", "minutes"]:
-        document.substitution_names.pop(f"wordcount-{key}", None)
-        document.substitution_defs.pop(f"wordcount-{key}", None)
+    notebook = _from_cache(env, key, monitor.budget)
+    cached = notebook is not None
+    if notebook is None:
+        if (scheduler := get_scheduler()) and (result := scheduler.result(key)):
+            notebook, monitor = result.nb, scheduler.monitor(key)
+        else:
+            notebook = _python_notebook(cells, kernel_name, timeouts)
+            result = _execute_notebook(notebook, env, code=code, monitor=monitor)
+        _report_result(result, document, key, monitor)
+        _report_overflows(monitor.budget, notebook, document)
 
-    return executed
+    return _render_timed(notebook, document, monitor, cached=cached)
 
 
-def _python_notebook(cells: list[str], kernel_name: str) -> NotebookNode:
-    return v4.new_notebook(
-        metadata=NotebookNode(
-            kernelspec=dict(name=kernel_name, display_name="", language="python"),
-            language_info=NotebookNode(name="python"),
-        ),
-        cells=[v4.new_code_cell(cell) for cell in cells],
+def execute_notebooks(
+    sources: Sequence[tuple[list[str], str]],
+    document: nodes.document,
+    *,
+    kernel_name: str,
+    timeouts: Sequence[int | None] = (),
+) -> list[list[nodes.Element]]:
+    """Execute notebooks concurrently and return each one’s rendered cells.
+
+    ``sources`` are pairs of code cells and the preload code to run them with,
+    each is executed in a kernel of its own.
+    ``timeouts`` apply to the cells of each notebook, see :func:`execute_cells`.
+    If the execution cache is enabled, outputs are reused from it when possible.
+    """
+    env = cast("SphinxEnvType", document.settings.env)
+    options = output_options(env)
+    keys = [
+        cache_key(cells, code=code, kernel_name=kernel_name, options=options)
+        for cells, code in sources
+    ]
+    monitors = [ExecutionMonitor(budget=output_budget(env)) for _ in sources]
+    notebooks = [
+        _from_cache(env, key, monitor.budget)
+        for key, monitor in zip(keys, monitors, strict=True)
+    ]
+    cached = [notebook is not None for notebook in notebooks]
+
+    jobs = {
+        i: (_python_notebook(cells, kernel_name, timeouts), code, monitors[i])
+        for i, (cells, code) in enumerate(sources)
+        if not cached[i]
+    }
+    results = _execute_concurrently(list(jobs.values()), env)
+    for (i, (notebook, _, monitor)), result in zip(jobs.items(), results, strict=True):
+        notebooks[i] = notebook
+        _report_result(result, document, keys[i], monitor)
+        _report_overflows(monitor.budget, notebook, document)
+
+    return [
+        _render_timed(cast("NotebookNode", notebook), document, monitor, cached=c)
+        for notebook, monitor, c in zip(notebooks, monitors, cached, strict=True)
+    ]
+
+
+def output_budget(env: BuildEnvironment) -> OutputBudget:
+    """Output budget for one of the current document’s notebooks.
+
+    The document’s notebooks share ``exec_jupyter_max_document_output``,
+    e.g. when each directive runs its own notebook.
+    """
+    config = env.config
+    spill_dir = (
+        Path(env.doctreedir) / "exec_jupyter_outputs"
+        if config.exec_jupyter_spill_outputs
+        else None
+    )
+    document = _document_output(env)
+    document.notebooks += 1
+    return OutputBudget(
+        max_cell=config.exec_jupyter_max_cell_output,
+        max_document=config.exec_jupyter_max_document_output,
+        spill_dir=spill_dir,
+        name=env.docname.replace("/", "-"),
+        document=document,
+        notebook=document.notebooks - 1,
     )
 
 
-@contextmanager
-def temp_source_code(
-    document: nodes.document, source_code: str
-) -> Generator[Path, None, None]:
-    """Context manager to temporarily set the current document."""
+def output_options(env: SphinxEnvType) -> dict[str, object]:
+    """Return settings and state that change which outputs an executed notebook keeps.
+
+    They are part of its cache key.
+    """
+    config = env.config
+    options: dict[str, object] = dict(
+        max_cell_output=config.exec_jupyter_max_cell_output,
+        max_document_output=config.exec_jupyter_max_document_output,
+        spill_outputs=config.exec_jupyter_spill_outputs,
+        allow_errors=env.mystnb_config.execution_allow_errors,
+    )
+    if config.exec_jupyter_max_document_output:
+        # the document’s earlier notebooks used up part of its budget
+        options["document_output"] = _document_output(env).size
+    return options
+
+
+def _document_output(env: BuildEnvironment) -> DocumentOutput:
+    return env.current_document.setdefault("exec_jupyter_output", DocumentOutput())
+
+
+def is_cached(env: BuildEnvironment, key: str) -> bool:
+    """Whether the execution cache is enabled and contains ``key``."""
+    return (exec_cache := get_cache(env)) is not None and key in exec_cache
+
+
+def _from_cache(
+    env: BuildEnvironment, key: str, budget: OutputBudget
+) -> NotebookNode | None:
+    """Look up a notebook, charging its outputs to the document’s budget."""
+    if (exec_cache := get_cache(env)) is None:
+        return None
+    notebook = exec_cache.get(key)
+    record_cache_use(env, hit=notebook is not None)
+    if notebook is not None:
+        budget.charge_cached(notebook.metadata.get(OUTPUT_SIZE_KEY, 0))
+    return notebook
+
+
+def _execute_notebook(
+    notebook: NotebookNode,
+    env: SphinxEnvType,
+    *,
+    code: str,
+    monitor: ExecutionMonitor,
+) -> ExecutionResult | None:
+    """Execute a notebook in place like myst_nb would, unless execution is off."""
+    nb_config = env.mystnb_config
+    if nb_config.execution_mode == "off":
+        return None
+
+    pool_size = env.config.exec_jupyter_kernel_pool_size
+    km_class = kernel_manager_class(code, pool_size=pool_size) if code else None
+    with TemporaryDirectory() as cwd, monitor.active():
+        client = notebook_client(
+            notebook, cwd=cwd, nb_config=nb_config, monitor=monitor, km_class=km_class
+        )
+        return run_in_server_loop(execute_notebook(client))
+
+
+def _execute_concurrently(
+    jobs: list[tuple[NotebookNode, str, ExecutionMonitor]], env: SphinxEnvType
+) -> list[ExecutionResult | None]:
+    """Execute notebooks in place with their preload code, all at once."""
+    nb_config = env.mystnb_config
+    if nb_config.execution_mode == "off":
+        return [None] * len(jobs)
+
+    pool_size = env.config.exec_jupyter_kernel_pool_size
+    with ExitStack() as stack:
+        clients = []
+        for notebook, code, monitor in jobs:
+            km_class = kernel_manager_class(code, pool_size=pool_size) if code else None
+            cwd = stack.enter_context(TemporaryDirectory())
+            client = notebook_client(
+                notebook,
+                cwd=cwd,
+                nb_config=nb_config,
+                monitor=monitor,
+                km_class=km_class,
+            )
+            clients.append((client, monitor))
+        return list(run_in_server_loop(_execute_all(clients)))
+
+
+async def _execute_all(
+    clients: list[tuple[NotebookClient, ExecutionMonitor]],
+) -> list[ExecutionResult]:
+    async def execute(
+        client: NotebookClient, monitor: ExecutionMonitor
+    ) -> ExecutionResult:
+        # each task has its own context, so kernel launches report to the right monitor
+        with monitor.active():
+            return await execute_notebook(client)
+
+    return await asyncio.gather(*(execute(*c) for c in clients))
+
+
+def _report_result(
+    result: ExecutionResult | None,
+    document: nodes.document,
+    key: str,
+    monitor: ExecutionMonitor,
+) -> None:
+    """Cache successfully executed notebooks and report failed ones."""
     env = cast("SphinxEnvType", document.settings.env)
-    ext_data = cast(
-        "ExtData", env.current_document.setdefault("sphinx_exec_jupyter", {})
+    if result is None:
+        return
+    if result.err is None:
+        if exec_cache := get_cache(env):
+            result.nb.metadata[OUTPUT_SIZE_KEY] = monitor.budget.size
+            exec_cache.put(key, result.nb)
+        return
+
+    _report_exceeded(result, document, monitor)
+    nb_config = env.mystnb_config
+    if nb_config.execution_raise_on_error:
+        raise ExecutionError(env.docname) from result.err
+    msg = f"Executing notebook failed: {type(result.err).__name__}"
+    if nb_config.execution_show_tb:
+        msg += f"\n{result.exc_string}"
+    SphinxDocLogger(document).warning(msg, subtype="exec")
+
+
+def _report_exceeded(
+    result: ExecutionResult, document: nodes.document, monitor: ExecutionMonitor
+) -> None:
+    """Warn about a cell that failed because it exceeded a limit."""
+    env = cast("SphinxEnvType", document.settings.env)
+    if (index := monitor.timer.last_cell) is None:
+        return
+    cell = result.nb.cells[index]
+    if isinstance(result.err, CellTimeoutError):
+        timeout = cell_timeout(cell, default=env.mystnb_config.execution_timeout)
+        what = f"its timeout of {timeout} seconds"
+    elif monitor.exceeded is not None:
+        what = _LIMIT_DESCRIPTIONS[monitor.exceeded]
+    elif (
+        isinstance(result.err, CellExecutionError)
+        and result.err.ename == "MemoryError"
+        and env.config.exec_jupyter_kernel_max_memory
+    ):
+        what = _LIMIT_DESCRIPTIONS["memory"]
+    else:
+        return
+    source = cell.source.strip().partition("\n")[0]
+    msg = f"Cell {index} ({source!r}) exceeded {what}"
+    SphinxDocLogger(document).warning(msg, subtype="limit")
+
+
+_LIMIT_DESCRIPTIONS: dict[LimitName, str] = {
+    "memory": "the kernel’s memory limit (exec_jupyter_kernel_max_memory)",
+    "cpu_time": "the kernel’s CPU time limit (exec_jupyter_kernel_max_cpu_time)",
+    "wall_time": "the kernel’s wall time limit (exec_jupyter_kernel_max_wall_time)",
+}
+
+
+def _report_overflows(
+    budget: OutputBudget, notebook: NotebookNode, document: nodes.document
+) -> None:
+    """Warn about cells whose outputs were truncated."""
+    for overflow in budget.overflows.values():
+        source = notebook.cells[overflow.cell_index].source.strip().partition("\n")[0]
+        msg = (
+            f"Output of cell {overflow.cell_index} ({source!r}) exceeded "
+            f"the output budget by {overflow.size} characters"
+        )
+        if overflow.path:
+            msg += f", see {overflow.path}"
+        SphinxDocLogger(document).warning(msg, subtype="output")
+
+
+def _render_timed(
+    notebook: NotebookNode,
+    document: nodes.document,
+    monitor: ExecutionMonitor,
+    *,
+    cached: bool,
+) -> list[nodes.Element]:
+    """Render an executed notebook, and record how long its execution took."""
+    env = cast("SphinxEnvType", document.settings.env)
+    monitor.timer.mark()
+    rendered = _render_notebook(notebook, document)
+    monitor.timer.mark("render")
+    record_timings(env, monitor.timer, notebook, cached=cached)
+    record_memory(env, monitor.memory)
+    return rendered
+
+
+def _render_notebook(
+    notebook: NotebookNode, document: nodes.document
+) -> list[nodes.Element]:
+    """Render an executed notebook’s cells to nodes, one per cell.
+
+    The nodes are rendered into a scratch document sharing ``document``’s
+    settings and reporter, so ``document`` itself is left untouched.
+    """
+    env = cast("SphinxEnvType", document.settings.env)
+    nb_config = env.mystnb_config
+    logger = SphinxDocLogger(document)
+    scratch = nodes.document(
+        document.settings, document.reporter, source=document.get("source", "")
     )
-    ext_data["count"] = ext_data.get("count", 0) + 1
-    old_docname = env.docname
-    docname_tmp = f"{old_docname}-exec-{ext_data['count']}"
 
-    d = Path(mkdtemp())
-    path = d / f"{docname_tmp}.ipynb"
-    path.parent.mkdir(parents=True, exist_ok=True)  # when docname contains slashes
-    path.write_text(source_code)
+    # like `myst_nb.sphinx_.Parser.parse`, minus reading and executing
+    mdit_parser = create_md_parser(env.myst_config, _CellsRenderer)
+    mdit_parser.options["document"] = scratch
+    mdit_parser.options["nb_config"] = nb_config
+    mdit_renderer = cast("_CellsRenderer", mdit_parser.renderer)
+    mdit_env: dict[str, object] = {}
+    scratch["nb_renderer"] = load_renderer(nb_config.render_plugin)(
+        mdit_renderer, logger
+    )
+    mdit_renderer.setup_render(mdit_parser.options, mdit_env)
+    tokens = notebook_to_tokens(notebook, mdit_parser, mdit_env, logger)
+    with NotebookClientBase(notebook, None, nb_config, logger) as nb_client:
+        mdit_parser.options["nb_client"] = nb_client
+        mdit_renderer.render(tokens, mdit_parser.options, mdit_env)
+
+    for key, (uri, kwargs) in scratch.attributes.pop("nb_js_files", {}).items():
+        NbMetadataCollector.add_js_file(env, env.docname, key, uri, kwargs)
+    # nodes refer to their document, which must not be the (unpicklable) scratch one
+    for node in scratch.findall(include_self=False):
+        node.document = document
+    return cast("list[nodes.Element]", scratch.children)
+
+
+class _CellsRenderer(SphinxNbRenderer):
+    """Renders only a notebook’s cells, not its metadata.
+
+    Neither front matter nor word counts are added,
+    so the document the cells end up in keeps its own.
+    """
+
+    @override
+    def render_nb_initialise(self, token: SyntaxTreeNode) -> None:
+        pass
+
+    @override
+    def _render_initialise(self) -> None:
+        pass
 
     @override
-    def doc2path(docname: str, base: bool = True) -> Path:
-        if docname == docname_tmp:
-            return path
-        return doc2path_orig(docname, base=base)
-
-    env.current_document.docname = docname_tmp
-    env.doc2path, doc2path_orig = doc2path, env.doc2path
-    old_source, document.current_source = document.current_source, str(path)
-    try:
-        yield path
-    finally:
-        env.current_document.docname = old_docname
-        env.doc2path = doc2path_orig
-        document.current_source = old_source
-        shutil.rmtree(d)
+    def _render_finalise(self) -> None:
+        self.md_env.pop("wordcount", None)
+        super()._render_finalise()
+
+
+def _python_notebook(
+    cells: list[str], kernel_name: str, timeouts: Sequence[int | None] = ()
+) -> NotebookNode:
+    """Create a notebook, storing cell timeouts where `cell_timeout` finds them."""
+    notebook = v4.new_notebook(
+        metadata=NotebookNode(
+            kernelspec=dict(name=kernel_name, display_name="", language="python"),
+            language_info=NotebookNode(name="python"),
+        ),
+        cells=[v4.new_code_cell(cell) for cell in cells],
+    )
+    for cell, timeout in zip(notebook.cells, timeouts, strict=False):
+        if timeout is not None:
+            cell.metadata["exec_jupyter"] = dict(timeout=timeout)
+    return notebook
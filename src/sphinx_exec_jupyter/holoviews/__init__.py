@@ -8,10 +8,17 @@ from typing import TYPE_CHECKING
 
 from sphinx.util.typing import ExtensionMetadata
 
-from ._directive import HoloViewsDirective, HoloViewsDirectiveOptions
+from .._kernel_mgr import prestart_fork_server
+from ._directive import (
+    HoloViewsDirective,
+    HoloViewsDirectiveOptions,
+    clear_resource_urls,
+    hv_preload,
+)
 
 if TYPE_CHECKING:
     from sphinx.application import Sphinx
+    from sphinx.config import Config
 
 __all__ = ["HoloViewsDirective", "HoloViewsDirectiveOptions", "setup"]
 
@@ -20,13 +27,29 @@ def setup(app: Sphinx) -> ExtensionMetadata:
     """Add holoviews-specific directive and setting to Sphinx."""
     app.add_directive("holoviews", HoloViewsDirective)
     app.add_config_value("holoviews_backends", ["bokeh"], "env", {list})
+    app.connect("config-inited", _prestart_fork_servers)
+    app.connect("build-finished", clear_resource_urls)
 
-    # `parallel_read_safe` is `False` because of a race condition in patching myst_nb
-    # the other directive uses only one preload script per run so that’s fine.
-    # See https://github.com/executablebooks/MyST-NB/issues/574
-    # and https://github.com/executablebooks/MyST-NB/issues/643
     return ExtensionMetadata(
         version=version("sphinx-exec-jupyter"),
-        parallel_read_safe=False,
+        parallel_read_safe=True,
         parallel_write_safe=True,
     )
+
+
+def _prestart_fork_servers(app: Sphinx, config: Config) -> None:  # noqa: ARG001
+    """Start importing HoloViews for the default backends, see the main extension.
+
+    Only if this extension was listed explicitly, since it’s loaded whenever
+    HoloViews is installed, and the imports are expensive to waste.
+    """
+    if not config.exec_jupyter_prestart_fork_servers:
+        return
+    if config.nb_execution_mode == "off" or __name__ not in config.extensions:
+        return
+    for backend in config.holoviews_backends:
+        prestart_fork_server(
+            hv_preload([backend], config.exec_jupyter_code),
+            config.exec_jupyter_kernel,
+            config.exec_jupyter_kernel_pool_size,
+        )
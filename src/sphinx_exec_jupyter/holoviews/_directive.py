@@ -1,14 +1,15 @@
 # SPDX-License-Identifier: MPL-2.0
 from __future__ import annotations
 
+import ast
 import json
 from importlib.resources import files
-from itertools import batched
 from typing import TYPE_CHECKING, TypedDict, cast
 
 import holoviews as hv
 from docutils import nodes
 from docutils.parsers.rst import directives
+from myst_nb._compat import get_env_app
 from myst_nb.sphinx_ import NbMetadataCollector
 from panel.io.convert import BOKEH_VERSION
 from panel.io.resources import CDN_DIST
@@ -16,15 +17,19 @@ from sphinx.errors import ExtensionError
 from sphinx.util.docutils import SphinxDirective
 from sphinx_design.shared import create_component
 
-from sphinx_exec_jupyter._kernel_mgr import maybe_patch_myst_nb
 from sphinx_exec_jupyter._pending import PendingExecNode
 
-from ..common import execute_cells
+from .._cache import cache_key, get_cache
+from .._execute import ExecutionMonitor
+from .._kernel_mgr import layered
+from ..common import _execute_notebook, _python_notebook, execute_notebooks
 
 if TYPE_CHECKING:
     from collections.abc import Iterable
 
     from myst_nb.sphinx_ import SphinxEnvType
+    from nbformat import NotebookNode
+    from sphinx.application import Sphinx
 
 __all__ = ["HoloViewsDirective"]
 
@@ -67,40 +72,145 @@ del load_nb, _hv_mpl
 
 
 def hv_preload(backends: Iterable[str], exec_code: str) -> str:
-    return (
-        "import holoviews as hv\n"
-        f"for backend in {json.dumps(sorted(backends))}:\n"
-        f"    hv.extension(backend)\n"
-        f"{HV_PATCH}\n"
-        f"{exec_code}\n"
-        "FAKE_BACKEND = None\n"
+    """Preload code for HoloViews with ``backends``.
+
+    Its layers are shared between backend combinations where possible,
+    e.g. ``{'bokeh', 'plotly'}`` runs only one more layer than ``{'bokeh'}``.
+    ``exec_code`` runs first, so servers for snippets without HoloViews share it.
+    If it uses HoloViews itself (e.g. ``hv.opts.defaults(...)``),
+    it runs after all backends were loaded instead.
+    """
+    hv_layers = [
+        f"import holoviews as hv\n{HV_PATCH}\nFAKE_BACKEND = None\n",
+        *(f"hv.extension({json.dumps(backend)})\n" for backend in sorted(backends)),
+    ]
+    if _uses_holoviews(exec_code):
+        return layered(*hv_layers, exec_code)
+    return layered(exec_code, *hv_layers)
+
+
+def _uses_holoviews(code: str) -> bool:
+    """Check if ``code`` refers to ``hv`` or imports HoloViews."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return True  # let it fail where it always did
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in {"hv", "holoviews"}:
+            return True
+        if isinstance(node, ast.ImportFrom) and node.module:
+            modules = [node.module]
+        elif isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        else:
+            continue
+        if any(module.partition(".")[0] == "holoviews" for module in modules):
+            return True
+    return False
+
+
+class ResourceURLs(TypedDict):
+    js: list[str]
+    css: list[str]
+
+
+#: URLs of the resources bokeh models need, by kernel name and preload code
+_RESOURCE_URLS: dict[tuple[str, str], ResourceURLs] = {}
+
+
+def switch_backend(backend: str) -> str:
+    """Line prepended to a plot cell to render it with ``backend``.
+
+    All backends were loaded by the preload code (see :func:`hv_preload`)
+    and registered with the kernel’s shell when it started,
+    so there is no need for another ``hv.extension`` call.
+    """
+    return f"hv.Store.set_current_backend({backend!r})\n"
+
+
+def resource_urls(code: str, env: SphinxEnvType) -> ResourceURLs:
+    """Collect JS and CSS URLs of all bokeh models loaded by preload ``code``.
+
+    The models are collected once per preload and build, in a kernel of their own,
+    unless the execution cache has them. If that fails, no URLs are returned.
+    Only models imported by the preload are seen, not ones that snippets import.
+    """
+    key = (env.config.exec_jupyter_kernel, code)
+    if (urls := _RESOURCE_URLS.get(key)) is None:
+        urls = ResourceURLs(js=[], css=[])
+        if (notebook := _collect_urls(code, env)) is not None:
+            urls = _parse_urls(notebook) or urls
+        _RESOURCE_URLS[key] = urls
+    return urls
+
+
+def _parse_urls(notebook: NotebookNode) -> ResourceURLs | None:
+    """Parse the URLs that `COLLECT_URLS` printed, ignoring other outputs.
+
+    E.g. deprecation warnings end up in stderr. Returns None if nothing was printed.
+    """
+    stdout = "".join(
+        out.text
+        for out in notebook.cells[0].outputs
+        if out.output_type == "stream" and out.name == "stdout"
     )
+    try:
+        return cast("ResourceURLs", json.loads(stdout.splitlines()[-1]))
+    except (IndexError, ValueError):
+        return None
+
+
+def _collect_urls(code: str, env: SphinxEnvType) -> NotebookNode | None:
+    """Return the notebook that ran `COLLECT_URLS`, or None if that failed."""
+    kernel_name = env.config.exec_jupyter_kernel
+    key = cache_key([COLLECT_URLS], code=code, kernel_name=kernel_name)
+    exec_cache = get_cache(env)
+    if exec_cache is not None and (notebook := exec_cache.get(key)) is not None:
+        return notebook
+    notebook = _python_notebook([COLLECT_URLS], kernel_name)
+    result = _execute_notebook(notebook, env, code=code, monitor=ExecutionMonitor())
+    if result is None or result.err is not None:
+        return None
+    if exec_cache is not None:
+        exec_cache.put(key, notebook)
+    return notebook
+
+
+def clear_resource_urls(app: Sphinx, exc: Exception | None) -> None:  # noqa: ARG001
+    _RESOURCE_URLS.clear()
 
 
 def process_hv_results(
-    results_raw: list[nodes.Element], backends: list[str], env: SphinxEnvType
+    results_raw: list[nodes.Element],
+    backends: list[str],
+    env: SphinxEnvType,
+    *,
+    preloads: Iterable[str],
 ) -> list[nodes.Element]:
-    n_blocks = 3
-    if len(results_raw) != n_blocks * len(backends):
+    """Turn the outputs of each backend’s plot cell into (tabs of) plots.
+
+    ``preloads`` is the preload code the cells were executed with.
+    """
+    if len(results_raw) != len(backends):
         msg = "Unexpected number of outputs from HoloViews execution:\n" + "\n\n".join(
             n.pformat() for n in results_raw
         )
         raise ExtensionError(msg)
 
-    urls: dict[str, list[str]] = {"js": list(JS_URLS), "css": []}
+    urls: ResourceURLs = {"js": list(JS_URLS), "css": []}
+    for code in preloads:
+        new_urls = resource_urls(code, env)
+        urls["js"] += new_urls["js"]
+        urls["css"] += new_urls["css"]
     results: list[nodes.Element] = []
-    for backend, (_header, plot, urls_cell) in zip(
-        backends, batched(results_raw, n_blocks), strict=True
-    ):
-        if len(urls_cell.children) > 1:  # no error happend
-            new_urls = json.loads(urls_cell.children[1].children[0].astext())
-            urls["js"] += new_urls["js"]
-            urls["css"] += new_urls["css"]
-        code = plot.children[0].children[0]
-        assert isinstance(code, nodes.literal_block)
-        code.children[0] = nodes.Text(
-            code.children[0].replace("FAKE_BACKEND", repr(backend))
-        )
+    for backend, plot in zip(backends, results_raw, strict=True):
+        code_node = plot.children[0].children[0]
+        assert isinstance(code_node, nodes.literal_block)
+        source = code_node.astext().removeprefix(switch_backend(backend))
+        source = source.replace("FAKE_BACKEND", repr(backend))
+        # Sphinx only highlights literal blocks whose text matches their source
+        code_node.rawsource = source
+        code_node.children[0] = nodes.Text(source)
         results.append(plot)
 
     for url in urls["js"]:
@@ -109,7 +219,7 @@ def process_hv_results(
     if len(results) == 1:
         return results
 
-    if "sphinx_design" not in env.app.extensions:
+    if "sphinx_design" not in get_env_app(env).extensions:
         msg = "`sphinx_design` extension is required for multiple backends"
         raise ExtensionError(msg)
 
@@ -139,11 +249,13 @@ def choice_list(argument: str, choices: Iterable[str]) -> list[str]:
 
 class HoloViewsDirectiveOptions(TypedDict, total=False):
     backends: list[str]
+    timeout: int
 
 
 class HoloViewsDirective(SphinxDirective):
     option_spec = dict(  # noqa: RUF012
         backends=lambda arg: choice_list(arg, hv.extension._backends),  # noqa: SLF001
+        timeout=directives.nonnegative_int,
     )
     has_content = True
 
@@ -152,21 +264,29 @@ class HoloViewsDirective(SphinxDirective):
     def run(self) -> list[nodes.Node]:
         backends = self.options.get("backends", self.env.config.holoviews_backends)
         code = "\n".join(self.content)
-        cells = [
-            block
-            for backend in backends
-            for block in [f"hv.extension({backend!r})", code, COLLECT_URLS]
-        ]
+        cells = [switch_backend(backend) + code for backend in backends]
+        timeout = self.options.get("timeout")
 
         if self.config.exec_jupyter_isolate_per_document:
-            return [PendingExecNode(cells=cells, hv_backends=list(backends))]
-
-        with maybe_patch_myst_nb(
-            self.config, code=hv_preload(backends, self.config.exec_jupyter_code)
-        ):
-            results_raw = execute_cells(
-                cells, self.state.document, kernel_name=self.config.exec_jupyter_kernel
-            )
+            return [
+                PendingExecNode(
+                    cells=cells, hv_backends=list(backends), timeout=timeout
+                )
+            ]
+
+        # each backend in its own kernel, forked from a server with just that backend
+        preloads = [
+            hv_preload([backend], self.config.exec_jupyter_code) for backend in backends
+        ]
+        results_raw = execute_notebooks(
+            [([cell], preload) for cell, preload in zip(cells, preloads, strict=True)],
+            self.state.document,
+            kernel_name=self.config.exec_jupyter_kernel,
+            timeouts=[timeout],
+        )
         return process_hv_results(
-            results_raw, backends, cast("SphinxEnvType", self.env)
+            [result for results in results_raw for result in results],
+            backends,
+            cast("SphinxEnvType", self.env),
+            preloads=preloads,
         )
@@ -1,5 +1,5 @@
 # SPDX-License-Identifier: MPL-2.0
-"""Mime renderer ignoring HoloViews metadata."""
+"""Mime renderer ignoring HoloViews metadata and sharing identical images."""
 
 from __future__ import annotations
 
@@ -11,6 +11,8 @@ from typing import TYPE_CHECKING, override
 from IPython.core import display
 from myst_nb.core.render import MimeRenderPlugin
 
+from ._assets import render_image
+
 if TYPE_CHECKING:
     from collections.abc import Callable, Mapping
 
@@ -44,16 +46,21 @@ class SEJMimeRenderer(MimeRenderPlugin):
     @override
     def handle_mime(
         renderer: NbElementRenderer, data: MimeData, inline: int
-    ) -> None | list[nodes.Element]:
+    ) -> list[nodes.Element] | None:
         if not inline and data.mime_type in HV_MIME_TYPES:
             return []
-        if not inline and (get_dims := RASTER_IMAGE_DIMS.get(data.mime_type)):
-            [elem] = renderer.render_image(data)
-            if not (elem.attributes.keys() & {"width", "height"}):
-                assert isinstance(data.content, str)
-                data_bytes = b64decode(data.content)
-                width, height = get_dims(data_bytes)
-                elem["width"] = str(width)
-                elem["height"] = str(height)
-            return [elem]
+        if not inline and RASTER_IMAGE_DIMS.get(data.mime_type):
+            return [render_image(renderer, data, _add_dims)]
         return None
+
+
+def _add_dims(elem: nodes.Element, data: MimeData) -> None:
+    """Add an image’s dimensions unless they were specified."""
+    if elem.attributes.keys() & {"width", "height"}:
+        return
+    get_dims = RASTER_IMAGE_DIMS[data.mime_type]
+    assert get_dims is not None
+    assert isinstance(data.content, str)
+    width, height = get_dims(b64decode(data.content))
+    elem["width"] = str(width)
+    elem["height"] = str(height)
@@ -1,9 +1,18 @@
 # SPDX-License-Identifier: MPL-2.0
 from __future__ import annotations
 
+from typing import TYPE_CHECKING
+
 import pytest
 
-from sphinx_exec_jupyter._kernel_mgr import FORK_ENV_VAR
+from sphinx_exec_jupyter._kernel_mgr import (
+    FORK_ENV_VAR,
+    ForkingProvisioner,
+    call_in_server_loop,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Generator
 
 
 @pytest.fixture(autouse=True)
@@ -16,3 +25,13 @@ def _force_fork(monkeypatch: pytest.MonkeyPatch) -> None:
     Tests for the fallback opt back out.
     """
     monkeypatch.setenv(FORK_ENV_VAR, "1")
+
+
+@pytest.fixture(autouse=True)
+def _shutdown_fork_servers() -> Generator[None]:
+    """Shut down fork servers of apps that weren’t built, like a build would.
+
+    E.g. creating a parallel app shares servers from ``config-inited`` on.
+    """
+    yield
+    call_in_server_loop(ForkingProvisioner.SERVERS.shutdown)
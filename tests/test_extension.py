@@ -1,17 +1,31 @@
 # SPDX-License-Identifier: MPL-2.0
 from __future__ import annotations
 
+import json
+import re
 from importlib.util import find_spec
 from itertools import product
 from typing import TYPE_CHECKING
 
+import nbformat
 import pytest
 from docutils import nodes
+from myst_nb.core.render import NbElementRenderer
+from nbformat import v4
+from sphinx.builders import Builder
 from sphinx.testing.util import SphinxTestApp
 
+from sphinx_exec_jupyter import common
+from sphinx_exec_jupyter._blobs import BLOB_ATTR
+from sphinx_exec_jupyter._cache import ExecutionCache
+from sphinx_exec_jupyter._kernel_mgr import KernelForkServer
+from sphinx_exec_jupyter._memory import MIB, KernelMemory
+
 if TYPE_CHECKING:
     from pathlib import Path
 
+    from pytest_mock import MockerFixture
+
 SKIP_NO_HV = pytest.mark.skipif(
     find_spec("holoviews") is None, reason="holoviews not installed"
 )
@@ -111,6 +125,622 @@ def test_holoviews_fake_backend(tmp_path: Path) -> None:
     assert out["text/plain"].astext() == "None\n"
 
 
+@SKIP_NO_HV
+def test_holoviews_exec_code_after_backends(tmp_path: Path) -> None:
+    """Preload code using HoloViews runs once it and the backends are loaded."""
+    rst = """\
+..  holoviews::
+
+    hv.Store.lookup_options("bokeh", hv.Curve([]), "plot").kwargs["width"]
+"""
+    code = "hv.opts.defaults(hv.opts.Curve(width=123))"
+    conf = dict(exec_jupyter_code=code)
+
+    [out] = run(rst, tmp_path, conf=conf).values()
+
+    assert out["text/plain"].astext() == "123"
+
+
+@SKIP_NO_HV
+def test_holoviews_resource_urls(tmp_path: Path, mocker: MockerFixture) -> None:
+    from sphinx_exec_jupyter.holoviews import _directive  # noqa: PLC0415
+
+    rst = """\
+..  holoviews::
+
+    hv.Curve([1, 2])
+
+..  holoviews::
+
+    hv.Curve([3, 4])
+"""
+    conf = dict(exec_jupyter_isolate_per_document=False)
+    collect = mocker.spy(_directive, "_execute_notebook")
+
+    outs = run(rst, tmp_path, conf=conf)
+
+    assert list(outs) == ["hv.Curve([1, 2])", "hv.Curve([3, 4])"]
+    assert all("text/html" in out for out in outs.values())
+    assert collect.call_count == 1, "URLs should be collected once per preload"
+    html = (tmp_path / "_build" / "html" / "index.html").read_text()
+    assert "bokeh-" in html
+
+
+@SKIP_NO_HV
+def test_holoviews_resource_urls_from_stdout(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    from sphinx_exec_jupyter.holoviews import _directive  # noqa: PLC0415
+
+    monkeypatch.setattr(_directive, "_RESOURCE_URLS", {})
+    urls = dict(js=["a.js"], css=[])
+    outputs = [
+        v4.new_output("stream", name="stderr", text="DeprecationWarning: …\n"),
+        v4.new_output("stream", name="stdout", text=json.dumps(urls) + "\n"),
+    ]
+    notebook = v4.new_notebook(cells=[v4.new_code_cell(outputs=outputs)])
+    mocker.patch.object(_directive, "_collect_urls", return_value=notebook)
+    env = mocker.Mock(**{"config.exec_jupyter_kernel": "python3"})
+
+    assert _directive.resource_urls("a", env) == urls
+    notebook.cells[0].outputs = outputs[:1]
+    assert _directive.resource_urls("b", env) == dict(js=[], css=[])
+
+
+@SKIP_NO_HV
+def test_holoviews_cached(tmp_path: Path, mocker: MockerFixture) -> None:
+    rst = """\
+..  holoviews::
+
+    hv.Curve([1, 2])
+"""
+    conf = dict(exec_jupyter_cache=True, exec_jupyter_cache_path=str(tmp_path))
+    execute = mocker.spy(common, "notebook_client")
+
+    calls = []
+    for project in ["a", "b"]:
+        (tmp_path / project).mkdir()
+        run(rst, tmp_path / project, conf=conf)
+        calls.append(execute.call_count)
+
+    assert calls[0] > 0
+    assert calls[1] == calls[0], "second build should start no kernel"
+    html = (tmp_path / "b" / "_build" / "html" / "index.html").read_text()
+    assert "bokeh-" in html
+
+
+@SKIP_NO_HV
+def test_holoviews_backends_in_own_kernels(tmp_path: Path) -> None:
+    rst = """\
+..  holoviews::
+    :backends: bokeh,matplotlib
+
+    import os
+    print(FAKE_BACKEND, hv.Store.current_backend, os.getpid())
+"""
+    conf = dict(
+        extensions=["sphinx_exec_jupyter", "sphinx_design"],
+        exec_jupyter_isolate_per_document=False,
+    )
+
+    outs = run(rst, tmp_path, conf=conf)
+
+    lines = [out["text/plain"].astext().split() for out in outs.values()]
+    assert [line[:2] for line in lines] == [
+        ["None", "bokeh"],
+        ["None", "matplotlib"],
+    ]
+    assert lines[0][2] != lines[1][2], "backends should run in separate kernels"
+
+
+@SKIP_NO_HV
+def test_holoviews_parallel_read(tmp_path: Path) -> None:
+    """Pages with different backends, i.e. preloads, render in parallel reads."""
+    (tmp_path / "conf.py").write_text('extensions = ["sphinx_exec_jupyter"]\n')
+    backends = dict(index="bokeh", mpl="matplotlib")
+    for doc, backend in backends.items():
+        rst = f"""\
+{doc}
+===
+
+..  holoviews::
+    :backends: {backend}
+
+    hv.Curve([1, 2])
+"""
+        (tmp_path / f"{doc}.rst").write_text(rst)
+    app = SphinxTestApp("html", srcdir=tmp_path, parallel=2)
+
+    try:
+        assert "sphinx_exec_jupyter.holoviews" in app.extensions
+        assert app.is_parallel_allowed("read")
+        app.build()
+        htmls = {
+            doc: [
+                node.astext()
+                for node in app.env.get_doctree(doc).findall(nodes.Element)
+                if node.get("mime_type") == "text/html"
+            ]
+            for doc in backends
+        }
+    finally:
+        app.cleanup()
+
+    [bokeh], [mpl] = htmls.values()
+    assert "docs_json" in bokeh, "bokeh plot should be embedded"
+    assert mpl.startswith("<img src='data:image/png"), "matplotlib plot should be a PNG"
+    html = (tmp_path / "_build" / "html" / "index.html").read_text()
+    assert "bokeh-" in html, "resource URLs should survive merging reader envs"
+
+
+def test_parallel_read_shares_fork_server(tmp_path: Path) -> None:
+    (tmp_path / "conf.py").write_text('extensions = ["sphinx_exec_jupyter"]\n')
+    rst = """\
+..  exec-jupyter::
+
+    import os
+    print(os.getpid(), os.getppid())
+"""
+    docs = ["index", "a", "b"]
+    for doc in docs:
+        (tmp_path / f"{doc}.rst").write_text(f"{doc}\n===\n\n{rst}")
+    conf = dict(exec_jupyter_code="import json")
+    app = SphinxTestApp("html", srcdir=tmp_path, confoverrides=conf, parallel=2)
+
+    try:
+        app.build()
+        # the last literal block of each document is its output
+        outputs = [
+            [*app.env.get_doctree(doc).findall(nodes.literal_block)][-1].astext()
+            for doc in docs
+        ]
+    finally:
+        app.cleanup()
+
+    pids, server_pids = zip(*(map(int, out.split()) for out in outputs), strict=True)
+    assert len(set(pids)) == len(docs)
+    assert len(set(server_pids)) == 1, "readers should share the fork server"
+
+
+def test_concurrent_execution(tmp_path: Path) -> None:
+    rst = """\
+..  exec-jupyter::
+
+    x = 21
+
+..  exec-jupyter::
+
+    print(x * 2)
+"""
+
+    _, out = run(rst, tmp_path, conf=dict(exec_jupyter_max_workers=2)).values()
+
+    assert out["text/plain"].astext() == "42\n"
+
+
+def test_concurrent_execution_with_notebooks(tmp_path: Path) -> None:
+    """Notebooks executed by myst-nb share fork servers with scheduled snippets."""
+    rst = """\
+..  exec-jupyter::
+
+    print(x * 2)
+
+..  toctree::
+
+    nb
+"""
+    kernelspec = dict(name="python3", display_name="Python 3", language="python")
+    notebook = v4.new_notebook(
+        cells=[v4.new_code_cell("print(x + 1)")], metadata=dict(kernelspec=kernelspec)
+    )
+    nbformat.write(notebook, tmp_path / "nb.ipynb")
+    conf = dict(exec_jupyter_max_workers=2, exec_jupyter_code="x = 21")
+
+    [out] = run(rst, tmp_path, conf=conf).values()
+
+    assert out["text/plain"].astext() == "42\n"
+    html = (tmp_path / "_build" / "html" / "nb.html").read_text()
+    assert "22" in html
+
+
+def test_concurrent_execution_resolves_finished_first(
+    tmp_path: Path, mocker: MockerFixture
+) -> None:
+    """Documents are written as their notebooks finish, not in the order read."""
+    (tmp_path / "conf.py").write_text('extensions = ["sphinx_exec_jupyter"]\n')
+    (tmp_path / "index.rst").write_text("""\
+..  exec-jupyter::
+
+    import time
+    time.sleep(2)
+
+..  toctree::
+
+    quick
+""")
+    (tmp_path / "quick.rst").write_text("quick\n=====\n\n..  exec-jupyter::\n\n    1\n")
+    conf = dict(exec_jupyter_max_workers=2)
+    write = mocker.spy(Builder, "write_doctree")
+    app = SphinxTestApp("html", srcdir=tmp_path, confoverrides=conf)
+
+    try:
+        app.build()
+    finally:
+        app.cleanup()
+
+    written = [call.args[1] for call in write.call_args_list]
+    assert written == ["index", "quick", "quick", "index"]
+
+
+def test_cache(tmp_path: Path, mocker: MockerFixture) -> None:
+    rst = """\
+..  exec-jupyter::
+
+    print('cached')
+"""
+    conf = dict(exec_jupyter_cache=True, exec_jupyter_cache_path=str(tmp_path))
+    execute = mocker.spy(common, "notebook_client")
+
+    outs = []
+    for project in ["a", "b"]:
+        (tmp_path / project).mkdir()
+        [out] = run(rst, tmp_path / project, conf=conf).values()
+        outs.append(out["text/plain"].astext())
+
+    assert execute.call_count == 1, "second build should have used the cache"
+    assert outs == ["cached\n"] * 2
+
+
+def test_cache_path_relative_to_confdir(
+    tmp_path: Path, mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    rst = """\
+..  exec-jupyter::
+
+    print('cached')
+"""
+    conf = dict(exec_jupyter_cache=True, exec_jupyter_cache_path="../cache")
+    execute = mocker.spy(common, "notebook_client")
+    cwd = tmp_path / "cwd" / "cwd"  # where ../cache isn’t the expected directory
+    cwd.mkdir(parents=True)
+    monkeypatch.chdir(cwd)
+
+    for project in ["a", "b"]:
+        (tmp_path / project).mkdir()
+        run(rst, tmp_path / project, conf=conf)
+
+    assert execute.call_count == 1, "projects should share the cache"
+    assert [*(tmp_path / "cache").glob("*.ipynb")]
+
+
+def test_cache_evicts_once_per_build(tmp_path: Path, mocker: MockerFixture) -> None:
+    rst = """\
+..  exec-jupyter::
+
+    print('a')
+
+..  exec-jupyter::
+
+    print('b')
+"""
+    conf = dict(
+        exec_jupyter_cache=True,
+        exec_jupyter_cache_path=str(tmp_path / "cache"),
+        exec_jupyter_cache_max_size=1,
+        exec_jupyter_isolate_per_document=False,
+    )
+    evict = mocker.spy(ExecutionCache, "evict")
+
+    outs = run(rst, tmp_path, conf=conf)
+
+    assert list(outs) == ["print('a')", "print('b')"]
+    assert evict.call_count == 1
+    assert not [*(tmp_path / "cache").glob("*.ipynb")], "entries exceed the max size"
+
+
+def test_timing_report(tmp_path: Path) -> None:
+    sleep = 0.2
+    rst = f"""\
+..  exec-jupyter::
+
+    import time
+
+..  exec-jupyter::
+
+    time.sleep({sleep})
+"""
+
+    run(rst, tmp_path, conf=dict(exec_jupyter_timing_report=3))
+
+    report = json.loads(
+        (tmp_path / "_build" / "html" / "exec-jupyter-timings.json").read_text()
+    )
+    doc = report["documents"]["index"]
+    assert {"kernel_info", "execute", "render"} <= doc["phases"].keys()
+    slowest = max(doc["cells"], key=lambda cell: cell["seconds"])
+    assert slowest["source"] == f"time.sleep({sleep})"
+    assert slowest["seconds"] >= sleep
+
+
+@pytest.mark.skipif(find_spec("psutil") is None, reason="psutil not installed")
+def test_gc_freeze_memory_report(tmp_path: Path) -> None:
+    (tmp_path / "conf.py").write_text('extensions = ["sphinx_exec_jupyter"]\n')
+    (tmp_path / "index.rst").write_text("""\
+..  exec-jupyter::
+
+    import gc
+
+    print(gc.isenabled(), gc.get_freeze_count() > 0)
+""")
+    conf = dict(
+        exec_jupyter_code="import json",
+        exec_jupyter_gc_freeze=True,
+        exec_jupyter_memory_report=3,
+    )
+    app = SphinxTestApp("html", srcdir=tmp_path, confoverrides=conf)
+
+    try:
+        app.build()
+        doc = app.env.get_doctree("index")
+    finally:
+        app.cleanup()
+
+    [out] = (n for n in doc.findall(nodes.literal_block) if "print" not in n.astext())
+    assert out.astext() == "True True\n", "kernels collect, but not the preload"
+    status = app.status.getvalue()
+    assert "memory of 1 forked kernels" in status
+    assert re.search(r"USS +[\d.]+ MiB, PSS +[\d.]+ MiB, .* RSS: index\n", status)
+
+
+def test_timing_report_accumulates_notebooks(tmp_path: Path) -> None:
+    """Without isolation, each directive’s notebook adds to the document’s timings."""
+    rst = """\
+..  exec-jupyter::
+
+    'first'
+
+..  exec-jupyter::
+
+    'second'
+"""
+    conf = dict(exec_jupyter_timing_report=3, exec_jupyter_isolate_per_document=False)
+
+    run(rst, tmp_path, conf=conf)
+
+    report = json.loads(
+        (tmp_path / "_build" / "html" / "exec-jupyter-timings.json").read_text()
+    )
+    doc = report["documents"]["index"]
+    assert [cell["source"] for cell in doc["cells"]] == ["'first'", "'second'"]
+
+
+def test_memory_report_without_server_rss(
+    tmp_path: Path, mocker: MockerFixture
+) -> None:
+    """Servers that exited before they were measured don’t break the report."""
+    memory = KernelMemory(uss=2 * MIB, pss=3 * MIB, rss=4 * MIB, server_rss=0)
+    mocker.patch("sphinx_exec_jupyter._kernel_mgr.measure_kernel", return_value=memory)
+    (tmp_path / "conf.py").write_text('extensions = ["sphinx_exec_jupyter"]\n')
+    (tmp_path / "index.rst").write_text("..  exec-jupyter::\n\n    1\n")
+    conf = dict(exec_jupyter_code="import json", exec_jupyter_memory_report=3)
+    app = SphinxTestApp("html", srcdir=tmp_path, confoverrides=conf)
+
+    try:
+        app.build()
+    finally:
+        app.cleanup()
+
+    status = app.status.getvalue()
+    assert "(mean USS 2.0 MiB, mean PSS 3.0 MiB), largest:" in status
+
+
+def test_profile_preload(tmp_path: Path) -> None:
+    (tmp_path / "conf.py").write_text('extensions = ["sphinx_exec_jupyter"]\n')
+    (tmp_path / "index.rst").write_text("..  exec-jupyter::\n\n    1\n")
+    code = "import time\nimport email.mime.text\ntime.sleep(0.2)"
+    conf = dict(exec_jupyter_code=code, exec_jupyter_profile_preload=5)
+    app = SphinxTestApp("html", srcdir=tmp_path, confoverrides=conf)
+
+    try:
+        app.build()
+    finally:
+        app.cleanup()
+
+    status = app.status.getvalue()
+    assert re.search(r"preload code 'import time'… of .* took [\d.]+ s", status)
+    assert re.search(r"slowest imports:\n(    .*\n)*.* s  email\.mime\.text\n", status)
+    assert re.search(r"slowest calls:\n .* s  <built-in method time\.sleep>", status)
+
+
+def test_prestart_fork_servers(tmp_path: Path, mocker: MockerFixture) -> None:
+    launch = mocker.spy(KernelForkServer, "launch")
+    (tmp_path / "conf.py").write_text('extensions = ["sphinx_exec_jupyter"]\n')
+    (tmp_path / "index.rst").write_text("..  exec-jupyter::\n\n    os.getppid()\n")
+    conf = dict(exec_jupyter_code="import os")
+    app = SphinxTestApp("html", srcdir=tmp_path, confoverrides=conf)
+
+    try:
+        assert launch.call_count == 1, "server should start before the build"
+        [server] = launch.call_args.args
+        assert (process := server._process) is not None  # noqa: SLF001
+        app.build()
+        doc = app.env.get_doctree("index")
+    finally:
+        app.cleanup()
+
+    [out] = (n for n in doc.findall(nodes.literal_block) if "os" not in n.astext())
+    assert out.astext() == str(process.pid), "kernel should fork from it"
+
+
+def test_output_budget(tmp_path: Path) -> None:
+    rst = """\
+..  exec-jupyter::
+
+    for i in range(1000):
+        print(i, flush=True)
+"""
+    conf = dict(exec_jupyter_max_cell_output=100, exec_jupyter_spill_outputs=True)
+
+    [out] = run(rst, tmp_path, conf=conf).values()
+
+    text = out["text/plain"].astext()
+    assert text.startswith("0\n1\n")
+    assert "output truncated" in text
+    assert "\n999\n" not in text
+    spill_dir = tmp_path / "_build" / "doctrees" / "exec_jupyter_outputs"
+    [spilled] = spill_dir.iterdir()
+    assert spilled.read_text().endswith("998\n999\n")
+
+
+def test_output_budget_per_document(tmp_path: Path) -> None:
+    """Without isolation, a document’s notebooks share its budget and spill files."""
+    rst = """\
+..  exec-jupyter::
+
+    print("a" * 80)
+
+..  exec-jupyter::
+
+    print("b" * 80)
+"""
+    conf = dict(
+        exec_jupyter_isolate_per_document=False,
+        exec_jupyter_max_cell_output=60,
+        exec_jupyter_max_document_output=100,
+        exec_jupyter_spill_outputs=True,
+    )
+
+    first, second = run(rst, tmp_path, conf=conf).values()
+
+    first, second = first["text/plain"].astext(), second["text/plain"].astext()
+    assert first.startswith("a" * 60 + "\n[… output truncated")
+    assert second.startswith("b" * 40 + "\n[… output truncated")
+    spill_dir = tmp_path / "_build" / "doctrees" / "exec_jupyter_outputs"
+    spilled = sorted(path.read_text() for path in spill_dir.iterdir())
+    assert spilled == ["a" * 20 + "\n", "b" * 40 + "\n"]
+
+
+def test_output_budget_rebuilds(tmp_path: Path) -> None:
+    rst = """\
+..  exec-jupyter::
+
+    print("a" * 80)
+"""
+
+    (tmp_path / "conf.py").write_text('extensions = ["sphinx_exec_jupyter"]\n')
+    (tmp_path / "index.rst").write_text(rst)
+
+    outs = []
+    for max_cell_output in [0, 60]:
+        conf = dict(exec_jupyter_max_cell_output=max_cell_output)
+        app = SphinxTestApp("html", srcdir=tmp_path, confoverrides=conf)
+        try:
+            app.build()
+            doc = app.env.get_doctree("index")
+        finally:
+            app.cleanup()
+        [out] = (
+            n for n in doc.findall(nodes.literal_block) if "print" not in n.astext()
+        )
+        outs.append(out.astext())
+
+    assert outs[0] == "a" * 80 + "\n"
+    assert "output truncated" in outs[1], "changed budget should re-read documents"
+
+
+def test_cache_key_covers_output_budget(tmp_path: Path) -> None:
+    rst = """\
+..  exec-jupyter::
+
+    print("a" * 80)
+"""
+    conf: dict[str, object] = dict(
+        exec_jupyter_cache=True, exec_jupyter_cache_path=str(tmp_path / "cache")
+    )
+
+    outs = []
+    for max_cell_output in [0, 60]:
+        conf["exec_jupyter_max_cell_output"] = max_cell_output
+        (tmp_path / str(max_cell_output)).mkdir()
+        [out] = run(rst, tmp_path / str(max_cell_output), conf=conf).values()
+        outs.append(out["text/plain"].astext())
+
+    assert outs[0] == "a" * 80 + "\n"
+    assert "output truncated" in outs[1], "shouldn’t reuse the untruncated output"
+
+
+@pytest.mark.parametrize(
+    ("conf", "option", "code", "limit"),
+    [
+        pytest.param({}, ":timeout: 1", "time.sleep(30)", "timeout of 1", id="timeout"),
+        pytest.param(
+            dict(exec_jupyter_kernel_max_cpu_time=1),
+            "",
+            "while True: pass",
+            "CPU time limit",
+            id="cpu_time",
+        ),
+        pytest.param(
+            dict(exec_jupyter_kernel_max_wall_time=2),
+            "",
+            "time.sleep(30)",
+            "wall time limit",
+            id="wall_time",
+        ),
+        pytest.param(
+            dict(exec_jupyter_kernel_max_memory=2**31),
+            "",
+            "data = bytearray(2**32)",
+            "memory limit",
+            id="memory",
+        ),
+    ],
+)
+def test_kernel_limits(
+    tmp_path: Path, conf: dict[str, object], option: str, code: str, limit: str
+) -> None:
+    (tmp_path / "conf.py").write_text('extensions = ["sphinx_exec_jupyter"]\n')
+    (tmp_path / "index.rst").write_text(f"""\
+..  exec-jupyter::
+
+    import time
+
+..  exec-jupyter::
+    {option}
+
+    {code}
+""")
+    conf = dict(exec_jupyter_code="import sys", **conf)
+    app = SphinxTestApp("html", srcdir=tmp_path, confoverrides=conf)
+
+    try:
+        app.build()
+    finally:
+        app.cleanup()
+
+    warnings = app.warning.getvalue()
+    assert f"index.rst: WARNING: Cell 1 ({code!r}) exceeded" in warnings
+    assert limit in warnings
+
+
+def test_external_outputs(tmp_path: Path) -> None:
+    rst = """\
+..  exec-jupyter::
+
+    from IPython.display import HTML
+    HTML("<b>" + "large" * 100 + "</b>")
+"""
+    conf = dict(exec_jupyter_external_output_size=100)
+
+    [out] = run(rst, tmp_path, conf=conf).values()
+
+    assert out["text/html"].astext() == ""
+    [blob] = (tmp_path / "_build" / "doctrees" / "exec_jupyter_blobs").iterdir()
+    assert blob.stem == out["text/html"][BLOB_ATTR]
+    html = (tmp_path / "_build" / "html" / "index.html").read_text()
+    assert "large" * 100 in html
+
+
 def test_add_image_dimensions(tmp_path: Path) -> None:
     rst = """\
 ..  exec-jupyter::
@@ -128,6 +758,32 @@ def test_add_image_dimensions(tmp_path: Path) -> None:
     assert "height" in out["image/png"].attributes
 
 
+def test_shared_images(tmp_path: Path, mocker: MockerFixture) -> None:
+    png = (
+        "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA"
+        "60e6kgAAAABJRU5ErkJggg=="
+    )
+    rst = f"""\
+..  exec-jupyter::
+
+    from base64 import b64decode
+    from IPython.display import Image
+    Image(b64decode({png!r}))
+
+..  exec-jupyter::
+
+    Image(b64decode({png!r}), metadata={{}})
+"""
+    render = mocker.spy(NbElementRenderer, "render_image")
+
+    outs = run(rst, tmp_path).values()
+
+    first, second = (out["image/png"] for out in outs)
+    assert first["uri"] == second["uri"]
+    assert first["width"] == second["width"] == "1"
+    assert render.call_count == 1, "identical image should be rendered once"
+
+
 def test_mpl_inline_after_warm_preload(tmp_path: Path) -> None:
     """`matplotlib_inline` registration triggered before forking must still
     apply to the real kernel, not just the (discarded) warm-up shell."""
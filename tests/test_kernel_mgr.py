@@ -1,12 +1,15 @@
 # SPDX-License-Identifier: MPL-2.0
 from __future__ import annotations
 
+import ast
 import asyncio
 import json
+import os
+import signal
 import sys
 from contextlib import suppress
 from datetime import UTC, datetime, timedelta
-from types import SimpleNamespace
+from pathlib import Path
 from typing import TYPE_CHECKING, cast
 
 import jupyter_cache.executors.utils as jce
@@ -16,20 +19,21 @@ import pytest
 from sphinx_exec_jupyter._kernel_mgr import (
     FORK_ENV_VAR,
     ForkingProvisioner,
+    ForkServerRegistry,
     KernelForkServer,
+    ServerConnection,
+    call_in_server_loop,
+    layered,
 )
 from sphinx_exec_jupyter._kernel_mgr.myst import patch_myst_nb
 from sphinx_exec_jupyter.common import _python_notebook
 
 if TYPE_CHECKING:
-    from asyncio.subprocess import Process
-    from pathlib import Path
+    from asyncio import StreamReader, StreamWriter
 
     from nbformat_types.versions import current as nbt
     from pytest_mock import MockerFixture
 
-    from sphinx_exec_jupyter._kernel_mgr import Cmd, Resp
-
 
 @pytest.mark.parametrize(
     ("preload", "code", "resp_str"),
@@ -98,30 +102,127 @@ def test_caching() -> None:
     assert times[0] >= times[2] + sleep
 
 
+def test_kernel_pool(mocker: MockerFixture) -> None:
+    take = mocker.spy(KernelForkServer, "take")
+    nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell("pooled")])
+
+    attempts = 2
+    for _attempt in range(attempts):
+        with patch_myst_nb("pooled = 'yes'", pool_size=1):
+            node = cast("nbt.Document", jce.executenb(nb))
+
+    assert take.call_count == attempts
+    assert take.spy_return is not None, "second kernel should come from the pool"
+    [code_cell] = node["cells"]
+    [result] = code_cell["outputs"]
+    assert result["data"]["text/plain"] == "'yes'"
+
+
+@pytest.mark.parametrize("pool_size", [0, 1])
+def test_ipc_transport(pool_size: int) -> None:
+    code = "(app := IPKernelApp.instance()).transport, app.ip"
+    nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(code)])
+
+    # with a pool, the second kernel comes from it
+    for _attempt in range(1 + pool_size):
+        with patch_myst_nb(
+            "from ipykernel.kernelapp import IPKernelApp", pool_size=pool_size
+        ):
+            node = cast("nbt.Document", jce.executenb(nb))
+
+    [code_cell] = node["cells"]
+    [result] = code_cell["outputs"]
+    transport, ip = ast.literal_eval(result["data"]["text/plain"])
+    assert transport == "ipc"
+    assert Path(ip).parent.name.startswith("sej-ipc-"), "should be the build’s"
+    assert not list(Path(ip).parent.glob(f"{Path(ip).name}-*")), "not cleaned up"
+
+
+def test_layered_preload(mocker: MockerFixture) -> None:
+    spawn = mocker.spy(KernelForkServer, "_spawn")
+    nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell("extra")])
+
+    with patch_myst_nb(layered("base = 1", "extra = base + 1")):
+        node = cast("nbt.Document", jce.executenb(nb))
+
+    assert spawn.call_count == 1, "second layer should be forked from the first"
+    [code_cell] = node["cells"]
+    [result] = code_cell["outputs"]
+    assert result["data"]["text/plain"] == "2"
+
+
+@pytest.mark.parametrize("pool_size", [0, 1])
+def test_fork_server_daemon(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    request: pytest.FixtureRequest,
+    pool_size: int,
+) -> None:
+    monkeypatch.setenv("JUPYTER_RUNTIME_DIR", str(tmp_path))
+    monkeypatch.setattr(ForkingProvisioner.SERVERS, "daemon_timeout", 30)
+    nb = nbformat.v4.new_notebook(
+        cells=[nbformat.v4.new_code_cell("import os; os.getppid()")]
+    )
+
+    daemons = []
+    for _attempt in range(2):
+        # with a pool, kernels pooled for the first build can’t be used in the second
+        with patch_myst_nb(f"# {request.node.name}", pool_size=pool_size):
+            node = cast("nbt.Document", jce.executenb(nb))
+        call_in_server_loop(ForkingProvisioner.SERVERS.shutdown)
+        [code_cell] = node["cells"]
+        [result] = code_cell["outputs"]
+        daemons.append(int(result["data"]["text/plain"]))
+        assert [*tmp_path.glob("*/*.sock")], "daemon should keep running"
+
+    os.kill(daemons[0], signal.SIGTERM)
+    assert daemons[0] == daemons[1], "second build should reuse the daemon"
+
+
+def test_fork_server_registry_evicts_lru() -> None:
+    max_servers = 2
+    registry = ForkServerRegistry(max_servers=max_servers)
+    for code in ["a", "b", "a", "c"]:
+        registry.release(registry.get((), code))
+
+    assert len(registry) == max_servers
+    assert ((), "a") in registry, "recently used server should be kept"
+    assert ((), "b") not in registry
+
+
+def test_fork_server_registry_max_memory(mocker: MockerFixture) -> None:
+    rss = 100
+    mocker.patch.object(KernelForkServer, "rss", return_value=rss)
+    kept = 2
+    registry = ForkServerRegistry(max_memory=int((kept + 0.5) * rss))
+    leased = registry.get((), "a")
+    for code in ["b", "c", "d"]:
+        registry.release(registry.get((), code))
+
+    assert len(registry) == kept
+    assert ((), "a") in registry, "leased server should be kept"
+    assert ((), "d") in registry
+    registry.release(leased)
+
+
 async def test_fork_server_concurrent_calls_dont_cross_talk() -> None:
     """Concurrent `fork`/`wait` calls on a shared `KernelForkServer` must not read
     each other’s replies off the pipe.
 
-    The fake server below always replies in the order it received commands,
-    exactly like the real one (`fork-server.py`) does.
-    It replies to `fork` slower than to `wait`, so we trigger a race condition:
-    Without lock, `fork()`→`wait()` results in switched replies,
-    i.e. a `fork()` reads back `{"code": ...}` and crashes with `KeyError: 'pid'`.
+    Like the real one (`fork-server.py`), the fake server below replies out of order:
+    It answers `wait` before the `fork` that was sent first,
+    so matching replies by order would make the `fork()` read back `{"code": ...}`
+    and crash with `KeyError: 'pid'`.
     """
-    cmd_queue: asyncio.Queue[Cmd] = asyncio.Queue()
-    resp_queue: asyncio.Queue[Resp] = asyncio.Queue()
-    last_cmd: str | None = None
+    cmd_queue: asyncio.Queue[dict[str, object]] = asyncio.Queue()
+    resp_queue: asyncio.Queue[dict[str, object]] = asyncio.Queue()
 
     class FakeStdin:
         def write(self, data: bytes) -> None:
-            nonlocal last_cmd
-            msg = json.loads(data)
-            last_cmd = msg["cmd"]
-            cmd_queue.put_nowait(msg)
+            cmd_queue.put_nowait(json.loads(data))
 
         async def drain(self) -> None:
-            if last_cmd == "fork":  # simulate `os.fork()` taking a moment
-                await asyncio.sleep(0.05)
+            pass
 
     class FakeStdout:
         async def readline(self) -> bytes:
@@ -129,23 +230,21 @@ async def test_fork_server_concurrent_calls_dont_cross_talk() -> None:
             return (json.dumps(resp) + "\n").encode()
 
     async def fake_fork_server() -> None:
-        next_pid = 1
-        while True:
-            cmd = await cmd_queue.get()
-            if cmd["cmd"] == "fork":
-                await resp_queue.put({"pid": next_pid})
-                next_pid += 1
-            else:
-                await resp_queue.put({"code": 0})
+        fork = await cmd_queue.get()
+        wait = await cmd_queue.get()
+        assert (fork["cmd"], wait["cmd"]) == ("fork", "wait")
+        await resp_queue.put({"id": wait["id"], "code": 0})
+        await resp_queue.put({"id": fork["id"], "pid": 1})
 
     server = KernelForkServer(py_cmd=(), code="")
-    fake_process = SimpleNamespace(
-        stdin=FakeStdin(), stdout=FakeStdout(), stderr=None, returncode=None
+    server.conn = ServerConnection(
+        pid=0,
+        reader=cast("StreamReader", FakeStdout()),
+        writer=cast("StreamWriter", FakeStdin()),
     )
-    server.process = cast("Process", fake_process)
     server_task = asyncio.create_task(fake_fork_server())
     try:
-        fork_task = asyncio.create_task(server.fork(["ignored"], "log.txt"))
+        fork_task = asyncio.create_task(server.fork(["ignored"]))
         wait_task = asyncio.create_task(server.wait(123))
         results = await asyncio.gather(fork_task, wait_task, return_exceptions=True)
         assert results == [1, 0]
@@ -155,6 +254,23 @@ async def test_fork_server_concurrent_calls_dont_cross_talk() -> None:
             await server_task
 
 
+def test_fork_server_bound_to_loop() -> None:
+    server = KernelForkServer(py_cmd=(sys.executable,), code="")
+
+    async def close() -> None:
+        server.close()
+        await asyncio.sleep(0)  # the transports close their pipes in the loop
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(server.start())
+        with pytest.raises(RuntimeError, match="bound to another event loop"):
+            asyncio.run(server.start())
+    finally:
+        loop.run_until_complete(close())
+        loop.close()
+
+
 def test_python_interpreter_flags(
     monkeypatch: pytest.MonkeyPatch, tmp_path: Path
 ) -> None:
@@ -175,3 +291,35 @@ def test_python_interpreter_flags(
     nb = _python_notebook(["1 + 1"], "python3-frozen")
     with patch_myst_nb(""):
         jce.executenb(nb)
+
+
+async def test_fork_server_relays_output_of_failed_kernels() -> None:
+    server = KernelForkServer(py_cmd=(sys.executable,), code="")
+    codes = {}
+    try:
+        for code in [0, 3]:
+            exit_ = f"import os; os.write(2, b'boom'); os._exit({code})"
+            pid = await server.fork([f"--IPKernelApp.exec_lines={[exit_]!r}"])
+            codes[pid] = await server.wait(pid)
+    finally:
+        server.close()
+        if server.conn is not None and server.conn.process is not None:
+            server.conn.process.wait()
+
+    [failed] = (pid for pid, code in codes.items() if code)
+    assert server.outputs.keys() == {failed}, "only failed kernels report output"
+    assert server.outputs[failed].endswith("boom")
+
+
+async def test_fork_server_forgets_reported_exit_codes() -> None:
+    server = KernelForkServer(py_cmd=(sys.executable,), code="")
+    exit_code = 3
+    try:
+        exit_ = f"import os; os._exit({exit_code})"
+        pid = await server.fork([f"--IPKernelApp.exec_lines={[exit_]!r}"])
+        assert await server.wait(pid) == exit_code
+        assert await server.get_exit_code(pid) is None, "should be forgotten"
+    finally:
+        server.close()
+        if server.conn is not None and server.conn.process is not None:
+            server.conn.process.wait()